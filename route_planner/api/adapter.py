@@ -1,12 +1,30 @@
-from typing import Iterator, Any
+import asyncio
+import contextlib
+import contextvars
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Any
 import folium
 from dataclasses import dataclass
-from openrouteservice.exceptions import ApiError
+from openrouteservice.exceptions import ApiError, HTTPError, Timeout
 
+from django.conf import settings
 from django.core.files.storage import default_storage, Storage
 
-from .aliases import Point, BoundingBox, Route, Routes, ORSPoint, GeoJson
-from .ors import find_routes as ors_find_routes, extract_points as ors_extract_points
+from .aliases import Point, BoundingBox, Matrix, Route, Routes
+from .cache import directions_cache, matrix_cache
+from .matrix import CostMatrix, Tile
+from .singleflight import directions_flight
+from .quota import current_priority
+from .routing import routing_backend
+from .snapping import point_snapper, Unroutable
+from .ors import (
+    extract_coordinates as ors_extract_coordinates,
+    extract_coordinates_many as ors_extract_coordinates_many,
+)
+from .polyline import Coordinates
+from .rendering import render_map
 
 
 class ORSException(Exception):
@@ -21,6 +39,20 @@ class ORSException(Exception):
         self.data = data
         self.status = status
 
+    @property
+    def upstream_failed(self) -> bool:
+        """ORS is failing (rate limited, unavailable or timed out), the request itself may be valid."""
+        return self.status == 429 or self.status >= 500
+
+
+def upstream_exception(exc: Exception) -> ORSException:
+    """It converts error of ORS call to `ORSException`."""
+    if isinstance(exc, ApiError):
+        return ORSException(exc.status, "ors_exception", "Open Route Service exception", exc.message)
+    if isinstance(exc, Timeout):
+        return ORSException(504, "ors_timeout", "Open Route Service timeout", None)
+    return ORSException(502, "ors_exception", "Open Route Service exception", str(exc))
+
 
 @dataclass
 class File:
@@ -28,18 +60,125 @@ class File:
     name: str
     size: int
 
-    def __init__(self, filename: str, created_map: folium.Map, storage: Storage | None = None):
+    def __init__(
+        self, filename: str, created_map: folium.Map, storage: Storage | None = None, exact_name: bool = False
+    ):
         self._storage: Storage = storage if storage is not None else default_storage
         self._map: folium.Map = created_map
-        self.name = self._storage.get_available_name(filename)
-        with self._storage.open(self.name, "wb") as file_handler:
-            self._map.save(file_handler, close_file=False)
-            self.size = file_handler.tell()
-            self.url = self._storage.url(self.name)
+        self.name = filename if exact_name else self._storage.get_available_name(filename)
+        self._write(render_map(self._map))
+
+    def _write(self, chunks: Iterable[bytes]):
+        path: str | None = self._local_path()
+        if path is None:
+            # remote storage uploads the file when it is closed, so partial file is never visible
+            with self._storage.open(self.name, "wb") as file_handler:
+                self.size = self._write_chunks(file_handler, chunks)
+        else:
+            self._write_atomically(path, chunks)
+        self.url = self._storage.url(self.name)
+
+    def _local_path(self) -> str | None:
+        try:
+            return self._storage.path(self.name)
+        except NotImplementedError:
+            # storage without local file system
+            return None
+
+    @staticmethod
+    def _write_chunks(file_handler: Any, chunks: Iterable[bytes]) -> int:
+        for chunk in chunks:
+            file_handler.write(chunk)
+        return file_handler.tell()
+
+    def _write_atomically(self, path: str, chunks: Iterable[bytes]):
+        """It writes the file under temporary name in the same directory and then it renames it, so that
+        other processes (and workers after crash) never see partially written file under its final name.
+        """
+        # storage creates directories in `save`, but not in `open`
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary: str = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(temporary, "xb") as file_handler:
+                self.size = self._write_chunks(file_handler, chunks)
+            permissions: int | None = getattr(self._storage, "file_permissions_mode", None)
+            if permissions is not None:
+                os.chmod(temporary, permissions)
+            os.replace(temporary, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(temporary)
+            raise
+
+    @classmethod
+    def from_chunks(cls, name: str, chunks: Iterable[bytes], storage: Storage | None = None) -> "File":
+        """It stores already rendered content (e.g. composed map) under the exact name.
+
+        Args:
+            name: name of the file in the storage
+            chunks: content of the file
+            storage: storage of the file
+
+        Returns:
+            stored file
+        """
+        file: File = cls.__new__(cls)
+        file._storage = storage if storage is not None else default_storage
+        file.name = name
+        file._write(chunks)
+        return file
+
+    @classmethod
+    def stored(cls, name: str, storage: Storage | None = None) -> "File":
+        """It creates instance of already stored file (without rendering).
+
+        Args:
+            name: name of the file in the storage
+            storage: storage of the file
+
+        Returns:
+            stored file
+        """
+        file: File = cls.__new__(cls)
+        file._storage = storage if storage is not None else default_storage
+        file.name = name
+        file.size = file._storage.size(name)
+        file.url = file._storage.url(name)
+        return file
 
 
 def find_routes(start: Point, finish: Point) -> Routes:
-    """It is just adapter to prepare input parameters for ORS call from validated data
+    """It is just adapter to prepare input parameters for ORS call from validated data,
+    already found routes are served from the directions cache and concurrent lookups
+    of the same route (with the same priority, see `ors_priority`) share one ORS call.
+    Start and finish are snapped to the nearest road first (if it is enabled), so unroutable points do not reach ORS.
+
+    Args:
+       start: starting point route coordinates
+       finish: ending point route coordinates
+
+    Returns:
+       list of routes (more structured)
+    """
+    start, finish = snap(start, finish)
+    key: str = directions_cache.key(routing_backend.profile, start, finish)
+    routes: Routes | None = directions_cache.get(key)
+    if routes is None:
+
+        def request_and_cache() -> Routes:
+            try:
+                found_routes: Routes = request_routes(start, finish)
+            except ORSException as exc:
+                return stale_routes(exc, directions_cache.get_stale(key) if exc.upstream_failed else None)
+            directions_cache.set(key, found_routes)
+            return found_routes
+
+        routes = directions_flight.do(flight_key(key), request_and_cache)
+    return routes
+
+
+async def afind_routes(start: Point, finish: Point) -> Routes:
+    """Async version of `find_routes`.
 
     Args:
        start: starting point route coordinates
@@ -48,93 +187,197 @@ def find_routes(start: Point, finish: Point) -> Routes:
     Returns:
        list of routes (more structured)
     """
-    coordinates: BoundingBox = (
+    start, finish = snap(start, finish)
+    key: str = directions_cache.key(routing_backend.profile, start, finish)
+    routes: Routes | None = await directions_cache.aget(key)
+    if routes is None:
+
+        async def request_and_cache() -> Routes:
+            try:
+                found_routes: Routes = await arequest_routes(start, finish)
+            except ORSException as exc:
+                return stale_routes(exc, await directions_cache.aget_stale(key) if exc.upstream_failed else None)
+            await directions_cache.aset(key, found_routes)
+            return found_routes
+
+        routes = await directions_flight.ado(flight_key(key), request_and_cache)
+    return routes
+
+
+def flight_key(key: str) -> str:
+    """It returns key of shared ORS call of the route - callers of different priorities do not share the call,
+    so that interactive request does not wait for quota as long as a batch or warm-up would (see `QuotaScheduler`)."""
+    return f"{key}:{current_priority()}"
+
+
+def stale_routes(exc: ORSException, stale: Routes | None) -> Routes:
+    """It returns expired routes when ORS fails (they are better than no routes), otherwise it raises the exception.
+
+    Args:
+       exc: failure of ORS call
+       stale: expired routes from the cache
+
+    Returns:
+       the expired routes
+    """
+    if stale is None:
+        raise exc
+    return stale
+
+
+def snap(start: Point, finish: Point) -> tuple[Point, Point]:
+    """It snaps start and finish to the nearest road and rounds them for the cache key.
+
+    Args:
+       start: starting point route coordinates
+       finish: ending point route coordinates
+
+    Returns:
+       start and finish
+    """
+    try:
+        start, finish = point_snapper.snap_all(start, finish)
+    except Unroutable as exc:
+        raise ORSException(404, "ors_exception", "Open Route Service exception", exc.error)
+    return directions_cache.quantize(start), directions_cache.quantize(finish)
+
+
+def ors_coordinates(start: Point, finish: Point) -> BoundingBox:
+    return (
         (
             start.long,
             start.lat,
         ),
         (finish.long, finish.lat),
     )
+
+
+def request_routes(start: Point, finish: Point) -> Routes:
+    """It calls routing backend (ORS) directly (without cache).
+
+    Args:
+       start: starting point route coordinates
+       finish: ending point route coordinates
+
+    Returns:
+       list of routes (more structured)
+    """
     try:
-        return ors_find_routes(coordinates)["routes"]
-    except ApiError as exc:
-        raise ORSException(exc.status, "ors_exception", "Open Route Service exception", exc.message)
+        return routing_backend.find_routes(ors_coordinates(start, finish))["routes"]
+    except (ApiError, HTTPError, Timeout) as exc:
+        raise upstream_exception(exc)
 
 
-def extract_points(route: Route) -> GeoJson:
-    """It extracts GeoJson structure from polyline - encoded string.
+async def arequest_routes(start: Point, finish: Point) -> Routes:
+    """Async version of `request_routes`.
 
     Args:
-        route: found route created by ORS
+       start: starting point route coordinates
+       finish: ending point route coordinates
+
+    Returns:
+       list of routes (more structured)
+    """
+    try:
+        return (await routing_backend.afind_routes(ors_coordinates(start, finish)))["routes"]
+    except (ApiError, HTTPError, Timeout) as exc:
+        raise upstream_exception(exc)
+
+
+def find_matrix(sources: list[Point], destinations: list[Point]) -> Matrix:
+    """It finds distances and durations from all sources to all destinations, cells are served from
+    the matrix cache and the missing ones are requested from routing backend in concurrent tiles.
+
+    Args:
+       sources: source points
+       destinations: destination points
 
     Returns:
-        GeoJson structure
+       distances (meters) and durations (seconds), None if there is no route
     """
-    polyline: str = route["geometry"]
-    return ors_extract_points(polyline)
+    matrix = CostMatrix(sources, destinations, settings.ROUTE_MATRIX["tile_size"], routing_backend.profile)
+    matrix.cached(matrix_cache.get_many(matrix.keys.values()))
+    tiles: list[Tile] = matrix.tiles()
+
+    def find_tile(tile: Tile) -> Matrix:
+        return routing_backend.find_matrix(*matrix.coordinates(tile))
 
+    try:
+        with ThreadPoolExecutor(max_workers=settings.ROUTE_MATRIX["concurrency"]) as executor:
+            # every tile runs in copy of the context, so that its upstream call is counted to the request
+            futures = [executor.submit(contextvars.copy_context().run, find_tile, tile) for tile in tiles]
+            found: list[Matrix] = [future.result() for future in futures]
+    except (ApiError, HTTPError, Timeout) as exc:
+        raise upstream_exception(exc)
+    for tile, tile_matrix in zip(tiles, found):
+        matrix_cache.set_many(matrix.fill(tile, tile_matrix))
+    return matrix.result()
 
-def geojson_iterable(geo_json: GeoJson, reverse: bool = True) -> Iterator[ORSPoint]:
-    """It is not just generator of coordinates from ORS service,
-    but it can reverse lat with long also.
+
+async def afind_matrix(sources: list[Point], destinations: list[Point]) -> Matrix:
+    """Async version of `find_matrix`.
 
     Args:
-        geo_json: it contains decoded polyline as list of ORS coordinates
-        reverse: default true -> switch lat with long
+       sources: source points
+       destinations: destination points
+
+    Returns:
+       distances (meters) and durations (seconds), None if there is no route
+    """
+    matrix = CostMatrix(sources, destinations, settings.ROUTE_MATRIX["tile_size"], routing_backend.profile)
+    matrix.cached(await matrix_cache.aget_many(matrix.keys.values()))
+    tiles: list[Tile] = matrix.tiles()
+    semaphore = asyncio.Semaphore(settings.ROUTE_MATRIX["concurrency"])
+
+    async def find_tile(tile: Tile) -> Matrix:
+        async with semaphore:
+            return await routing_backend.afind_matrix(*matrix.coordinates(tile))
+
+    try:
+        found: list[Matrix] = await asyncio.gather(*(find_tile(tile) for tile in tiles))
+    except (ApiError, HTTPError, Timeout) as exc:
+        raise upstream_exception(exc)
+    for tile, tile_matrix in zip(tiles, found):
+        await matrix_cache.aset_many(matrix.fill(tile, tile_matrix))
+    return matrix.result()
+
+
+def extract_coordinates(route: Route) -> Coordinates:
+    """It extracts coordinates from polyline - encoded string.
+
+    Args:
+        route: found route created by ORS
 
     Returns:
-        generator of ORS coordinates
+        array of (long, lat) coordinates
     """
-    if reverse:
-        yield from map(
-            lambda osr_point: osr_point.reverse() or osr_point, geo_json["coordinates"]  # type: ignore[func-returns-value]  # noqa: [E501]
-        )
-    else:
-        yield from geo_json["coordinates"]
+    return ors_extract_coordinates(route["geometry"])
 
 
-def create_map_from_geojson(
-    geojson: GeoJson, title: str, route_title: str, created_map: folium.Map | None = None
-) -> folium.Map:
-    """It creates HTML map with route which is passed via geojson string.
-     Map title and route title can be set.
+def extract_coordinates_many(routes: Routes) -> list[Coordinates]:
+    """It extracts coordinates of all routes in one pass.
 
     Args:
-        geojson: GeoJson structure
-        title: map title
-        route_title: route tooltip
-        created_map: instance of folium.Map class
+        routes: found routes created by ORS
 
     Returns:
-        created map
+        list of arrays of (long, lat) coordinates
     """
-    if created_map is None:
-        created_map = folium.Map(title=title)
-    gj_iterable = geojson_iterable(geojson)
-    drawn_polyline: folium.PolyLine = folium.PolyLine(gj_iterable, tooltip=route_title)
-    created_map.add_child(drawn_polyline)
-    created_map.fit_bounds(drawn_polyline.get_bounds())
-    return created_map
+    return ors_extract_coordinates_many([route["geometry"] for route in routes])
 
 
-def create_map(
-    start: Point, finish: Point, title: str = "Found routes", route_title: str = "Driving path"
-) -> folium.Map:
-    """It creates HTML map with route found from start to finish points.
-     Map title and route title can be set.
+def routes_bounds(routes: Routes) -> list[list[float]] | None:
+    """It computes bounds of all routes in one pass over bounding boxes precomputed by ORS.
 
     Args:
-        start: start of the route
-        finish: end of the route
-        title: title of the map
-        route_title: title of the route
+        routes: found routes
 
     Returns:
-        generated HTML map
+        [[south, west], [north, east]] or None if there are no routes
     """
-    created_map = folium.Map(title=title)
-    routes: Routes = find_routes(start, finish)
-    for route in routes:
-        geojson: GeoJson = extract_points(route)
-        create_map_from_geojson(geojson, title, route_title, created_map)
-    return created_map
+    if not routes:
+        return None
+    # bbox is [west, south, east, north], elevations follow both corners in 3D routes
+    corners = [bbox[:2] + bbox[3:5] if len(bbox) == 6 else bbox for bbox in (route["bbox"] for route in routes)]
+    west, south, east, north = zip(*corners)
+    return [[min(south), min(west)], [max(north), max(east)]]
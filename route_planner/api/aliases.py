@@ -54,6 +54,12 @@ class Directions(TypedDict):
     metadata: None
 
 
+class Matrix(TypedDict):
+    # meters and seconds by source (row) and destination (column), None if there is no route
+    distances: list[list[float | None]]
+    durations: list[list[float | None]]
+
+
 ORSPoint: TypeAlias = list[float]
 
 
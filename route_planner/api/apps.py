@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from .routing import routing_backend
+        from .snapping import point_snapper
+        from .fuel import fuel_stations
+
+        # files of local road graph are mapped once per worker (or once in master with `--preload`)
+        routing_backend.load()
+        point_snapper.load()
+        fuel_stations.load()
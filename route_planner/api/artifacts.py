@@ -0,0 +1,155 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+import typing
+
+import folium
+from django.conf import settings
+from django.core.files.storage import default_storage, Storage
+
+from .adapter import File
+from .singleflight import SingleFlight
+
+
+logger = logging.getLogger(__name__)
+
+
+class MapArtifacts:
+    """Content addressed store of rendered maps. Map is stored under hash of everything it is rendered from,
+    so the same map is rendered only once and then it is reused. Background sweeper keeps the store within
+    size and age budget.
+
+    Args:
+        prefix: directory of maps within the storage
+        max_bytes: max. total size of stored maps (0 = unlimited)
+        max_age: max. age of stored map in seconds (0 = unlimited)
+        sweep_interval: seconds between two sweeps
+        storage: storage of maps
+    """
+
+    def __init__(
+        self,
+        prefix: str = "maps",
+        max_bytes: int = 0,
+        max_age: int = 0,
+        sweep_interval: int = 600,
+        storage: Storage | None = None,
+    ):
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.sweep_interval = sweep_interval
+        self._storage = storage
+        self._renders = SingleFlight()
+        self._sweeper: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def storage(self) -> Storage:
+        return self._storage if self._storage is not None else default_storage
+
+    @staticmethod
+    def digest(*parts: str | bytes) -> str:
+        """It hashes everything the map is rendered from (geometry, titles, render options).
+
+        Args:
+            parts: parts of the map
+
+        Returns:
+            hex digest
+        """
+        digest = hashlib.sha256(folium.__version__.encode())
+        for part in parts:
+            data: bytes = part.encode("utf8") if isinstance(part, str) else part
+            digest.update(len(data).to_bytes(8, "little"))
+            digest.update(data)
+        return digest.hexdigest()[:40]
+
+    def name(self, digest: str, filename: str) -> str:
+        return f"{self.prefix}/{digest}/{os.path.basename(filename)}"
+
+    def get_or_render(self, digest: str, filename: str, render: typing.Callable[[], folium.Map]) -> File:
+        """It returns already stored map or it renders and stores the map.
+
+        Args:
+            digest: hash of the map (see `digest`)
+            filename: filename of the map
+            render: it creates the map
+
+        Returns:
+            stored map
+        """
+        return self.get_or_write(digest, filename, lambda name: File(name, render(), self.storage, exact_name=True))
+
+    def get_or_write(self, digest: str, filename: str, write: typing.Callable[[str], File]) -> File:
+        """It returns already stored artifact or it stores the artifact (e.g. composed map, see `composition`).
+
+        Args:
+            digest: hash of the artifact
+            filename: filename of the artifact
+            write: it stores the artifact under given name
+
+        Returns:
+            stored artifact
+        """
+        self.start_sweeper()
+        name: str = self.name(digest, filename)
+        if self.storage.exists(name):
+            return File.stored(name, self.storage)
+        # concurrent requests of the same artifact wait for the first one
+        return self._renders.do(name, lambda: write(name))
+
+    def artifacts(self) -> typing.Iterator[tuple[str, float, int]]:
+        """It lists stored maps as (name, modified timestamp, size)."""
+        if not self.storage.exists(self.prefix):
+            return
+        for directory in self.storage.listdir(self.prefix)[0]:
+            for filename in self.storage.listdir(f"{self.prefix}/{directory}")[1]:
+                name = f"{self.prefix}/{directory}/{filename}"
+                yield name, self.storage.get_modified_time(name).timestamp(), self.storage.size(name)
+
+    def sweep(self) -> int:
+        """It deletes maps older than `max_age` and the oldest maps over `max_bytes`.
+
+        Returns:
+            number of deleted maps
+        """
+        artifacts = sorted(self.artifacts(), key=lambda artifact: artifact[1], reverse=True)
+        oldest: float = time.time() - self.max_age if self.max_age else 0.0
+        total: int = 0
+        deleted: int = 0
+        for name, modified, size in artifacts:
+            total += size
+            if modified < oldest or (self.max_bytes and total > self.max_bytes):
+                self.delete(name)
+                deleted += 1
+        return deleted
+
+    def delete(self, name: str):
+        self.storage.delete(name)
+        try:
+            # empty directory of the map (file system storage)
+            self.storage.delete(os.path.dirname(name))
+        except OSError:
+            pass
+
+    def start_sweeper(self):
+        if not (self.max_bytes or self.max_age) or self._sweeper is not None:
+            return
+        with self._lock:
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(target=self._sweep_forever, name="map-artifacts-sweeper", daemon=True)
+                self._sweeper.start()
+
+    def _sweep_forever(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Sweeping of map artifacts failed.")
+            time.sleep(self.sweep_interval)
+
+
+map_artifacts = MapArtifacts(**settings.MAP_ARTIFACTS)
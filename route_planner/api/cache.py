@@ -0,0 +1,268 @@
+import threading
+import time
+import typing
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.cache import caches, BaseCache
+
+from .aliases import Point, Routes
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    local_hits: int = 0
+    backend_hits: int = 0
+    evictions: int = 0
+
+
+class LRUCache:
+    """In-process tier - the least recently used entries are evicted first,
+    every entry expires after `ttl` seconds.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, typing.Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> typing.Any | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: typing.Any) -> int:
+        """It stores value and returns number of evicted entries."""
+        evicted = 0
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+        return evicted
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class DirectionsCache:
+    """Two tier cache of found routes.
+
+    The first tier is in-process LRU, the second one is optional Django cache (see `CACHES` setting),
+    it can be file based cache to survive restarts or shared cache (memcached, redis) for all workers.
+    Keys are built from quantized coordinates, so nearby requests share the same entry.
+    Entries are kept `stale_ttl` seconds after they expire, stale entries are served only when ORS fails.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        precision: int = 5,
+        ttl: int = 3600,
+        max_entries: int = 1024,
+        backend: str | None = None,
+        namespace: str = "directions",
+        stale_ttl: int = 0,
+    ):
+        self.enabled = enabled
+        self.precision = precision
+        self.ttl = ttl
+        self.namespace = namespace
+        self.backend_alias = backend
+        self.stale_ttl = stale_ttl
+        self.local = LRUCache(max_entries, ttl)
+        self.stale = LRUCache(max_entries, ttl + stale_ttl)
+        self.stats = CacheStats()
+
+    @property
+    def backend(self) -> BaseCache | None:
+        return caches[self.backend_alias] if self.backend_alias else None
+
+    def quantize(self, point: Point) -> Point:
+        """It rounds coordinates of the point to configured precision."""
+        return Point(lat=round(point.lat, self.precision), long=round(point.long, self.precision))
+
+    def key(self, profile: str, start: Point, finish: Point, **options: typing.Any) -> str:
+        """It builds cache key
+
+        Args:
+            profile: ORS profile
+            start: starting point
+            finish: ending point
+            options: other parameters which change the result
+
+        Returns:
+            cache key
+        """
+        coordinates = ":".join(
+            f"{value:.{self.precision}f}" for point in (start, finish) for value in (point.long, point.lat)
+        )
+        flags = ",".join(f"{name}={options[name]}" for name in sorted(options))
+        return f"{self.namespace}:{profile}:{coordinates}:{flags}"
+
+    def get(self, key: str) -> Routes | None:
+        if not self.enabled:
+            return None
+        routes: Routes | None = self.local.get(key)
+        if routes is not None:
+            self.stats.hits += 1
+            self.stats.local_hits += 1
+            return routes
+        backend = self.backend
+        if backend is not None:
+            routes = backend.get(key)
+        return self._backend_result(key, routes)
+
+    async def aget(self, key: str) -> Routes | None:
+        if not self.enabled:
+            return None
+        routes: Routes | None = self.local.get(key)
+        if routes is not None:
+            self.stats.hits += 1
+            self.stats.local_hits += 1
+            return routes
+        backend = self.backend
+        if backend is not None:
+            routes = await backend.aget(key)
+        return self._backend_result(key, routes)
+
+    def _backend_result(self, key: str, routes: Routes | None) -> Routes | None:
+        if routes is None:
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        self.stats.backend_hits += 1
+        self.stats.evictions += self.local.set(key, routes)
+        return routes
+
+    def set(self, key: str, routes: Routes):
+        if not self.enabled:
+            return
+        self.stats.evictions += self.local.set(key, routes)
+        backend = self.backend
+        if backend is not None:
+            backend.set(key, routes, self.ttl)
+            if self.stale_ttl:
+                backend.set(self.stale_key(key), routes, self.ttl + self.stale_ttl)
+        elif self.stale_ttl:
+            self.stale.set(key, routes)
+
+    async def aset(self, key: str, routes: Routes):
+        if not self.enabled:
+            return
+        self.stats.evictions += self.local.set(key, routes)
+        backend = self.backend
+        if backend is not None:
+            await backend.aset(key, routes, self.ttl)
+            if self.stale_ttl:
+                await backend.aset(self.stale_key(key), routes, self.ttl + self.stale_ttl)
+        elif self.stale_ttl:
+            self.stale.set(key, routes)
+
+    def stale_key(self, key: str) -> str:
+        return f"{key}:stale"
+
+    def get_stale(self, key: str) -> Routes | None:
+        """It returns routes even if they have expired (within `stale_ttl`), e.g. when ORS is failing."""
+        if not self.enabled or not self.stale_ttl:
+            return None
+        backend = self.backend
+        return self.stale.get(key) if backend is None else backend.get(self.stale_key(key))
+
+    async def aget_stale(self, key: str) -> Routes | None:
+        if not self.enabled or not self.stale_ttl:
+            return None
+        backend = self.backend
+        return self.stale.get(key) if backend is None else await backend.aget(self.stale_key(key))
+
+    def get_many(self, keys: typing.Iterable[str]) -> dict[str, typing.Any]:
+        """It returns cached values of the keys (missing ones are left out), Django cache is asked once
+        for all keys which are not in the local tier.
+        """
+        if not self.enabled:
+            return {}
+        found, missing = self._local_many(keys)
+        backend = self.backend
+        if missing and backend is not None:
+            self._backend_many(found, missing, backend.get_many(missing))
+        else:
+            self.stats.misses += len(missing)
+        return found
+
+    async def aget_many(self, keys: typing.Iterable[str]) -> dict[str, typing.Any]:
+        if not self.enabled:
+            return {}
+        found, missing = self._local_many(keys)
+        backend = self.backend
+        if missing and backend is not None:
+            self._backend_many(found, missing, await backend.aget_many(missing))
+        else:
+            self.stats.misses += len(missing)
+        return found
+
+    def _local_many(self, keys: typing.Iterable[str]) -> tuple[dict[str, typing.Any], list[str]]:
+        found: dict[str, typing.Any] = {}
+        missing: list[str] = []
+        for key in keys:
+            value = self.local.get(key)
+            if value is None:
+                missing.append(key)
+            else:
+                found[key] = value
+        self.stats.hits += len(found)
+        self.stats.local_hits += len(found)
+        return found, missing
+
+    def _backend_many(self, found: dict[str, typing.Any], missing: list[str], values: dict[str, typing.Any]):
+        for key, value in values.items():
+            self.stats.evictions += self.local.set(key, value)
+        found.update(values)
+        self.stats.hits += len(values)
+        self.stats.backend_hits += len(values)
+        self.stats.misses += len(missing) - len(values)
+
+    def set_many(self, values: dict[str, typing.Any]):
+        if not self.enabled or not values:
+            return
+        for key, value in values.items():
+            self.stats.evictions += self.local.set(key, value)
+        backend = self.backend
+        if backend is not None:
+            backend.set_many(values, self.ttl)
+
+    async def aset_many(self, values: dict[str, typing.Any]):
+        if not self.enabled or not values:
+            return
+        for key, value in values.items():
+            self.stats.evictions += self.local.set(key, value)
+        backend = self.backend
+        if backend is not None:
+            await backend.aset_many(values, self.ttl)
+
+    def clear(self):
+        self.local.clear()
+        self.stale.clear()
+        self.stats = CacheStats()
+
+
+directions_cache = DirectionsCache(**settings.ROUTE_CACHE)
+# cells of distance/duration matrices - (distance, duration) by start and finish
+matrix_cache = DirectionsCache(
+    **{**settings.ROUTE_CACHE, "max_entries": settings.ROUTE_MATRIX["cache_entries"]}, namespace="matrix"
+)
@@ -0,0 +1,371 @@
+import functools
+import json
+import os
+import re
+import typing
+from dataclasses import asdict, dataclass
+
+import folium
+import numpy as np
+import numpy.typing as npt
+from django.conf import settings
+from folium.plugins import VectorGridProtobuf
+
+from .adapter import File
+from .artifacts import MapArtifacts, map_artifacts
+from .corridor import require_line
+from .mvt import Box, Feature, clip, encode_tile, mercator, pixel_size, quantize, tile_box, tile_source
+from .polyline import Coordinates
+from .rendering import StreamedPolyLine, render_html
+from .simplify import SimplifyOptions
+
+
+# fixed id of the map element, so the layer rendered once can be added to any composed map
+MAP_ID: str = "route_planner"
+MAP_NAME: str = f"map_{MAP_ID}"
+LAYER_FILE: str = "layer.js"
+MANIFEST_FILE: str = "composition.json"
+SOURCE_FILE: str = "tiles.bin"
+TILES_LAYER: str = "routes"
+BASE_LAYERS: int = 64
+
+# [[south, west], [north, east]]
+Bounds: typing.TypeAlias = list[list[float]]
+
+
+class MapNotFound(Exception):
+    """The map (or its layer) does not exist or it has been swept from the store."""
+
+    def __init__(self, map_id: str, layer_id: str | None = None):
+        self.map_id = map_id
+        self.layer_id = layer_id
+
+    def __str__(self):
+        if self.layer_id is not None:
+            return f"Layer {self.layer_id} of map {self.map_id} does not exist"
+        return f"Map {self.map_id} does not exist or it has expired"
+
+
+class TileNotFound(Exception):
+    """The tile is out of the world or its zoom level is not served."""
+
+    def __init__(self, zoom: int, x: int, y: int):
+        self.zoom = zoom
+        self.x = x
+        self.y = y
+
+    def __str__(self):
+        return f"Tile {self.zoom}/{self.x}/{self.y} does not exist"
+
+
+@dataclass
+class Layer:
+    """Route drawn in composed map - id (digest) of its stored script, its tooltip and bounds."""
+
+    id: str
+    title: str
+    bounds: Bounds
+
+
+@dataclass
+class Composition:
+    """Stored map composed of layers - its id (digest), title, filename, layers and the map file."""
+
+    id: str
+    title: str
+    filename: str
+    layers: list[Layer]
+    file: File
+
+
+def new_map(**kwargs: typing.Any) -> folium.Map:
+    created_map = folium.Map(**kwargs)
+    created_map._id = MAP_ID
+    return created_map
+
+
+@functools.lru_cache(maxsize=BASE_LAYERS)
+def base_layer(title: str) -> tuple[bytes, bytes]:
+    """It renders page of the map without routes (scripts, CSS, tiles) once per title and process.
+
+    Args:
+        title: map title
+
+    Returns:
+        the page up to the end of the map script and the rest of the page
+    """
+    html: str = new_map(title=title).get_root().render()
+    end: int = html.rindex("</script>")
+    return html[:end].encode("utf8"), html[end:].encode("utf8")
+
+
+def layer_script(line: StreamedPolyLine) -> str:
+    """It renders script which adds the line to the map (with marker instead of coordinates)."""
+    created_map: folium.Map = new_map(tiles=None)
+    created_map.add_child(line)
+    html: str = created_map.get_root().render()
+    return html[html.index(f"var {line.get_name()} = ") : html.rindex("</script>")]
+
+
+def coordinates_bounds(coordinates: Coordinates) -> Bounds:
+    south, west = coordinates[:, 1::-1].min(axis=0).tolist()
+    north, east = coordinates[:, 1::-1].max(axis=0).tolist()
+    return [[south, west], [north, east]]
+
+
+def union(bounds: typing.Sequence[Bounds]) -> Bounds | None:
+    if not bounds:
+        return None
+    return [
+        [min(box[0][0] for box in bounds), min(box[0][1] for box in bounds)],
+        [max(box[1][0] for box in bounds), max(box[1][1] for box in bounds)],
+    ]
+
+
+def mercator_box(bounds: Bounds) -> Box:
+    (south, west), (north, east) = bounds
+    (x0, y0), (x1, y1) = mercator(np.array([[west, north], [east, south]]))
+    return x0, y0, x1, y1
+
+
+def intersects(first: Box, second: Box) -> bool:
+    return first[0] <= second[2] and second[0] <= first[2] and first[1] <= second[3] and second[1] <= first[3]
+
+
+def fit_script(bounds: Bounds | None) -> bytes:
+    if bounds is None:
+        return b""
+    return f"\n    {MAP_NAME}.fitBounds({json.dumps(bounds)}, {{}});\n".encode("utf8")
+
+
+class MapComposer:
+    """Maps composed of the base page cached in process and route layers stored in map artifacts.
+    Every layer is rendered once (it is content addressed as maps are), composed map is only a concatenation
+    of the base page, stored layers and bounds of all layers. Composition is stored with manifest
+    of its layers, so layers can be added or removed (or the title changed) without rendering the others.
+    Layers are stored also as sources of vector tiles (projected points with their Douglas–Peucker importance),
+    tiles of the composition are then clipped from the sources simplified for their zoom level and stored too.
+
+    Args:
+        artifacts: store of maps and layers
+        extent: size of the tile in tile coordinates
+        buffer: tile coordinates drawn around the tile (so that lines are not cut at the edge)
+        max_zoom: the highest zoom level of tiles
+        cache_size: number of tile sources and manifests kept in memory
+    """
+
+    def __init__(
+        self, artifacts: MapArtifacts, extent: int = 4096, buffer: int = 64, max_zoom: int = 18, cache_size: int = 64
+    ):
+        self.artifacts = artifacts
+        self.extent = extent
+        self.buffer = buffer
+        self.max_zoom = max_zoom
+        # stored layers and manifests never change (they are content addressed)
+        self.source = functools.lru_cache(maxsize=cache_size)(self._source)
+        self.manifest = functools.lru_cache(maxsize=cache_size)(self._manifest)
+
+    def layer(
+        self,
+        coordinates: Coordinates,
+        route_title: str,
+        bounds: Bounds | None = None,
+        simplify: SimplifyOptions | None = None,
+    ) -> Layer:
+        """It stores the route layer unless it is stored already.
+
+        Args:
+            coordinates: array of (long, lat) coordinates of the route
+            route_title: route tooltip
+            bounds: bounds of the route (e.g. from ORS bbox), they are computed from coordinates if not set
+            simplify: simplification of the route before it is drawn
+
+        Returns:
+            the layer, `InvalidRoute` is raised if the route has less than 2 points
+        """
+        require_line(coordinates)
+        coordinates = np.ascontiguousarray(coordinates[:, :2])
+        digest: str = self.artifacts.digest(
+            b"layer", coordinates.tobytes(), route_title, repr(simplify or SimplifyOptions())
+        )
+        self.artifacts.get_or_write(
+            digest, LAYER_FILE, lambda name: self.write_layer(name, coordinates, route_title, simplify)
+        )
+        self.artifacts.get_or_write(digest, SOURCE_FILE, lambda name: self.write_source(name, coordinates))
+        return Layer(id=digest, title=route_title, bounds=bounds or coordinates_bounds(coordinates))
+
+    def write_layer(
+        self, name: str, coordinates: Coordinates, route_title: str, simplify: SimplifyOptions | None
+    ) -> File:
+        if simplify:
+            coordinates = simplify.apply(coordinates)
+        line: StreamedPolyLine = StreamedPolyLine(coordinates, tooltip=route_title)
+        return File.from_chunks(name, render_html(layer_script(line), [line]), self.artifacts.storage)
+
+    def write_source(self, name: str, coordinates: Coordinates) -> File:
+        source: npt.NDArray[np.float64] = tile_source(coordinates, pixel_size(self.max_zoom))
+        return File.from_chunks(name, [source.tobytes()], self.artifacts.storage)
+
+    def compose(self, title: str, layers: list[Layer], filename: str = "map.html") -> Composition:
+        """It stores the map of the layers unless it is stored already.
+
+        Args:
+            title: map title
+            layers: stored layers
+            filename: filename of the map
+
+        Returns:
+            the composition
+        """
+        filename = os.path.basename(filename)
+        digest: str = self.artifacts.digest(b"composition", title, filename, *(layer.id for layer in layers))
+        for layer in layers:
+            if not self.artifacts.storage.exists(self.artifacts.name(layer.id, LAYER_FILE)):
+                raise MapNotFound(digest, layer.id)
+        manifest: bytes = json.dumps(
+            {"title": title, "filename": filename, "layers": [asdict(layer) for layer in layers]}
+        ).encode()
+        self.artifacts.get_or_write(
+            digest, MANIFEST_FILE, lambda name: File.from_chunks(name, [manifest], self.artifacts.storage)
+        )
+        file: File = self.artifacts.get_or_write(
+            digest, filename, lambda name: File.from_chunks(name, self.chunks(title, layers), self.artifacts.storage)
+        )
+        return Composition(id=digest, title=title, filename=filename, layers=layers, file=file)
+
+    def chunks(self, title: str, layers: list[Layer]) -> typing.Iterator[bytes]:
+        head, tail = base_layer(title)
+        yield head
+        for layer in layers:
+            with self.artifacts.storage.open(self.artifacts.name(layer.id, LAYER_FILE), "rb") as file:
+                yield from iter(lambda: file.read(1 << 16), b"")
+        yield fit_script(union([layer.bounds for layer in layers]))
+        yield tail
+
+    def load(self, map_id: str) -> Composition:
+        """It returns stored composition, the map is composed again if it has been swept (but its layers not).
+
+        Args:
+            map_id: id of the composition
+
+        Returns:
+            the composition
+        """
+        title, filename, layers = self.manifest(map_id)
+        return self.compose(title, list(layers), filename)
+
+    def _manifest(self, map_id: str) -> tuple[str, str, tuple[Layer, ...]]:
+        name: str = self.artifacts.name(map_id, MANIFEST_FILE)
+        if not re.fullmatch("[0-9a-f]{40}", map_id) or not self.artifacts.storage.exists(name):
+            raise MapNotFound(map_id)
+        with self.artifacts.storage.open(name, "rb") as file:
+            manifest: dict[str, typing.Any] = json.load(file)
+        return manifest["title"], manifest["filename"], tuple(Layer(**layer) for layer in manifest["layers"])
+
+    def _source(self, layer_id: str) -> npt.NDArray[np.float64]:
+        # FileNotFoundError if the source has been swept
+        with self.artifacts.storage.open(self.artifacts.name(layer_id, SOURCE_FILE), "rb") as file:
+            return np.frombuffer(file.read(), dtype=np.float64).reshape(-1, 3)
+
+    def tile(self, map_id: str, zoom: int, x: int, y: int) -> bytes:
+        """It returns vector tile of the composed map, the tile is clipped from tile sources of its layers
+        simplified for the zoom level, it is stored unless it is empty (out of bounds of the map).
+
+        Args:
+            map_id: id of the composition
+            zoom: zoom level
+            x: column of the tile
+            y: row of the tile
+
+        Returns:
+            Mapbox Vector Tile with one line feature per layer, empty if the tile has no line
+        """
+        if not (0 <= zoom <= self.max_zoom and 0 <= x < 2**zoom and 0 <= y < 2**zoom):
+            raise TileNotFound(zoom, x, y)
+        layers: tuple[Layer, ...] = self.manifest(map_id)[2]
+        box: Box = tile_box(zoom, x, y, self.buffer / self.extent)
+        bounds: Bounds | None = union([layer.bounds for layer in layers])
+        if bounds is None or not intersects(box, mercator_box(bounds)):
+            return b""
+        file: File = self.artifacts.get_or_write(
+            map_id,
+            f"{zoom}-{x}-{y}.mvt",
+            lambda name: File.from_chunks(name, [self.render_tile(map_id, layers, zoom, x, y)], self.artifacts.storage),
+        )
+        with self.artifacts.storage.open(file.name, "rb") as stored:
+            return stored.read()
+
+    def render_tile(self, map_id: str, layers: typing.Iterable[Layer], zoom: int, x: int, y: int) -> bytes:
+        box: Box = tile_box(zoom, x, y, self.buffer / self.extent)
+        features: list[Feature] = []
+        for layer in layers:
+            try:
+                source: npt.NDArray[np.float64] = self.source(layer.id)
+            except FileNotFoundError:
+                raise MapNotFound(map_id, layer.id)
+            points = source[source[:, 2] > pixel_size(zoom), :2]
+            parts = [quantize(part, zoom, x, y, self.extent) for part in clip(points, box)]
+            parts = [part for part in parts if len(part) > 1]
+            if parts:
+                features.append(({"id": layer.id, "title": layer.title}, parts))
+        return encode_tile(TILES_LAYER, features, self.extent)
+
+    def tiled_map(self, composition: Composition, tiles_url: str) -> File:
+        """It stores the map which loads vector tiles of the composition in view instead of whole routes.
+
+        Args:
+            composition: composed map
+            tiles_url: URL template of the tiles ({z}, {x} and {y} placeholders)
+
+        Returns:
+            stored map
+        """
+        digest: str = self.artifacts.digest(b"tiled", composition.id, tiles_url)
+        return self.artifacts.get_or_render(
+            digest, composition.filename, lambda: self.render_tiled_map(composition, tiles_url)
+        )
+
+    def render_tiled_map(self, composition: Composition, tiles_url: str) -> folium.Map:
+        created_map: folium.Map = new_map(title=composition.title)
+        options: dict[str, typing.Any] = {
+            "vectorTileLayerStyles": {TILES_LAYER: {"color": "#3388ff", "weight": 3}},
+            "maxNativeZoom": self.max_zoom,
+        }
+        VectorGridProtobuf(tiles_url, "Routes", options).add_to(created_map)
+        bounds: Bounds | None = union([layer.bounds for layer in composition.layers])
+        if bounds is not None:
+            created_map.fit_bounds(bounds)
+        return created_map
+
+    def update(
+        self, map_id: str, title: str | None = None, add: list[Layer] | None = None, remove: list[str] | None = None
+    ) -> Composition:
+        """It composes new map from the stored one - only added layers are rendered (if they are new).
+
+        Args:
+            map_id: id of the stored composition
+            title: new title of the map
+            add: layers added on top of the map
+            remove: ids of removed layers
+
+        Returns:
+            the new composition
+        """
+        composition: Composition = self.load(map_id)
+        removed: set[str] = set(remove or [])
+        unknown: set[str] = removed - {layer.id for layer in composition.layers}
+        if unknown:
+            raise MapNotFound(map_id, sorted(unknown)[0])
+        layers: list[Layer] = [layer for layer in composition.layers if layer.id not in removed]
+        for layer in add or []:
+            if layer.id not in {kept.id for kept in layers}:
+                layers.append(layer)
+        return self.compose(title if title is not None else composition.title, layers, composition.filename)
+
+    @staticmethod
+    def map_id(file: File) -> str:
+        """It returns id of the composition of the map file."""
+        return os.path.basename(os.path.dirname(file.name))
+
+
+map_composer = MapComposer(map_artifacts, **settings.MAP_TILES)
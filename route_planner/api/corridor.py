@@ -0,0 +1,153 @@
+import math
+from dataclasses import dataclass
+
+import numpy as np
+import numpy.typing as npt
+
+from .graph import haversine
+from .polyline import Coordinates
+from .spatial import GridIndex, DEGREE
+
+
+class InvalidRoute(Exception):
+    """Geometry of the route is not a line (it is not decodable or it has less than 2 points)."""
+
+
+def require_line(route: Coordinates):
+    """It raises `InvalidRoute` if the route has less than 2 points."""
+    if len(route) < 2:
+        raise InvalidRoute(f"Route needs at least 2 points, it has {len(route)}.")
+
+
+@dataclass
+class CorridorMatch:
+    """Points within the corridor around the route, sorted by their position along the route.
+
+    Args:
+        indexes: indexes of the points
+        distances: meters of the points from the route
+        positions: meters from the start of the route to the nearest place of the route
+    """
+
+    indexes: npt.NDArray[np.int64]
+    distances: npt.NDArray[np.float64]
+    positions: npt.NDArray[np.float64]
+
+
+def lengths(coordinates: Coordinates) -> npt.NDArray[np.float64]:
+    """It returns meters of every segment of the route."""
+    return haversine(coordinates[1:, :2], coordinates[:-1, 0], coordinates[:-1, 1])
+
+
+def densify(coordinates: Coordinates, spacing: float) -> tuple[Coordinates, npt.NDArray[np.float64]]:
+    """It adds points to segments of the route, so no points are farther than spacing from each other.
+
+    Args:
+        coordinates: array of (long, lat) coordinates of the route
+        spacing: max. distance of points in meters
+
+    Returns:
+        coordinates of points and their distances from the start in meters
+    """
+    segment_lengths = lengths(coordinates)
+    parts = np.maximum(np.ceil(segment_lengths / spacing), 1).astype(np.int64)
+    segments = np.repeat(np.arange(len(segment_lengths)), parts)
+    # fraction of every point along its segment
+    fractions = (np.arange(parts.sum()) - np.repeat(np.cumsum(parts) - parts, parts)) / np.repeat(parts, parts)
+    starts, ends = coordinates[segments, :2], coordinates[segments + 1, :2]
+    positions = np.concatenate(([0.0], np.cumsum(segment_lengths)))
+    return (
+        np.vstack((starts + (ends - starts) * fractions[:, None], coordinates[-1:, :2])),
+        np.concatenate((positions[segments] + segment_lengths[segments] * fractions, positions[-1:])),
+    )
+
+
+def segment_distances(
+    points: Coordinates, starts: Coordinates, ends: Coordinates
+) -> tuple[npt.NDArray[np.float64], npt.NDArray[np.float64]]:
+    """It computes distances from points to segments pairwise - the point is projected onto the segment
+    in local plane around the point, the distance to the projection is haversine.
+
+    Args:
+        points: array of (long, lat) coordinates of the points
+        starts: array of (long, lat) coordinates of starts of the segments
+        ends: array of (long, lat) coordinates of ends of the segments
+
+    Returns:
+        distances in meters and fractions of the segments where the nearest places are
+    """
+    scale = np.column_stack((np.cos(np.radians(points[:, 1])), np.ones(len(points))))
+    relative = (starts - points) * scale
+    direction = (ends - starts) * scale
+    squared = (direction**2).sum(axis=1)
+    projected = np.divide(-(relative * direction).sum(axis=1), squared, out=np.zeros(len(squared)), where=squared > 0)
+    fractions = np.clip(projected, 0.0, 1.0)
+    nearest = starts + (ends - starts) * fractions[:, None]
+    return haversine(nearest, points[:, 0], points[:, 1]), fractions
+
+
+def cell_size(width: float, lat: float) -> float:
+    """Size of grid cell (degrees) which is at least twice the width wide up to the latitude."""
+    return 2 * width / (DEGREE * max(math.cos(math.radians(min(abs(lat) + 1.0, 89.0))), 1e-6))
+
+
+def bounding_box(route: Coordinates, points: Coordinates, width: float) -> npt.NDArray[np.bool_]:
+    """It returns mask of points within the bounding box of the route enlarged by the width."""
+    margin: float = cell_size(width, float(np.abs(route[:, 1]).max())) / 2
+    low, high = route[:, :2].min(axis=0) - margin, route[:, :2].max(axis=0) + margin
+    return ((points >= low) & (points <= high)).all(axis=1)
+
+
+def within(route: Coordinates, index: GridIndex, width: float) -> CorridorMatch:
+    """It finds indexed points within the width from the route. The route is cut into pieces not longer
+    than the width, pieces are paired with points in neighbouring cells of their starts, so distances
+    are computed only for pairs which may be near - at once, without a loop over pieces or points.
+
+    Args:
+        route: array of (long, lat) coordinates of the route
+        index: spatial index of the points
+        width: max. distance of the points from the route in meters
+
+    Returns:
+        points within the corridor
+    """
+    pieces, positions = densify(route, width)
+    # a point near the piece is at most its length plus the width far from its start
+    narrowest: float = index.cell_size * DEGREE * math.cos(math.radians(min(float(np.abs(pieces[:, 1]).max()), 89.0)))
+    segments, candidates = index.pairs(pieces[:-1], math.ceil(2 * width / max(narrowest, 1e-6)))
+    distances, fractions = segment_distances(index.points[candidates], pieces[segments], pieces[segments + 1])
+    near = distances <= width
+    segments, candidates, distances, fractions = segments[near], candidates[near], distances[near], fractions[near]
+    # the nearest piece of every point is the first one after sorting by point and distance
+    order = np.lexsort((distances, candidates))
+    indexes, first = np.unique(candidates[order], return_index=True)
+    nearest = order[first]
+    along = positions[segments[nearest]] + (positions[segments[nearest] + 1] - positions[segments[nearest]]) * (
+        fractions[nearest]
+    )
+    by_position = np.argsort(along, kind="stable")
+    return CorridorMatch(
+        indexes=indexes[by_position].astype(np.int64),
+        distances=distances[nearest][by_position],
+        positions=along[by_position],
+    )
+
+
+def corridor(route: Coordinates, points: Coordinates, width: float) -> CorridorMatch:
+    """It finds points within the width from the route - points out of the bounding box of the route
+    are dropped first, the rest is indexed by grid (see `within`).
+
+    Args:
+        route: array of (long, lat) coordinates of the route
+        points: array of (long, lat) coordinates of the points
+        width: max. distance of the points from the route in meters
+
+    Returns:
+        points within the corridor
+    """
+    require_line(route)
+    inside = np.flatnonzero(bounding_box(route, points, width))
+    index = GridIndex.build(points[inside], cell_size(width, float(np.abs(route[:, 1]).max())))
+    match: CorridorMatch = within(route, index, width)
+    match.indexes = inside[match.indexes]
+    return match
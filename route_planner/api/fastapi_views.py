@@ -1,16 +1,40 @@
+import dataclasses
 import typing
 from fastapi import APIRouter, Request
+from fastapi.responses import StreamingResponse
 
 from api.adapter import ORSException  # noqa: E402
-from api.services import RoutePlannerService  # noqa: E402
+from api.aliases import Point  # noqa: E402
+from api.composition import Composition, MapNotFound, TileNotFound, map_composer  # noqa: E402
+from api.corridor import InvalidRoute  # noqa: E402
+from api.polyline import InvalidPolyline  # noqa: E402
+from api.jobs import MapJob, JobQueueFull  # noqa: E402
+from api.matrix import max_tiles  # noqa: E402
+from api.formats import negotiate, JSON  # noqa: E402
+from api.responses import FastAPIJsonResponse, FastAPIGeometryResponse, FastAPITileResponse  # noqa: E402
+from api.upstream import upstream_budget  # noqa: E402
+from api.services import RoutePlannerService, RoutePair, Tour, abatch_lines, max_tour_calls  # noqa: E402
 from api.fastapi_schema import (  # noqa: E402
     RouteQuestion,
+    BatchRouteQuestion,
     RoutesAnswer,
+    MatrixQuestion,
+    MatrixAnswer,
+    TourQuestion,
+    TourAnswer,
+    FuelQuestion,
+    FuelAnswer,
     GeoJsonAnswer,
+    CorridorQuestion,
+    CorridorAnswer,
     GeoJsonQuestion,
     MapFromGeoJsonQuestion,
     MapQuestion,
     MapAnswer,
+    ComposeMapQuestion,
+    UpdateMapQuestion,
+    CompositionAnswer,
+    MapJobAnswer,
 )
 
 
@@ -18,7 +42,8 @@ router = APIRouter()
 
 
 @router.post("/routes", response_model=RoutesAnswer, tags=["Routes"])
-async def find_routes(route: RouteQuestion):
+@upstream_budget(1)
+async def find_routes(request: Request, route: RouteQuestion):
     """### Call parameters
     - **start** route location
     - **finish** route location (both within the **USA**)
@@ -26,6 +51,12 @@ async def find_routes(route: RouteQuestion):
     ### Call result
     - includes start end finish points of the requested routes
     - textual representation of the all found routes
+    - only geometries of the routes if binary format is requested by `Accept` header:
+        - `application/vnd.route-planner.polyline` encoded polylines (as returned by ORS), one per line
+        - `application/vnd.route-planner.coordinates+float32` (or `+float64`) for every route
+          uint32 number of points and (long, lat) pairs, little-endian
+        - `application/vnd.route-planner.columnar` uint32 number of routes, uint32 offsets of routes,
+          float64 longitudes and float64 latitudes of all points, little-endian
 
     Example:
     ```json
@@ -44,22 +75,177 @@ async def find_routes(route: RouteQuestion):
     from fastapi.exceptions import HTTPException
 
     try:
-        routes = RoutePlannerService().find_routes(route.start, route.finish)
+        routes = await RoutePlannerService().afind_routes(route.start, route.finish)
     except ORSException as exc:
         error_details: list[dict[str, typing.Any]] = [{"msg": exc.message, "type": exc.code, "error": exc.data}]
         raise HTTPException(status_code=exc.status, detail=error_details)
-    return {"start": route.start, "finish": route.finish, "routes": routes}
+    media_type: str = negotiate(request.headers.get("accept"))
+    if media_type != JSON:
+        geometries: list[str] = [found_route["geometry"] for found_route in routes]
+        return FastAPIGeometryResponse(RoutePlannerService().encode_geometries(geometries, media_type), media_type)
+    return FastAPIJsonResponse(
+        {"start": route.start, "finish": route.finish, "routes": routes}, headers={"Vary": "Accept"}
+    )
+
+
+@router.post("/routes/batch", tags=["Routes"])
+async def find_routes_batch(batch: BatchRouteQuestion):
+    """### Call parameters
+    - **pairs** list of **start** and **finish** route locations
+
+    ### Call result
+    - NDJSON stream, one line per pair as soon as its routes are found (not in order of pairs)
+    - each line includes **index** of the pair, its **start** and **finish** and
+      **routes** or **errors** if Open Route Service failed for the pair
+    - the last line is **summary** with number of **pairs**, **upstream_calls** (ORS calls) and **hedged_calls**
+      (hedged ORS calls) made for them,
+      `X-Upstream-Calls` header is sent before the pairs are resolved, so it does not include them
+
+    Example:
+    ```json
+    {
+        "pairs": [
+            {
+                "start": {"lat": 40.658714, "long": -73.801984},
+                "finish": {"lat": 33.948344, "long": -118.395067}
+            },
+            {
+                "start": {"lat": 41.978367, "long": -87.904712},
+                "finish": {"lat": 29.990295, "long": -95.336654}
+            }
+        ]
+    }
+    ```
+    """
+    pairs: list[RoutePair] = [(pair.start, pair.finish) for pair in batch.pairs]
+    return StreamingResponse(abatch_lines(pairs), media_type="application/x-ndjson")
+
+
+@router.post("/matrix", response_model=MatrixAnswer, tags=["Routes"])
+@upstream_budget(max_tiles())
+async def find_matrix(query: MatrixQuestion):
+    """### Call parameters
+    - **sources** route locations
+    - **destinations** optional route locations, **sources** are used if they are not set
+
+    ### Call result
+    - **distances** (meters) and **durations** (seconds) of the fastest routes from every source (row)
+      to every destination (column), `null` if there is no route, geometries of the routes are not included
+
+    Example:
+    ```json
+    {
+        "sources": [
+            {"lat": 40.658714, "long": -73.801984},
+            {"lat": 41.978367, "long": -87.904712}
+        ],
+        "destinations": [
+            {"lat": 33.948344, "long": -118.395067},
+            {"lat": 29.990295, "long": -95.336654}
+        ]
+    }
+    ```
+    """
+    from fastapi.exceptions import HTTPException
+
+    destinations: list[Point] = query.destinations or query.sources
+    try:
+        matrix = await RoutePlannerService().afind_matrix(query.sources, destinations)
+    except ORSException as exc:
+        error_details: list[dict[str, typing.Any]] = [{"msg": exc.message, "type": exc.code, "error": exc.data}]
+        raise HTTPException(status_code=exc.status, detail=error_details)
+    return FastAPIJsonResponse({"sources": query.sources, "destinations": destinations, **matrix})
+
+
+@router.post("/tour", response_model=TourAnswer, tags=["Routes"])
+@upstream_budget(max_tour_calls())
+async def optimize_tour(request: Request, query: TourQuestion):
+    """### Call parameters
+    - **depot** start of the tour (and its finish if **round_trip** is set, default)
+    - **stops** locations to visit (in any order)
+    - **title** title of the map
+    - **route_title** title of the tour
+
+    ### Call result
+    - **order** indexes of **stops** in the order of the fastest found tour and **stops** in this order
+    - **distance** (meters) and **duration** (seconds) of the whole tour
+    - **map** URL of the map of the tour
+
+    Example:
+    ```json
+    {
+        "depot": {"lat": 40.658714, "long": -73.801984},
+        "stops": [
+            {"lat": 41.978367, "long": -87.904712},
+            {"lat": 33.948344, "long": -118.395067},
+            {"lat": 29.990295, "long": -95.336654}
+        ]
+    }
+    ```
+    """
+    from fastapi.exceptions import HTTPException
+
+    try:
+        tour: Tour = await RoutePlannerService().aoptimize_tour(
+            query.depot, query.stops, query.round_trip, query.title, query.route_title
+        )
+    except ORSException as exc:
+        error_details: list[dict[str, typing.Any]] = [{"msg": exc.message, "type": exc.code, "error": exc.data}]
+        raise HTTPException(status_code=exc.status, detail=error_details)
+    return {
+        "order": tour.order,
+        "stops": [query.stops[index] for index in tour.order],
+        "distance": tour.distance,
+        "duration": tour.duration,
+        "map": build_absolute_url(request, tour.map.url),
+    }
+
+
+@router.post("/fuel", response_model=FuelAnswer, tags=["Routes"])
+@upstream_budget(1)
+async def plan_fuel(request: Request, query: FuelQuestion):
+    """### Call parameters
+    - **start** route location
+    - **finish** route location (both within the **USA**)
+    - **vehicle_range** miles on full tank and **mpg** miles per gallon (optional)
+
+    ### Call result
+    - **distance** miles of the route
+    - **stops** the cheapest stations to fuel up (the vehicle starts with full tank), gallons bought there and cost
+    - **gallons** and **cost** of the fuel bought on the route
+
+    Example:
+    ```json
+    {
+        "start": {"lat": 40.658714, "long": -73.801984},
+        "finish": {"lat": 33.948344, "long": -118.395067},
+        "vehicle_range": 500,
+        "mpg": 10
+    }
+    ```
+    """
+    from fastapi.exceptions import HTTPException
+
+    try:
+        _, plan = await RoutePlannerService().aplan_fuel(query.start, query.finish, query.vehicle_range, query.mpg)
+    except ORSException as exc:
+        error_details: list[dict[str, typing.Any]] = [{"msg": exc.message, "type": exc.code, "error": exc.data}]
+        raise HTTPException(status_code=exc.status, detail=error_details)
+    return {"start": query.start, "finish": query.finish, **dataclasses.asdict(plan)}
 
 
 @router.post("/geojson", response_model=GeoJsonAnswer, tags=["Routes"])
-def extract_geojson(route: GeoJsonQuestion):
+@upstream_budget(0)
+def extract_geojson(request: Request, route: GeoJsonQuestion):
     """### Call parameters
     - **geometry** geometry string read from route data structure returned from `/routes` endpoint.
+    - **tolerance**, **max_points**, **zoom** optional simplification of the route
 
     ### Call result
     - geojson structure
         - type = "LineString"
         - coordinates: list of Open Route Service points(coordinates)
+    - or binary format requested by `Accept` header, the same as `/routes` provides
 
     Example:
     ```json
@@ -68,43 +254,97 @@ def extract_geojson(route: GeoJsonQuestion):
     }
     ```
     """
-    return {"geojson": RoutePlannerService().extract_geojson(route.geometry)}
+    from fastapi.exceptions import HTTPException
+
+    media_type: str = negotiate(request.headers.get("accept"))
+    try:
+        if media_type != JSON:
+            return FastAPIGeometryResponse(
+                RoutePlannerService().encode_geometries([route.geometry], media_type, route.simplify_options()),
+                media_type,
+            )
+        geojson = RoutePlannerService().extract_geojson(route.geometry, route.simplify_options())
+    except InvalidPolyline as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return FastAPIJsonResponse({"geojson": geojson}, headers={"Vary": "Accept"})
 
 
 def build_absolute_url(request: Request, media_filepath: str) -> str:
     return f"{request.url.scheme}://{request.url.netloc}{media_filepath}"
 
 
+@router.post("/corridor", response_model=CorridorAnswer, tags=["Routes"])
+@upstream_budget(0)
+def find_corridor(request: Request, query: CorridorQuestion):
+    """### Call parameters
+    - **geometry** geometry string read from route data structure returned from `/routes` endpoint
+    - **points** locations (e.g. stations or depots)
+    - **distance** max. meters of the points from the route
+
+    ### Call result
+    - **points** within the distance from the route in the order along the route, with index of the point
+      in the request, meters from the route and meters from the start of the route
+
+    Example:
+    ```json
+    {
+        "geometry": "cddwFbomaM...",
+        "points": [{"lat": 40.658714, "long": -73.801984}, {"lat": 41.978367, "long": -87.904712}],
+        "distance": 1000
+    }
+    ```
+    """
+    from fastapi.exceptions import HTTPException
+
+    try:
+        points = RoutePlannerService().corridor(query.geometry, query.points, query.distance)
+    except InvalidRoute as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return FastAPIJsonResponse({"points": points})
+
+
 @router.post("/map_from_geojson", response_model=MapAnswer, tags=["Routes"])
+@upstream_budget(0)
 def map_from_geo_json(request: Request, query: MapFromGeoJsonQuestion):
     """### Call parameters
     - **geojson** data structure of route returned from `/geojson` endpoint.
     - **title** title of the map
     - **route_title** title of the route
     - **filename** filename of the map
+    - **tolerance**, **max_points**, **zoom** optional simplification of the route
 
     ### Call result
     - map: URL of the map
+    - id: id of the map, see `/maps/{map_id}`
     """
-    file = RoutePlannerService().map_from_geojson(
-        query.geojson,
-        title=query.title,
-        route_title=query.route_title,
-        filename=query.filename,
-    )
-    return {"map": build_absolute_url(request, file.url)}
+    from fastapi.exceptions import HTTPException
+
+    try:
+        file = RoutePlannerService().map_from_geojson(
+            query.geojson,
+            title=query.title,
+            route_title=query.route_title,
+            filename=query.filename,
+            simplify=query.simplify_options(),
+        )
+    except InvalidRoute as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return {"map": build_absolute_url(request, file.url), "id": map_composer.map_id(file)}
 
 
 @router.post("/map", response_model=MapAnswer, tags=["Routes"])
-def create_map(request: Request, query: MapQuestion):
+@upstream_budget(1)
+async def create_map(request: Request, query: MapQuestion):
     """### Call parameters
     - **start** route location
     - **finish** route location (both within the **USA**)
     - **title** title of the map
     - **route_title** title of the route
+    - **tolerance**, **max_points**, **zoom** optional simplification of the route
 
     ### Call result
     - map: URL of the map
+    - id: id of the map, see `/maps/{map_id}`
 
      Example:
     ```json
@@ -125,13 +365,209 @@ def create_map(request: Request, query: MapQuestion):
     from fastapi.exceptions import HTTPException
 
     try:
-        file = RoutePlannerService().create_map(
+        file = await RoutePlannerService().acreate_map(
             query.start,
             query.finish,
             query.title,
             query.route_title,
+            simplify=query.simplify_options(),
         )
     except ORSException as exc:
         error_details: list[dict[str, typing.Any]] = [{"msg": exc.message, "type": exc.code, "error": exc.data}]
         raise HTTPException(status_code=exc.status, detail=error_details)
-    return {"map": build_absolute_url(request, file.url)}
+    return {"map": build_absolute_url(request, file.url), "id": map_composer.map_id(file)}
+
+
+def tiles_url(request: Request, map_id: str) -> str:
+    url: str = str(request.url_for("map_tile", map_id=map_id, zoom=0, x=0, y=0))
+    # placeholders of Leaflet instead of the first tile
+    return url.replace("/0/0/0.mvt", "/{z}/{x}/{y}.mvt")
+
+
+def composition_answer(request: Request, composition: Composition) -> dict[str, typing.Any]:
+    tiles: str = tiles_url(request, composition.id)
+    return {
+        "id": composition.id,
+        "title": composition.title,
+        "map": build_absolute_url(request, composition.file.url),
+        "layers": [{"id": layer.id, "title": layer.title} for layer in composition.layers],
+        "tiles": tiles,
+        "tiled_map": build_absolute_url(request, RoutePlannerService().tiled_map(composition, tiles).url),
+    }
+
+
+@router.post("/maps", response_model=CompositionAnswer, tags=["Maps"])
+@upstream_budget(0)
+def compose_map(request: Request, query: ComposeMapQuestion):
+    """### Call parameters
+    - **routes** geometry strings read from route data structure returned from `/routes` endpoint
+      and tooltips of the routes
+    - **title** title of the map
+    - **filename** filename of the map
+    - **tolerance**, **max_points**, **zoom** optional simplification of the routes
+
+    ### Call result
+    - **id** of the map and **map** URL of the map
+    - **layers** ids and tooltips of the routes, see `/maps/{map_id}`
+    - **tiles** URL template of vector tiles of the routes, see `/maps/{map_id}/tiles/{zoom}/{x}/{y}.mvt`
+    - **tiled_map** URL of the map which loads only tiles in view, its size does not depend on length of routes
+
+    Routes which were already drawn (with the same tooltip and simplification) are not rendered again.
+    """
+    from fastapi.exceptions import HTTPException
+
+    try:
+        composition: Composition = RoutePlannerService().compose_map(
+            [(route.geometry, route.title) for route in query.routes],
+            query.title,
+            query.filename,
+            query.simplify_options(),
+        )
+    except (InvalidPolyline, InvalidRoute) as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return composition_answer(request, composition)
+
+
+@router.get("/maps/{map_id}", response_model=CompositionAnswer, tags=["Maps"])
+@upstream_budget(0)
+def map_composition(request: Request, map_id: str):
+    """### Call parameters
+    - **map_id** id of the map
+
+    ### Call result
+    - the same as `/maps`
+    """
+    from fastapi.exceptions import HTTPException
+
+    try:
+        return composition_answer(request, RoutePlannerService().map_composition(map_id))
+    except MapNotFound as exc:
+        raise HTTPException(status_code=404, detail=str(exc))
+
+
+@router.post("/maps/{map_id}", response_model=CompositionAnswer, tags=["Maps"])
+@upstream_budget(0)
+def update_map(request: Request, map_id: str, query: UpdateMapQuestion):
+    """### Call parameters
+    - **map_id** id of the map
+    - **title** new title of the map (optional)
+    - **add** routes added to the map, the same as **routes** of `/maps`
+    - **remove** ids of routes (layers) removed from the map
+    - **tolerance**, **max_points**, **zoom** optional simplification of the added routes
+
+    ### Call result
+    - the same as `/maps`, the changed map is stored as a new map with new **id**
+
+    Only added routes are rendered, the other routes of the map are reused.
+    """
+    from fastapi.exceptions import HTTPException
+
+    try:
+        composition: Composition = RoutePlannerService().update_map(
+            map_id,
+            query.title,
+            [(route.geometry, route.title) for route in query.add],
+            query.remove,
+            query.simplify_options(),
+        )
+    except MapNotFound as exc:
+        raise HTTPException(status_code=404, detail=str(exc))
+    except (InvalidPolyline, InvalidRoute) as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return composition_answer(request, composition)
+
+
+@router.get("/maps/{map_id}/tiles/{zoom}/{x}/{y}.mvt", name="map_tile", tags=["Maps"])
+@upstream_budget(0)
+def map_tile(request: Request, map_id: str, zoom: int, x: int, y: int):
+    """### Call parameters
+    - **map_id** id of the map
+    - **zoom**, **x**, **y** the tile
+
+    ### Call result
+    - Mapbox Vector Tile with layer "routes", one line per route of the map with its **id** and **title**,
+      lines are simplified for the zoom level and clipped by the tile, the tile is empty if no route crosses it
+    """
+    from fastapi.exceptions import HTTPException
+
+    try:
+        return FastAPITileResponse(RoutePlannerService().map_tile(map_id, zoom, x, y))
+    except (MapNotFound, TileNotFound) as exc:
+        raise HTTPException(status_code=404, detail=str(exc))
+
+
+def job_answer(request: Request, job: MapJob) -> dict[str, typing.Any]:
+    answer: dict[str, typing.Any] = {"id": job.id, "status": job.status, "map": None, "errors": job.errors}
+    if job.map is not None:
+        answer["map"] = build_absolute_url(request, job.map)
+    return answer
+
+
+def submit_job(request: Request, submit: typing.Callable[[], MapJob]) -> dict[str, typing.Any]:
+    from fastapi.exceptions import HTTPException
+
+    try:
+        return job_answer(request, submit())
+    except JobQueueFull as exc:
+        raise HTTPException(status_code=503, detail=str(exc))
+
+
+@router.post("/map_from_geojson/jobs", response_model=MapJobAnswer, status_code=202, tags=["Map jobs"])
+@upstream_budget(0)
+def submit_map_from_geo_json(request: Request, query: MapFromGeoJsonQuestion):
+    """### Call parameters
+    - the same as `/map_from_geojson`
+
+    ### Call result
+    - id of the job which renders the map in background, see `/map/jobs/{job_id}`
+    """
+    return submit_job(
+        request,
+        lambda: RoutePlannerService().submit_map_from_geojson(
+            query.geojson,
+            title=query.title,
+            route_title=query.route_title,
+            filename=query.filename,
+            simplify=query.simplify_options(),
+        ),
+    )
+
+
+@router.post("/map/jobs", response_model=MapJobAnswer, status_code=202, tags=["Map jobs"])
+@upstream_budget(0)
+def submit_map(request: Request, query: MapQuestion):
+    """### Call parameters
+    - the same as `/map`
+
+    ### Call result
+    - id of the job which finds the route and renders the map in background, see `/map/jobs/{job_id}`
+    """
+    return submit_job(
+        request,
+        lambda: RoutePlannerService().submit_map(
+            query.start,
+            query.finish,
+            query.title,
+            query.route_title,
+            simplify=query.simplify_options(),
+        ),
+    )
+
+
+@router.get("/map/jobs/{job_id}", response_model=MapJobAnswer, tags=["Map jobs"])
+async def map_job(request: Request, job_id: str, wait: float = 0.0):
+    """### Call parameters
+    - **job_id** id of the job
+    - **wait** optional seconds to wait until the job is finished (long-poll)
+
+    ### Call result
+    - **status** pending, done or failed
+    - **map** URL of the map when the job is done
+    - **errors** when the job failed
+    """
+    from fastapi.exceptions import HTTPException
+
+    job: MapJob | None = await RoutePlannerService().amap_job(job_id, wait)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown map job")
+    return job_answer(request, job)
@@ -0,0 +1,113 @@
+import typing
+
+import numpy as np
+
+from .polyline import Coordinates, decode_many, encode
+from .simplify import SimplifyOptions
+
+
+# media types of route geometries, the client chooses by "Accept" header
+JSON = "application/json"
+# encoded polylines (as returned by ORS), one line per route
+POLYLINE = "application/vnd.route-planner.polyline"
+# for every route: uint32 number of points, then (long, lat) pairs, all little-endian
+FLOAT32 = "application/vnd.route-planner.coordinates+float32"
+FLOAT64 = "application/vnd.route-planner.coordinates+float64"
+# uint32 number of routes, uint32 offsets of routes (number of routes + 1),
+# then float64 longitudes of all points and float64 latitudes of all points, all little-endian
+COLUMNAR = "application/vnd.route-planner.columnar"
+
+MEDIA_TYPES: tuple[str, ...] = (JSON, POLYLINE, FLOAT32, FLOAT64, COLUMNAR)
+
+
+def negotiate(accept: str | None) -> str:
+    """It chooses media type of the response by "Accept" header, JSON is the default one.
+
+    Args:
+        accept: value of "Accept" header
+
+    Returns:
+        one of `MEDIA_TYPES`
+    """
+    accepted: list[tuple[float, int, str]] = []
+    for position, item in enumerate((accept or "").split(",")):
+        media_type, *parameters = (part.strip() for part in item.split(";"))
+        quality: float = _quality(parameters)
+        if media_type in MEDIA_TYPES and quality > 0:
+            accepted.append((-quality, position, media_type))
+    return min(accepted)[2] if accepted else JSON
+
+
+def _quality(parameters: list[str]) -> float:
+    for parameter in parameters:
+        name, _, value = parameter.partition("=")
+        if name.strip() == "q":
+            try:
+                return float(value)
+            except ValueError:
+                return 0.0
+    return 1.0
+
+
+def pack(coordinates: typing.Sequence[Coordinates], dtype: str) -> bytes:
+    """It packs (long, lat) coordinates of routes into one buffer, every route is prefixed with number of points.
+
+    Args:
+        coordinates: arrays of coordinates
+        dtype: little-endian float type ("<f4" or "<f8")
+
+    Returns:
+        packed coordinates
+    """
+    return b"".join(
+        np.uint32(len(route)).astype("<u4").tobytes() + route[:, :2].astype(dtype).tobytes() for route in coordinates
+    )
+
+
+def pack_columnar(coordinates: typing.Sequence[Coordinates]) -> bytes:
+    """It packs coordinates of routes into columns - offsets of routes, longitudes and latitudes.
+
+    Args:
+        coordinates: arrays of coordinates
+
+    Returns:
+        packed coordinates
+    """
+    lengths = np.fromiter(map(len, coordinates), dtype=np.int64, count=len(coordinates))
+    offsets = np.concatenate(([0], np.cumsum(lengths))).astype("<u4")
+    points: Coordinates = np.concatenate([route[:, :2] for route in coordinates] or [np.empty((0, 2))])
+    return b"".join(
+        (
+            np.uint32(len(coordinates)).astype("<u4").tobytes(),
+            offsets.tobytes(),
+            points[:, 0].astype("<f8").tobytes(),
+            points[:, 1].astype("<f8").tobytes(),
+        )
+    )
+
+
+def encode_geometries(
+    geometries: typing.Sequence[str], media_type: str, simplify: SimplifyOptions | None = None
+) -> bytes:
+    """It encodes route geometries (polylines) into binary media type. Polylines are passed through
+    without decoding if they are requested and they are not simplified.
+
+    Args:
+        geometries: encoded polylines of routes
+        media_type: one of binary `MEDIA_TYPES`
+        simplify: simplification of routes
+
+    Returns:
+        body of the response
+    """
+    # polylines with non-ASCII characters are decoded, so that they are rejected as invalid
+    if media_type == POLYLINE and not simplify and all(geometry.isascii() for geometry in geometries):
+        return "\n".join(geometries).encode("ascii")
+    coordinates: list[Coordinates] = decode_many(geometries) if geometries else []
+    if simplify:
+        coordinates = [simplify.apply(route) for route in coordinates]
+    if media_type == POLYLINE:
+        return "\n".join(map(encode, coordinates)).encode("ascii")
+    if media_type == COLUMNAR:
+        return pack_columnar(coordinates)
+    return pack(coordinates, "<f4" if media_type == FLOAT32 else "<f8")
@@ -0,0 +1,211 @@
+import csv
+import functools
+import logging
+from dataclasses import dataclass
+
+import numpy as np
+import numpy.typing as npt
+
+from django.conf import settings
+
+from .corridor import CorridorMatch, cell_size, lengths, within
+from .polyline import Coordinates
+from .spatial import GridIndex
+
+
+logger = logging.getLogger(__name__)
+
+METERS_PER_MILE: float = 1609.344
+
+
+class OutOfRange(Exception):
+    """There is no fuel station within the range of the vehicle."""
+
+    def __init__(self, position: float, vehicle_range: float):
+        self.position = position
+        self.vehicle_range = vehicle_range
+
+    def __str__(self):
+        return (
+            f"There is no fuel station within {self.vehicle_range / METERS_PER_MILE:.0f} miles "
+            f"after {self.position / METERS_PER_MILE:.1f} miles of the route."
+        )
+
+
+@dataclass
+class FuelStop:
+    """Station where the vehicle fuels up - position is miles from start of the route."""
+
+    name: str
+    lat: float
+    long: float
+    price: float
+    position: float
+    gallons: float
+    cost: float
+
+
+@dataclass
+class FuelPlan:
+    """The cheapest fuel stops of the route - miles of the route, bought gallons and their price."""
+
+    distance: float
+    gallons: float
+    cost: float
+    stops: list[FuelStop]
+
+
+@dataclass
+class Stations:
+    names: list[str]
+    coordinates: Coordinates
+    prices: npt.NDArray[np.float64]
+    index: GridIndex
+
+
+def next_cheaper(prices: npt.NDArray[np.float64]) -> list[int]:
+    """It returns index of the next cheaper station of every station (len(prices) if there is none)."""
+    following: list[int] = [len(prices)] * len(prices)
+    stack: list[int] = []
+    for index, price in enumerate(prices.tolist()):
+        while stack and prices[stack[-1]] > price:
+            following[stack.pop()] = index
+        stack.append(index)
+    return following
+
+
+def refuel(
+    positions: npt.NDArray[np.float64], prices: npt.NDArray[np.float64], length: float, vehicle_range: float
+) -> list[tuple[int, float]]:
+    """It finds the cheapest refuelling of the route - the vehicle starts with full tank and it buys only enough fuel
+    to reach the next cheaper station within the range, it fills up and goes to the cheapest station within the range
+    if there is none. This greedy rule gives the optimum of the range-constrained refuelling DP in O(n log n).
+
+    Args:
+        positions: sorted meters of the stations from the start of the route
+        prices: prices of the stations
+        length: meters of the route
+        vehicle_range: meters on full tank
+
+    Returns:
+        indexes of the stations and meters of range bought there
+    """
+    # the start is never cheaper and the finish is always cheaper than any station
+    positions = np.concatenate(([0.0], positions, [length]))
+    prices = np.concatenate(([np.inf], prices, [-np.inf]))
+    cheaper: list[int] = next_cheaper(prices)
+    reaches = np.searchsorted(positions, positions + vehicle_range, side="right").tolist()
+    bought: list[tuple[int, float]] = []
+    station, fuel = 0, vehicle_range
+    while station < len(positions) - 1:
+        following, amount = _leg(positions, prices, station, cheaper[station], reaches[station], fuel, vehicle_range)
+        if amount > 0:
+            bought.append((station - 1, amount))
+        fuel += amount - (positions[following] - positions[station])
+        station = following
+    return bought
+
+
+def _leg(
+    positions: npt.NDArray[np.float64],
+    prices: npt.NDArray[np.float64],
+    station: int,
+    cheaper: int,
+    reach: int,
+    fuel: float,
+    vehicle_range: float,
+) -> tuple[int, float]:
+    """It returns the next station and meters of range bought at the station."""
+    if reach <= station + 1:
+        raise OutOfRange(float(positions[station]), vehicle_range)
+    if cheaper < reach:
+        return cheaper, max(float(positions[cheaper] - positions[station]) - fuel, 0.0)
+    return station + 1 + int(np.argmin(prices[station + 1 : reach])), vehicle_range - fuel
+
+
+class FuelStations:
+    """Fuel stations with their prices, they are loaded from CSV into spatial index (see `spatial`) at startup.
+    Stations within the corridor around the route are found by `corridor.within`.
+
+    Args:
+        stations: path of CSV file with "name", "lat", "long" and "price" columns
+        corridor: max. distance of the station from the route in meters
+    """
+
+    def __init__(self, stations: str | None = None, corridor: float = 1600.0):
+        self.path = stations
+        self.corridor = corridor
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    @functools.cached_property
+    def stations(self) -> Stations:
+        if not self.path:
+            raise ValueError("CSV file of fuel stations is not set (FUEL_STATIONS_CSV).")
+        with open(self.path, newline="", encoding="utf-8") as file:
+            rows = [row for row in csv.DictReader(file) if row.get("price")]
+        coordinates: Coordinates = np.array([(float(row["long"]), float(row["lat"])) for row in rows]).reshape(-1, 2)
+        # cells are wide enough for the corridor up to the northernmost station
+        northernmost: float = float(np.abs(coordinates[:, 1]).max(initial=0.0))
+        return Stations(
+            names=[row.get("name") or "" for row in rows],
+            coordinates=coordinates,
+            prices=np.array([float(row["price"]) for row in rows]),
+            index=GridIndex.build(coordinates, cell_size(self.corridor, northernmost)),
+        )
+
+    def load(self):
+        """It loads stations at startup of worker process."""
+        if not self.enabled:
+            return
+        try:
+            logger.info("Loaded %d fuel stations", len(self.stations.prices))
+        except (ValueError, KeyError, OSError) as exc:
+            logger.warning("Fuel stations are not loaded - %s", exc)
+
+    def along(self, route: Coordinates) -> CorridorMatch:
+        """It finds stations within the corridor around the route, sorted by their position along the route."""
+        return within(route, self.stations.index, self.corridor)
+
+    def plan(self, route: Coordinates, vehicle_range: float, mpg: float) -> FuelPlan:
+        """It finds the cheapest fuel stops of the route, `OutOfRange` is raised if a station is out of range.
+
+        Args:
+            route: array of (long, lat) coordinates of the route
+            vehicle_range: miles on full tank
+            mpg: miles per gallon
+
+        Returns:
+            fuel stops
+        """
+        match: CorridorMatch = self.along(route)
+        length: float = float(lengths(route).sum())
+        bought = refuel(match.positions, self.stations.prices[match.indexes], length, vehicle_range * METERS_PER_MILE)
+        stops: list[FuelStop] = [
+            self.stop(int(match.indexes[at]), float(match.positions[at]), float(amount) / METERS_PER_MILE / mpg)
+            for at, amount in bought
+        ]
+        return FuelPlan(
+            distance=round(length / METERS_PER_MILE, 1),
+            gallons=round(sum(stop.gallons for stop in stops), 2),
+            cost=round(sum(stop.cost for stop in stops), 2),
+            stops=stops,
+        )
+
+    def stop(self, station: int, position: float, gallons: float) -> FuelStop:
+        long, lat = self.stations.coordinates[station].tolist()
+        price: float = float(self.stations.prices[station])
+        return FuelStop(
+            name=self.stations.names[station],
+            lat=lat,
+            long=long,
+            price=price,
+            position=round(position / METERS_PER_MILE, 1),
+            gallons=round(gallons, 2),
+            cost=round(gallons * price, 2),
+        )
+
+
+fuel_stations = FuelStations(settings.FUEL["stations"], settings.FUEL["corridor"])
@@ -0,0 +1,65 @@
+import typing
+
+import numpy as np
+from pydantic import GetCoreSchemaHandler
+from pydantic_core import core_schema
+
+from .aliases import BoundingBox, GeoJson
+from .polyline import Coordinates, to_geojson, from_geojson
+
+
+class LineString:
+    """Route geometry backed by contiguous array of (long, lat[, elevation]) coordinates.
+
+    It replaces GeoJson structure (list of lists) within the service layer, GeoJson structure
+    is created only when the geometry is serialized (pydantic schemas).
+
+    Args:
+        coordinates: array of shape (N, 2) or (N, 3)
+    """
+
+    __slots__ = ("coordinates",)
+
+    def __init__(self, coordinates: Coordinates):
+        self.coordinates: Coordinates = np.ascontiguousarray(coordinates, dtype=np.float64)
+
+    @classmethod
+    def from_geojson(cls, geojson: GeoJson) -> "LineString":
+        return cls(from_geojson(geojson))
+
+    def to_geojson(self) -> GeoJson:
+        return to_geojson(self.coordinates)
+
+    def __len__(self) -> int:
+        return len(self.coordinates)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, LineString):
+            return NotImplemented
+        return np.array_equal(self.coordinates, other.coordinates)
+
+    def __repr__(self) -> str:
+        return f"LineString({len(self)} points)"
+
+    def bounds(self) -> BoundingBox | None:
+        """It returns ((west, south), (east, north)) or None for empty geometry."""
+        if not len(self):
+            return None
+        west, south = self.coordinates.min(axis=0)[:2].tolist()
+        east, north = self.coordinates.max(axis=0)[:2].tolist()
+        return (west, south), (east, north)
+
+    def tobytes(self) -> bytes:
+        return self.coordinates.tobytes()
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source: typing.Any, handler: GetCoreSchemaHandler) -> core_schema.CoreSchema:
+        # input is validated as GeoJson structure, output is serialized to it
+        from_geojson_schema = core_schema.no_info_after_validator_function(
+            cls.from_geojson, handler.generate_schema(GeoJson)
+        )
+        return core_schema.json_or_python_schema(
+            json_schema=from_geojson_schema,
+            python_schema=core_schema.union_schema([core_schema.is_instance_schema(cls), from_geojson_schema]),
+            serialization=core_schema.plain_serializer_function_ser_schema(lambda geometry: geometry.to_geojson()),
+        )
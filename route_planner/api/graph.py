@@ -0,0 +1,300 @@
+import heapq
+import json
+import math
+import os
+import typing
+import uuid
+
+import numpy as np
+import numpy.typing as npt
+
+from .polyline import Coordinates
+
+
+EARTH_RADIUS: float = 6371008.8
+
+# files of the graph within its directory
+ARRAYS: tuple[str, ...] = ("nodes", "offsets", "targets", "distances", "durations")
+META: str = "meta"
+
+
+def save_arrays(directory: str, arrays: dict[str, npt.NDArray[typing.Any]], meta: dict[str, typing.Any], name: str):
+    """It saves arrays as `.npy` files and their meta information as `<name>.json` file. Every file is replaced
+    at once, so the processes which have already mapped the old file keep reading it.
+
+    Args:
+        directory: directory of the files
+        arrays: arrays by their names
+        meta: meta information (version, id of the graph, ...)
+        name: name of meta information file
+    """
+    os.makedirs(directory, exist_ok=True)
+    for array_name, array in arrays.items():
+        path: str = os.path.join(directory, f"{array_name}.npy")
+        np.save(f"{path}.tmp.npy", array)
+        os.replace(f"{path}.tmp.npy", path)
+    path = os.path.join(directory, f"{name}.json")
+    with open(f"{path}.tmp", "w") as meta_file:
+        json.dump(meta, meta_file)
+    os.replace(f"{path}.tmp", path)
+
+
+def load_arrays(directory: str, names: typing.Iterable[str]) -> dict[str, npt.NDArray[typing.Any]]:
+    """It maps `.npy` files read-only, memory is shared by all processes through page cache."""
+    return {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r") for name in names}
+
+
+def load_meta(directory: str, name: str) -> dict[str, typing.Any]:
+    with open(os.path.join(directory, f"{name}.json")) as meta_file:
+        return json.load(meta_file)
+
+
+class NoPathFound(Exception):
+    def __init__(self, source: int, target: int):
+        self.source = source
+        self.target = target
+
+    def __str__(self):
+        return f"There is no path from node {self.source} to node {self.target}"
+
+
+def haversine(
+    coordinates: Coordinates, long: float | npt.NDArray[np.float64], lat: float | npt.NDArray[np.float64]
+) -> npt.NDArray[np.float64]:
+    """It computes distances in meters from the point to all coordinates
+    (or pairwise distances if arrays of points are passed).
+
+    Args:
+        coordinates: array of (long, lat) coordinates
+        long: longitude of the point(s)
+        lat: latitude of the point(s)
+
+    Returns:
+        distances in meters
+    """
+    longs, lats = np.radians(coordinates[:, 0]), np.radians(coordinates[:, 1])
+    a = (
+        np.sin((lats - np.radians(lat)) / 2) ** 2
+        + np.cos(lats) * np.cos(np.radians(lat)) * np.sin((longs - np.radians(long)) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+def distance(long: float, lat: float, other_long: float, other_lat: float) -> float:
+    """Scalar version of `haversine`."""
+    a = (
+        math.sin(math.radians(other_lat - lat) / 2) ** 2
+        + math.cos(math.radians(lat))
+        * math.cos(math.radians(other_lat))
+        * math.sin(math.radians(other_long - long) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+class RoadGraph:
+    """Directed road graph in compressed sparse row (CSR) form - edges leaving node `u` are
+    `targets[offsets[u]:offsets[u + 1]]` with their `distances` (meters) and `durations` (seconds).
+
+    Arrays are stored as `.npy` files in one directory and they are memory-mapped when loaded,
+    so the graph is shared by all worker processes and only touched pages are read.
+
+    Args:
+        nodes: array of (long, lat) coordinates of nodes
+        offsets: index of the first edge of every node (number of nodes + 1)
+        targets: target node of every edge
+        distances: length of every edge in meters
+        durations: travel time of every edge in seconds
+        meta: profile, max. speed (m/s) and other information about the graph
+    """
+
+    def __init__(
+        self,
+        nodes: Coordinates,
+        offsets: npt.NDArray[np.int64],
+        targets: npt.NDArray[np.int32],
+        distances: npt.NDArray[np.float32],
+        durations: npt.NDArray[np.float32],
+        meta: dict[str, typing.Any],
+    ):
+        self.nodes = nodes
+        self.offsets = offsets
+        self.targets = targets
+        self.distances = distances
+        self.durations = durations
+        self.meta = meta
+        # the fastest speed in the graph keeps A* heuristic admissible
+        self.max_speed: float = float(meta["max_speed"])
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    @property
+    def profile(self) -> str:
+        return self.meta.get("profile", "driving-car")
+
+    @classmethod
+    def build(
+        cls,
+        nodes: Coordinates,
+        sources: npt.NDArray[np.int64],
+        targets: npt.NDArray[np.int64],
+        distances: npt.NDArray[np.float64],
+        durations: npt.NDArray[np.float64],
+        meta: dict[str, typing.Any] | None = None,
+    ) -> "RoadGraph":
+        """It builds the graph from list of edges.
+
+        Args:
+            nodes: array of (long, lat) coordinates of nodes
+            sources: source node of every edge
+            targets: target node of every edge
+            distances: length of every edge in meters
+            durations: travel time of every edge in seconds
+            meta: information about the graph (e.g. profile)
+
+        Returns:
+            the graph
+        """
+        order = np.argsort(sources, kind="stable")
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(sources, minlength=len(nodes))))).astype(np.int64)
+        speeds = np.divide(distances, durations, out=np.zeros(len(distances)), where=durations > 0)
+        return cls(
+            np.ascontiguousarray(nodes, dtype=np.float64),
+            offsets,
+            targets[order].astype(np.int32),
+            distances[order].astype(np.float32),
+            durations[order].astype(np.float32),
+            {**(meta or {}), "id": uuid.uuid4().hex, "max_speed": float(speeds.max()) if len(speeds) else 1.0},
+        )
+
+    @property
+    def id(self) -> str | None:
+        """Identification of the graph, files built from the graph (indexes) refer to it."""
+        return self.meta.get("id")
+
+    def save(self, directory: str):
+        save_arrays(directory, {name: getattr(self, name) for name in ARRAYS}, self.meta, META)
+
+    @classmethod
+    def load(cls, directory: str) -> "RoadGraph":
+        """It loads memory-mapped graph saved by `save`."""
+        return cls(meta=load_meta(directory, META), **load_arrays(directory, ARRAYS))
+
+    def nearest(self, long: float, lat: float) -> int:
+        """It returns the node nearest to the point."""
+        return int(np.argmin(haversine(self.nodes, long, lat)))
+
+    def edges(self, node: int) -> typing.Iterator[tuple[int, float, float]]:
+        """It yields (target, distance, duration) of edges leaving the node."""
+        start, end = int(self.offsets[node]), int(self.offsets[node + 1])
+        yield from zip(
+            self.targets[start:end].tolist(), self.distances[start:end].tolist(), self.durations[start:end].tolist()
+        )
+
+    def shortest_path(self, source: int, target: int) -> list[int]:
+        """It finds the fastest path by A* search, the heuristic is travel time along great circle
+        at the max. speed of the graph.
+
+        Args:
+            source: index of starting node
+            target: index of ending node
+
+        Returns:
+            nodes of the path
+        """
+        search = _AStar(self, source, target)
+        while search.queue:
+            _, node = heapq.heappop(search.queue)
+            if node == target:
+                return self._path(search.previous, source, target)
+            if node not in search.done:
+                search.expand(node)
+        raise NoPathFound(source, target)
+
+    @staticmethod
+    def _path(previous: dict[int, int], source: int, target: int) -> list[int]:
+        path: list[int] = [target]
+        while path[-1] != source:
+            path.append(previous[path[-1]])
+        return path[::-1]
+
+    def costs(self, source: int, targets: typing.Collection[int]) -> dict[int, tuple[float, float]]:
+        """It finds (distance, duration) of the fastest paths from the source to all targets by one
+        Dijkstra search, which stops when all targets are reached.
+
+        Args:
+            source: index of starting node
+            targets: indexes of ending nodes
+
+        Returns:
+            costs by target, unreachable targets are left out
+        """
+        search = _Dijkstra(self, source)
+        remaining: set[int] = set(targets)
+        found: dict[int, tuple[float, float]] = {}
+        while search.queue and remaining:
+            duration, node = heapq.heappop(search.queue)
+            if duration > search.durations[node]:
+                continue
+            if node in remaining:
+                remaining.discard(node)
+                found[node] = (search.distances[node], duration)
+            search.expand(node)
+        return found
+
+    def path_costs(self, path: list[int]) -> tuple[float, float]:
+        """It returns (distance, duration) of the path, the fastest edge is used between two nodes."""
+        total_distance: float = 0.0
+        total_duration: float = 0.0
+        for node, following in zip(path, path[1:]):
+            edge_duration, edge_distance = min(
+                (edge_duration, edge_distance)
+                for neighbour, edge_distance, edge_duration in self.edges(node)
+                if neighbour == following
+            )
+            total_distance += edge_distance
+            total_duration += edge_duration
+        return total_distance, total_duration
+
+
+class _AStar:
+    """State of one A* search."""
+
+    def __init__(self, graph: RoadGraph, source: int, target: int):
+        self.graph = graph
+        self.target_long, self.target_lat = graph.nodes[target].tolist()
+        self.durations: dict[int, float] = {source: 0.0}
+        self.previous: dict[int, int] = {}
+        self.done: set[int] = set()
+        self.queue: list[tuple[float, int]] = [(self.heuristic(source), source)]
+
+    def heuristic(self, node: int) -> float:
+        long, lat = self.graph.nodes[node].tolist()
+        return distance(long, lat, self.target_long, self.target_lat) / self.graph.max_speed
+
+    def expand(self, node: int):
+        self.done.add(node)
+        for neighbour, _, duration in self.graph.edges(node):
+            candidate: float = self.durations[node] + duration
+            if candidate < self.durations.get(neighbour, math.inf):
+                self.durations[neighbour] = candidate
+                self.previous[neighbour] = node
+                heapq.heappush(self.queue, (candidate + self.heuristic(neighbour), neighbour))
+
+
+class _Dijkstra:
+    """State of one Dijkstra search by duration, distance of the fastest path is tracked too."""
+
+    def __init__(self, graph: RoadGraph, source: int):
+        self.graph = graph
+        self.durations: dict[int, float] = {source: 0.0}
+        self.distances: dict[int, float] = {source: 0.0}
+        self.queue: list[tuple[float, int]] = [(0.0, source)]
+
+    def expand(self, node: int):
+        for neighbour, edge_distance, duration in self.graph.edges(node):
+            candidate: float = self.durations[node] + duration
+            if candidate < self.durations.get(neighbour, math.inf):
+                self.durations[neighbour] = candidate
+                self.distances[neighbour] = self.distances[node] + edge_distance
+                heapq.heappush(self.queue, (candidate, neighbour))
@@ -0,0 +1,301 @@
+import heapq
+import math
+import typing
+
+import numpy as np
+import numpy.typing as npt
+
+from .graph import RoadGraph, NoPathFound, save_arrays, load_arrays, load_meta
+
+
+FORMAT: str = "contraction-hierarchy"
+VERSION: int = 1
+META: str = "hierarchy"
+ARRAYS: tuple[str, ...] = (
+    "ch_rank",
+    "ch_up_offsets",
+    "ch_up_nodes",
+    "ch_up_weights",
+    "ch_up_middles",
+    "ch_down_offsets",
+    "ch_down_nodes",
+    "ch_down_weights",
+    "ch_down_middles",
+)
+
+# edge of the hierarchy - other node, weight (duration) and contracted middle node of shortcut (-1 for edge)
+Edge: typing.TypeAlias = tuple[int, float, int]
+
+
+class IndexMismatch(Exception):
+    def __init__(self, name: str, directory: str):
+        self.name = name
+        self.directory = directory
+
+    def __str__(self):
+        return f"Index {self.name} in {self.directory} does not match the graph or its version, it has to be rebuilt"
+
+
+def check_meta(meta: dict[str, typing.Any], graph: RoadGraph, name: str, directory: str, version: int):
+    if meta.get("version") != version or meta.get("graph") != graph.id:
+        raise IndexMismatch(name, directory)
+
+
+class _Contraction:
+    """Mutable graph being contracted, node with the lowest edge difference is contracted first
+    (priorities are updated lazily), shortcuts are added only if there is no shorter witness path.
+
+    Args:
+        graph: road graph
+        settled_limit: max. number of nodes settled by one witness search
+    """
+
+    def __init__(self, graph: RoadGraph, settled_limit: int):
+        self.settled_limit = settled_limit
+        self.outgoing: list[dict[int, tuple[float, int]]] = [{} for _ in range(len(graph))]
+        self.incoming: list[dict[int, tuple[float, int]]] = [{} for _ in range(len(graph))]
+        self.contracted_neighbours: list[int] = [0] * len(graph)
+        for node in range(len(graph)):
+            for target, _, duration in graph.edges(node):
+                if target != node:
+                    self.add(node, target, duration, -1)
+        self.rank: list[int] = [-1] * len(graph)
+        self.up: list[list[Edge]] = [[] for _ in range(len(graph))]
+        self.down: list[list[Edge]] = [[] for _ in range(len(graph))]
+
+    def add(self, source: int, target: int, weight: float, middle: int):
+        if weight < self.outgoing[source].get(target, (math.inf, -1))[0]:
+            self.outgoing[source][target] = (weight, middle)
+            self.incoming[target][source] = (weight, middle)
+
+    def witness(self, source: int, skipped: int, targets: set[int], limit: float) -> dict[int, float]:
+        """It finds distances from source to targets without skipped node (up to the limit)."""
+        distances: dict[int, float] = {source: 0.0}
+        queue: list[tuple[float, int]] = [(0.0, source)]
+        settled: int = 0
+        while queue and targets and settled < self.settled_limit:
+            distance, node = heapq.heappop(queue)
+            if distance > limit:
+                break
+            if distance > distances[node]:
+                continue
+            settled += 1
+            targets.discard(node)
+            self.relax(node, skipped, distances, queue)
+        return distances
+
+    def relax(self, node: int, skipped: int, distances: dict[int, float], queue: list[tuple[float, int]]):
+        for neighbour, (weight, _) in self.outgoing[node].items():
+            candidate: float = distances[node] + weight
+            if neighbour != skipped and candidate < distances.get(neighbour, math.inf):
+                distances[neighbour] = candidate
+                heapq.heappush(queue, (candidate, neighbour))
+
+    def shortcuts(self, node: int) -> list[tuple[int, int, float]]:
+        """It returns shortcuts (source, target, weight) needed to contract the node."""
+        needed: list[tuple[int, int, float]] = []
+        targets: dict[int, float] = {target: weight for target, (weight, _) in self.outgoing[node].items()}
+        for source, (in_weight, _) in self.incoming[node].items():
+            limit: float = in_weight + max(targets.values(), default=0.0)
+            distances = self.witness(source, node, set(targets) - {source}, limit)
+            needed.extend(
+                (source, target, in_weight + out_weight)
+                for target, out_weight in targets.items()
+                if target != source and distances.get(target, math.inf) > in_weight + out_weight
+            )
+        return needed
+
+    def priority(self, node: int, shortcuts: list[tuple[int, int, float]] | None = None) -> int:
+        removed: int = len(self.outgoing[node]) + len(self.incoming[node])
+        needed: int = len(self.shortcuts(node) if shortcuts is None else shortcuts)
+        return needed - removed + self.contracted_neighbours[node]
+
+    def contract(self, node: int, rank: int, shortcuts: list[tuple[int, int, float]]):
+        for source, target, weight in shortcuts:
+            self.add(source, target, weight, node)
+        self.rank[node] = rank
+        # remaining neighbours are contracted later, so they have higher rank
+        self.up[node] = [(target, weight, middle) for target, (weight, middle) in self.outgoing[node].items()]
+        self.down[node] = [(source, weight, middle) for source, (weight, middle) in self.incoming[node].items()]
+        for target in self.outgoing[node]:
+            del self.incoming[target][node]
+            self.contracted_neighbours[target] += 1
+        for source in self.incoming[node]:
+            del self.outgoing[source][node]
+            self.contracted_neighbours[source] += 1
+        self.outgoing[node], self.incoming[node] = {}, {}
+
+    def run(self):
+        queue: list[tuple[int, int]] = [(self.priority(node), node) for node in range(len(self.rank))]
+        heapq.heapify(queue)
+        rank: int = 0
+        while queue:
+            _, node = heapq.heappop(queue)
+            # shortcuts of the up-to-date priority are reused by contraction (witness searches are the most of build)
+            shortcuts: list[tuple[int, int, float]] = self.shortcuts(node)
+            priority: int = self.priority(node, shortcuts)
+            if queue and priority > queue[0][0]:
+                heapq.heappush(queue, (priority, node))
+                continue
+            self.contract(node, rank, shortcuts)
+            rank += 1
+
+
+def _csr(edges: list[list[Edge]]) -> tuple[npt.NDArray[typing.Any], ...]:
+    offsets = np.concatenate(([0], np.cumsum([len(node_edges) for node_edges in edges]))).astype(np.int64)
+    flat: list[Edge] = [edge for node_edges in edges for edge in node_edges]
+    return (
+        offsets,
+        np.array([edge[0] for edge in flat], dtype=np.int32),
+        np.array([edge[1] for edge in flat], dtype=np.float64),
+        np.array([edge[2] for edge in flat], dtype=np.int32),
+    )
+
+
+class ContractionHierarchy:
+    """Contraction hierarchy of road graph - every node has its rank (order of contraction), shortcuts
+    replace paths over contracted nodes. Query is bidirectional Dijkstra which goes only up the ranks,
+    forward over "up" edges (to higher node) and backward over "down" edges (from higher node).
+
+    Arrays are memory-mapped from files built by `build_contraction_hierarchy` command.
+    """
+
+    def __init__(self, arrays: dict[str, npt.NDArray[typing.Any]], meta: dict[str, typing.Any]):
+        self.arrays = arrays
+        self.meta = meta
+        self.rank = arrays["ch_rank"]
+
+    @classmethod
+    def build(cls, graph: RoadGraph, settled_limit: int = 500) -> "ContractionHierarchy":
+        """It contracts all nodes of the graph, build time grows about quadratically with the size of the graph
+        (pure Python), it is practical for city sized extracts (tens of thousands of nodes).
+
+        Args:
+            graph: road graph
+            settled_limit: max. number of nodes settled by one witness search (more shortcuts, faster build)
+
+        Returns:
+            the hierarchy
+        """
+        contraction = _Contraction(graph, settled_limit)
+        contraction.run()
+        arrays: dict[str, npt.NDArray[typing.Any]] = {"ch_rank": np.array(contraction.rank, dtype=np.int32)}
+        for direction, edges in (("up", contraction.up), ("down", contraction.down)):
+            for name, array in zip(("offsets", "nodes", "weights", "middles"), _csr(edges)):
+                arrays[f"ch_{direction}_{name}"] = array
+        return cls(arrays, {"format": FORMAT, "version": VERSION, "graph": graph.id})
+
+    def save(self, directory: str):
+        save_arrays(directory, self.arrays, self.meta, META)
+
+    @classmethod
+    def load(cls, directory: str, graph: RoadGraph) -> "ContractionHierarchy":
+        """It maps the hierarchy of the graph, `IndexMismatch` is raised if it is built for other graph."""
+        meta: dict[str, typing.Any] = load_meta(directory, META)
+        check_meta(meta, graph, META, directory, VERSION)
+        return cls(load_arrays(directory, ARRAYS), meta)
+
+    def edges(self, direction: str, node: int) -> typing.Iterator[Edge]:
+        offsets = self.arrays[f"ch_{direction}_offsets"]
+        start, end = int(offsets[node]), int(offsets[node + 1])
+        yield from zip(
+            self.arrays[f"ch_{direction}_nodes"][start:end].tolist(),
+            self.arrays[f"ch_{direction}_weights"][start:end].tolist(),
+            self.arrays[f"ch_{direction}_middles"][start:end].tolist(),
+        )
+
+    def shortest_path(self, source: int, target: int) -> list[int]:
+        """It finds the fastest path - nodes of the road graph.
+
+        Args:
+            source: index of starting node
+            target: index of ending node
+
+        Returns:
+            nodes of the path
+        """
+        forward, backward = _Search(self, "up", source), _Search(self, "down", target)
+        meeting: int = self.meet(forward, backward, source == target)
+        if meeting < 0:
+            raise NoPathFound(source, target)
+        hops: list[tuple[int, int, int]] = forward.hops(meeting)[::-1] + [
+            (following, node, middle) for node, following, middle in backward.hops(meeting)
+        ]
+        path: list[int] = [source]
+        for node, following, middle in hops:
+            path.extend(self.unpack(node, following, middle)[1:])
+        return path
+
+    @staticmethod
+    def meet(forward: "_Search", backward: "_Search", same: bool) -> int:
+        """It runs both searches until the shortest path is certain, it returns the node where they meet
+        (-1 if there is no path)."""
+        best, meeting = (0.0, forward.start) if same else (math.inf, -1)
+        while forward.queue or backward.queue:
+            for search, other in ((forward, backward), (backward, forward)):
+                best, meeting = search.step(other, best, meeting)
+            if min(forward.minimum(), backward.minimum()) >= best:
+                break
+        return meeting
+
+    def middle(self, direction: str, node: int, other: int) -> int:
+        return min((weight, middle) for neighbour, weight, middle in self.edges(direction, node) if neighbour == other)[
+            1
+        ]
+
+    def unpack(self, source: int, target: int, middle: int) -> list[int]:
+        """It replaces shortcut by nodes of the road graph."""
+        path: list[int] = [source]
+        stack: list[tuple[int, int, int]] = [(source, target, middle)]
+        while stack:
+            start, end, through = stack.pop()
+            if through < 0:
+                path.append(end)
+                continue
+            # middle node has lower rank than both ends - start -> middle is "down" edge of the middle node
+            stack.append((through, end, self.middle("up", through, end)))
+            stack.append((start, through, self.middle("down", through, start)))
+        return path
+
+
+class _Search:
+    """One direction of bidirectional search."""
+
+    def __init__(self, hierarchy: ContractionHierarchy, direction: str, start: int):
+        self.hierarchy = hierarchy
+        self.direction = direction
+        self.start = start
+        self.distances: dict[int, float] = {start: 0.0}
+        self.previous: dict[int, tuple[int, int]] = {}
+        self.queue: list[tuple[float, int]] = [(0.0, start)]
+
+    def minimum(self) -> float:
+        return self.queue[0][0] if self.queue else math.inf
+
+    def step(self, other: "_Search", best: float, meeting: int) -> tuple[float, int]:
+        """It settles one node, it returns the best known path length and its meeting node."""
+        if not self.queue or self.queue[0][0] >= best:
+            return best, meeting
+        distance, node = heapq.heappop(self.queue)
+        if distance > self.distances[node]:
+            return best, meeting
+        if distance + other.distances.get(node, math.inf) < best:
+            best, meeting = distance + other.distances[node], node
+        self.relax(node, distance)
+        return best, meeting
+
+    def relax(self, node: int, distance: float):
+        for neighbour, weight, middle in self.hierarchy.edges(self.direction, node):
+            if distance + weight < self.distances.get(neighbour, math.inf):
+                self.distances[neighbour] = distance + weight
+                self.previous[neighbour] = (node, middle)
+                heapq.heappush(self.queue, (distance + weight, neighbour))
+
+    def hops(self, node: int) -> list[tuple[int, int, int]]:
+        """It returns (previous, node, middle) hops from the meeting node back to the start."""
+        hops: list[tuple[int, int, int]] = []
+        while node in self.previous:
+            previous, middle = self.previous[node]
+            hops.append((previous, node, middle))
+            node = previous
+        return hops
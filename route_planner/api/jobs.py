@@ -0,0 +1,246 @@
+import asyncio
+import functools
+import logging
+import multiprocessing
+import threading
+import time
+import typing
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, asdict
+
+import django
+from django.conf import settings
+from django.core.cache import caches, BaseCache
+from django.core.cache.backends.locmem import LocMemCache
+
+from .adapter import ORSException, File
+
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueueFull(Exception):
+    def __init__(self, max_pending: int):
+        self.max_pending = max_pending
+
+    def __str__(self):
+        return f"There are already {self.max_pending} pending map jobs"
+
+
+@dataclass
+class MapJob:
+    id: str
+    status: str = "pending"
+    map: str | None = None
+    errors: list[dict[str, typing.Any]] | None = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status != "pending"
+
+
+def init_worker():
+    """It prepares Django in worker process of the pool."""
+    django.setup()
+
+
+def run_job(render: typing.Callable[..., File], args: tuple, kwargs: dict[str, typing.Any]) -> dict[str, typing.Any]:
+    """It renders the map in worker process, result is sent back as plain data (ORS exception is not picklable).
+
+    Args:
+        render: it renders and stores the map
+        args: positional arguments of `render`
+        kwargs: keyword arguments of `render`
+
+    Returns:
+        finished job fields (without id)
+    """
+    try:
+        file: File = render(*args, **kwargs)
+    except ORSException as exc:
+        return {
+            "status": "failed",
+            "errors": [{"msg": exc.message, "type": exc.code, "ctx": {"status": exc.status, "error": exc.data}}],
+        }
+    return {"status": "done", "map": file.url}
+
+
+class MapJobs:
+    """Maps rendered off the request path by process pool (folium rendering is CPU bound).
+
+    State of jobs is kept in Django cache given by `backend` alias, so with more (gunicorn) workers
+    it has to be shared cache to see the state of the job in any of them (file based cache by default).
+
+    Args:
+        workers: number of worker processes
+        max_pending: max. number of pending jobs of this process, `JobQueueFull` is raised over it
+        ttl: seconds the state of the job is kept
+        max_wait: max. seconds to wait (long-poll) for finished job
+        poll_interval: seconds between two reads of the job state while waiting
+        backend: alias of Django cache of job states
+        namespace: prefix of cache keys
+        start_method: multiprocessing start method of worker processes
+    """
+
+    def __init__(
+        self,
+        workers: int = 2,
+        max_pending: int = 100,
+        ttl: int = 3600,
+        max_wait: float = 30.0,
+        poll_interval: float = 0.2,
+        backend: str = "map_jobs",
+        namespace: str = "map_jobs",
+        start_method: str = "spawn",
+    ):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.max_wait = max_wait
+        self.poll_interval = poll_interval
+        self.backend_alias = backend
+        self.namespace = namespace
+        self.start_method = start_method
+        self.pending: int = 0
+        self._pool: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self) -> BaseCache:
+        return caches[self.backend_alias]
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._warn_local_backend()
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(self.start_method),
+                    initializer=init_worker,
+                )
+            return self._pool
+
+    def _warn_local_backend(self):
+        if isinstance(self.backend, LocMemCache):
+            logger.warning(
+                "State of map jobs is kept in process-local cache %r, jobs submitted to other processes are not found.",
+                self.backend_alias,
+            )
+
+    def key(self, job_id: str) -> str:
+        return f"{self.namespace}:{job_id}"
+
+    def submit(self, render: typing.Callable[..., File], *args: typing.Any, **kwargs: typing.Any) -> MapJob:
+        """It submits rendering of the map to the pool.
+
+        Args:
+            render: it renders and stores the map, it has to be picklable (module level function)
+            args: positional arguments of `render`
+            kwargs: keyword arguments of `render`
+
+        Returns:
+            pending job
+        """
+        with self._lock:
+            if self.pending >= self.max_pending:
+                raise JobQueueFull(self.max_pending)
+            self.pending += 1
+        job = MapJob(id=uuid.uuid4().hex)
+        try:
+            self.store(job)
+            pool: ProcessPoolExecutor = self.pool
+            future: Future = pool.submit(run_job, render, args, kwargs)
+        except BaseException:
+            self._done()
+            raise
+        future.add_done_callback(functools.partial(self._finish, job.id, pool))
+        return job
+
+    def run(self, func: typing.Callable[..., typing.Any], *args: typing.Any) -> Future:
+        """It runs CPU bound function in the pool out of the queue of map jobs (the caller waits for it).
+
+        Args:
+            func: picklable (module level) function
+            args: its arguments
+
+        Returns:
+            future of the result
+        """
+        pool: ProcessPoolExecutor = self.pool
+        future: Future = pool.submit(func, *args)
+        future.add_done_callback(functools.partial(self._check_pool, pool))
+        return future
+
+    def _check_pool(self, pool: ProcessPoolExecutor, future: Future):
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            self._forget(pool)
+
+    def _done(self):
+        with self._lock:
+            self.pending -= 1
+
+    def _finish(self, job_id: str, pool: ProcessPoolExecutor, future: Future):
+        self._done()
+        try:
+            result: dict[str, typing.Any] = future.result()
+        except Exception as exc:
+            logger.exception("Map job %s failed.", job_id)
+            if isinstance(exc, BrokenProcessPool):
+                self._forget(pool)
+            result = {"status": "failed", "errors": [{"msg": "Rendering of the map failed", "type": "job_failed"}]}
+        self.store(MapJob(id=job_id, **result))
+
+    def _forget(self, pool: ProcessPoolExecutor):
+        # crashed worker breaks the whole pool (it cleans up itself), new one is created for the next job
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+
+    def store(self, job: MapJob):
+        self.backend.set(self.key(job.id), asdict(job), self.ttl)
+
+    def get(self, job_id: str) -> MapJob | None:
+        job: dict[str, typing.Any] | None = self.backend.get(self.key(job_id))
+        return MapJob(**job) if job is not None else None
+
+    async def aget(self, job_id: str) -> MapJob | None:
+        job: dict[str, typing.Any] | None = await self.backend.aget(self.key(job_id))
+        return MapJob(**job) if job is not None else None
+
+    def poll(self, job_id: str, wait: float = 0.0) -> MapJob | None:
+        """It returns the job, it waits (max. `max_wait` seconds) until the job is finished.
+
+        Args:
+            job_id: id of the job
+            wait: seconds to wait for finished job
+
+        Returns:
+            the job or None for unknown job
+        """
+        deadline: float = time.monotonic() + min(wait, self.max_wait)
+        job: MapJob | None = self.get(job_id)
+        while job is not None and not job.finished and time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            job = self.get(job_id)
+        return job
+
+    async def apoll(self, job_id: str, wait: float = 0.0) -> MapJob | None:
+        """Async version of `poll`."""
+        deadline: float = time.monotonic() + min(wait, self.max_wait)
+        job: MapJob | None = await self.aget(job_id)
+        while job is not None and not job.finished and time.monotonic() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            job = await self.aget(job_id)
+        return job
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+map_jobs = MapJobs(**settings.MAP_JOBS)
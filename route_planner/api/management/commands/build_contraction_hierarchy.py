@@ -0,0 +1,68 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.graph import RoadGraph
+from api.hierarchy import ContractionHierarchy
+from api.spatial import GridIndex
+
+
+def check_size(graph: RoadGraph, max_nodes: int):
+    if max_nodes and len(graph) > max_nodes:
+        raise CommandError(
+            f"Road graph has {len(graph)} nodes, over --max-nodes {max_nodes} its hierarchy is not built "
+            "(build time grows about quadratically), use smaller extract or hosted ORS backend."
+        )
+
+
+class Command(BaseCommand):
+    help = (
+        "It preprocesses road graph of local routing backend (see `build_road_graph`) - it builds contraction "
+        "hierarchy for fast route queries and spatial index of nodes for snapping of start/finish, both are saved "
+        "as memory-mapped files next to the graph. It has to be run again whenever the graph is rebuilt. "
+        "The hierarchy is built in pure Python and its build time grows about quadratically with the size "
+        "of the graph - seconds for city extracts (~25k nodes in ~20 s), minutes for ~100k nodes, hours for "
+        "regional or country extracts, which are refused over --max-nodes (local backend then routes by A* search "
+        "without the hierarchy, hosted ORS backend is recommended for them)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--directory",
+            default=settings.ROUTE_BACKEND["options"]["graph_dir"],
+            help="directory of the graph (default ROUTE_GRAPH_DIR)",
+        )
+        parser.add_argument(
+            "--settled-limit",
+            type=int,
+            default=500,
+            help="max. number of nodes settled by one witness search (lower is faster build, more shortcuts)",
+        )
+        parser.add_argument(
+            "--max-nodes",
+            type=int,
+            default=200000,
+            help="max. number of nodes of the graph whose hierarchy is built (0 = no limit)",
+        )
+        parser.add_argument("--cell-size", type=float, default=0.01, help="cell size of spatial index in degrees")
+
+    def handle(self, *args, **options):
+        if not options["directory"]:
+            raise CommandError("Directory of the graph is not set (--directory or ROUTE_GRAPH_DIR).")
+        try:
+            graph: RoadGraph = RoadGraph.load(options["directory"])
+        except FileNotFoundError:
+            raise CommandError(f"There is no road graph in {options['directory']}, run `build_road_graph` first.")
+        if graph.id is None:
+            raise CommandError("Road graph has no id (it is built by older version), run `build_road_graph` again.")
+        check_size(graph, options["max_nodes"])
+        started: float = time.monotonic()
+        GridIndex.build(graph.nodes, options["cell_size"], graph=graph.id).save(options["directory"])
+        hierarchy = ContractionHierarchy.build(graph, options["settled_limit"])
+        hierarchy.save(options["directory"])
+        self.stdout.write(
+            f"Contraction hierarchy with {len(hierarchy.arrays['ch_up_nodes'])} upward and "
+            f"{len(hierarchy.arrays['ch_down_nodes'])} downward edges is saved "
+            f"({time.monotonic() - started:.1f} s)."
+        )
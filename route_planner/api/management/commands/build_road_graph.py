@@ -0,0 +1,135 @@
+import typing
+
+import numpy as np
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.graph import RoadGraph, haversine
+
+
+# speeds (km/h) of road types, roads of other types are not routable
+SPEEDS: dict[str, dict[str, float]] = {
+    "driving-car": {
+        "motorway": 120,
+        "motorway_link": 60,
+        "trunk": 100,
+        "trunk_link": 50,
+        "primary": 80,
+        "primary_link": 40,
+        "secondary": 70,
+        "secondary_link": 35,
+        "tertiary": 60,
+        "tertiary_link": 30,
+        "unclassified": 50,
+        "residential": 30,
+        "living_street": 10,
+        "service": 20,
+    },
+    "driving-hgv": {
+        "motorway": 90,
+        "motorway_link": 50,
+        "trunk": 80,
+        "trunk_link": 45,
+        "primary": 70,
+        "primary_link": 35,
+        "secondary": 60,
+        "secondary_link": 30,
+        "tertiary": 50,
+        "tertiary_link": 25,
+        "unclassified": 40,
+        "residential": 25,
+        "service": 15,
+    },
+}
+ONEWAY: set[str] = {"yes", "true", "1"}
+REVERSED: set[str] = {"-1", "reverse"}
+NO_ACCESS: set[str] = {"no", "private"}
+
+
+def directions(tags: typing.Any) -> tuple[bool, bool]:
+    """It returns whether the way can be driven forward and backward."""
+    oneway: str = tags.get("oneway", "")
+    if oneway in REVERSED:
+        return False, True
+    implied: bool = tags.get("highway") == "motorway" or tags.get("junction") == "roundabout"
+    return True, not (oneway in ONEWAY or (implied and oneway != "no"))
+
+
+class RoadsCollector:
+    """It collects routable ways of OSM extract as edges between consecutive nodes of ways."""
+
+    def __init__(self, speeds: dict[str, float]):
+        self.speeds = speeds
+        self.node_ids: dict[int, int] = {}
+        self.coordinates: list[tuple[float, float]] = []
+        self.sources: list[int] = []
+        self.targets: list[int] = []
+        self.speed_values: list[float] = []
+
+    def node(self, node_id: int, long: float, lat: float) -> int:
+        index: int | None = self.node_ids.get(node_id)
+        if index is None:
+            index = self.node_ids[node_id] = len(self.coordinates)
+            self.coordinates.append((long, lat))
+        return index
+
+    def read(self, items: typing.Iterable[typing.Any]):
+        """It reads OSM objects (nodes with locations and ways)."""
+        for item in items:
+            if item.is_way():
+                self.way(item)
+
+    def way(self, way: typing.Any):
+        speed: float | None = self.speeds.get(way.tags.get("highway", ""))
+        if speed is None or way.tags.get("access", "") in NO_ACCESS:
+            return
+        forward, backward = directions(way.tags)
+        nodes: list[int] = [self.node(node.ref, node.lon, node.lat) for node in way.nodes if node.location.valid()]
+        for source, target in zip(nodes, nodes[1:]):
+            if forward:
+                self.edge(source, target, speed)
+            if backward:
+                self.edge(target, source, speed)
+
+    def edge(self, source: int, target: int, speed: float):
+        self.sources.append(source)
+        self.targets.append(target)
+        self.speed_values.append(speed)
+
+    def graph(self, meta: dict[str, typing.Any]) -> RoadGraph:
+        nodes = np.array(self.coordinates, dtype=np.float64).reshape(-1, 2)
+        sources = np.array(self.sources, dtype=np.int64)
+        targets = np.array(self.targets, dtype=np.int64)
+        distances = haversine(nodes[targets], nodes[sources, 0], nodes[sources, 1])
+        durations = distances / (np.array(self.speed_values, dtype=np.float64) / 3.6)
+        return RoadGraph.build(nodes, sources, targets, distances, durations, meta)
+
+
+class Command(BaseCommand):
+    help = (
+        "It builds road graph of local routing backend (ROUTE_BACKEND=local) from OSM extract (.osm.pbf), "
+        "it requires `osmium` package."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("extract", help="OSM extract (.osm.pbf or .osm)")
+        parser.add_argument(
+            "--directory",
+            default=settings.ROUTE_BACKEND["options"]["graph_dir"],
+            help="directory of the graph (default ROUTE_GRAPH_DIR)",
+        )
+        parser.add_argument("--profile", default="driving-car", choices=sorted(SPEEDS))
+
+    def handle(self, *args, **options):
+        try:
+            import osmium
+        except ImportError:
+            raise CommandError("Package `osmium` is required to read OSM extract (pip install osmium).")
+        if not options["directory"]:
+            raise CommandError("Directory of the graph is not set (--directory or ROUTE_GRAPH_DIR).")
+        collector = RoadsCollector(SPEEDS[options["profile"]])
+        collector.read(osmium.FileProcessor(options["extract"], osmium.osm.NODE | osmium.osm.WAY).with_locations())
+        graph: RoadGraph = collector.graph({"profile": options["profile"], "source": options["extract"]})
+        graph.save(options["directory"])
+        self.stdout.write(f"Road graph with {len(graph)} nodes and {len(graph.targets)} edges is saved.")
@@ -0,0 +1,83 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.cache import directions_cache
+from api.warmup import Lane, WarmupStats, read_lanes, route_warmup
+
+
+class Command(BaseCommand):
+    help = (
+        "It warms up hot lanes - routes of start/finish pairs from CSV (columns start_lat, start_long, finish_lat, "
+        "finish_long) or JSON lines file are found within the rate limit of ORS calls and stored in the directions "
+        "cache, maps of the routes are rendered into map artifacts. Lanes which are cached already are not requested "
+        "again, so interrupted warm-up continues where it stopped when it is run again. Run it by cron instead of "
+        "the warm-up scheduled in server processes (ROUTE_WARMUP_SCHEDULED=0) e.g. with gevent workers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "lanes",
+            nargs="?",
+            default=settings.ROUTE_WARMUP["lanes"],
+            help="file of lanes (default ROUTE_WARMUP_LANES)",
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=settings.ROUTE_WARMUP["rate"],
+            help="max. ORS calls per second, 0 = unlimited (default ROUTE_WARMUP_RATE)",
+        )
+        parser.add_argument("--burst", type=int, default=settings.ROUTE_WARMUP["burst"], help="max. ORS calls at once")
+        parser.add_argument(
+            "--concurrency", type=int, default=settings.ROUTE_WARMUP["concurrency"], help="lanes warmed up at once"
+        )
+        parser.add_argument("--no-maps", action="store_true", help="maps of the routes are not rendered")
+        parser.add_argument("--progress", type=float, default=5.0, help="seconds between two progress reports")
+
+    def handle(self, *args, **options):
+        lanes: list[Lane] = self.read_lanes(options["lanes"])
+        if not directions_cache.enabled or directions_cache.backend is None:
+            self.stderr.write(
+                "Directions cache has no shared backend (ROUTE_CACHE_DIR), routes found by this command are kept "
+                "only in its own process, only maps are warmed up for the server."
+            )
+        report = ProgressReport(self, options["progress"])
+        try:
+            stats: WarmupStats = route_warmup.run(
+                lanes,
+                report,
+                rate=options["rate"],
+                burst=options["burst"],
+                concurrency=options["concurrency"],
+                maps=not options["no_maps"],
+            )
+        except KeyboardInterrupt:
+            raise CommandError(f"Warm-up is interrupted after {report.last}, run it again to continue.")
+        self.stdout.write(f"Warm-up is finished: {stats}.")
+
+    @staticmethod
+    def read_lanes(path: str | None) -> list[Lane]:
+        if not path:
+            raise CommandError("File of lanes is not set (argument or ROUTE_WARMUP_LANES).")
+        try:
+            return read_lanes(path)
+        except (OSError, ValueError) as exc:
+            raise CommandError(str(exc))
+
+
+class ProgressReport:
+    """It writes progress of the warm-up at most once per `interval` seconds."""
+
+    def __init__(self, command: BaseCommand, interval: float):
+        self.command = command
+        self.interval = interval
+        self.last: WarmupStats | None = None
+        self._reported: float = time.monotonic()
+
+    def __call__(self, stats: WarmupStats):
+        self.last = stats
+        if time.monotonic() - self._reported >= self.interval:
+            self._reported = time.monotonic()
+            self.command.stdout.write(str(stats))
@@ -0,0 +1,126 @@
+import math
+import typing
+from dataclasses import dataclass
+
+from django.conf import settings
+
+from .aliases import Coordinate, Matrix, Point
+from .cache import matrix_cache
+from .snapping import point_snapper
+
+
+# (distance, duration) of one cell, None if there is no route
+Cell: typing.TypeAlias = tuple[float | None, float | None]
+Position: typing.TypeAlias = tuple[int, int]
+NO_ROUTE: Cell = (None, None)
+
+
+def max_tiles(locations: int | None = None) -> int:
+    """Max. number of tiles (upstream calls) of one matrix of the locations (max. allowed by default)."""
+    locations = settings.ROUTE_MATRIX["max_locations"] if locations is None else locations
+    return math.ceil(locations / settings.ROUTE_MATRIX["tile_size"]) ** 2
+
+
+def coordinate(point: Point | None) -> Coordinate:
+    point = typing.cast(Point, point)
+    return point.long, point.lat
+
+
+@dataclass
+class Tile:
+    """Part of matrix found by one call of routing backend - its sources (rows) and destinations (columns)."""
+
+    rows: list[int]
+    columns: list[int]
+
+
+class CostMatrix:
+    """Distance/duration matrix being assembled - cells are read from the cache first, only rows and columns
+    with missing cells are requested from routing backend in tiles of at most `tile_size` x `tile_size` cells.
+    Points are snapped (see `snapping`) and quantized the same way as for `find_routes`.
+
+    Args:
+        sources: source points
+        destinations: destination points
+        tile_size: max. number of sources (and destinations) of one tile
+        profile: routing profile of the cache keys
+    """
+
+    def __init__(self, sources: list[Point], destinations: list[Point], tile_size: int, profile: str):
+        self.sources: list[Point | None] = self.prepare(sources)
+        self.destinations: list[Point | None] = self.prepare(destinations)
+        self.tile_size = tile_size
+        self.cells: dict[Position, Cell] = {}
+        # unroutable points have no keys, there is no route from/to them
+        self.keys: dict[Position, str] = {
+            (row, column): matrix_cache.key(profile, source, destination)
+            for row, source in enumerate(self.sources)
+            if source is not None
+            for column, destination in enumerate(self.destinations)
+            if destination is not None
+        }
+
+    @staticmethod
+    def prepare(points: list[Point]) -> list[Point | None]:
+        return [matrix_cache.quantize(point) if point is not None else None for point in point_snapper.routable(points)]
+
+    def cached(self, found: dict[str, Cell]):
+        """It fills cells found in the cache."""
+        for position, key in self.keys.items():
+            if key in found:
+                self.cells[position] = found[key]
+
+    def tiles(self) -> list[Tile]:
+        """It splits missing cells into tiles."""
+        tiles: list[Tile | None] = [
+            self.tile(row, column)
+            for row in range(0, len(self.sources), self.tile_size)
+            for column in range(0, len(self.destinations), self.tile_size)
+        ]
+        return [tile for tile in tiles if tile is not None]
+
+    def tile(self, first_row: int, first_column: int) -> Tile | None:
+        missing: list[Position] = [
+            (row, column)
+            for row in range(first_row, min(first_row + self.tile_size, len(self.sources)))
+            for column in range(first_column, min(first_column + self.tile_size, len(self.destinations)))
+            if (row, column) in self.keys and (row, column) not in self.cells
+        ]
+        if not missing:
+            return None
+        return Tile(sorted({row for row, _ in missing}), sorted({column for _, column in missing}))
+
+    def coordinates(self, tile: Tile) -> tuple[list[Coordinate], list[Coordinate]]:
+        """It returns (long, lat) coordinates of sources and destinations of the tile (all are routable)."""
+        return (
+            [coordinate(self.sources[row]) for row in tile.rows],
+            [coordinate(self.destinations[column]) for column in tile.columns],
+        )
+
+    def fill(self, tile: Tile, matrix: Matrix) -> dict[str, Cell]:
+        """It fills cells of the tile found by routing backend.
+
+        Args:
+            tile: the tile
+            matrix: distances and durations of the tile
+
+        Returns:
+            new cells by cache keys
+        """
+        found: dict[str, Cell] = {}
+        for tile_row, row in enumerate(tile.rows):
+            for tile_column, column in enumerate(tile.columns):
+                cell: Cell = (matrix["distances"][tile_row][tile_column], matrix["durations"][tile_row][tile_column])
+                self.cells[row, column] = cell
+                found[self.keys[row, column]] = cell
+        return found
+
+    def result(self) -> Matrix:
+        positions: list[list[Cell]] = [
+            [self.cells.get((row, column), NO_ROUTE) for column in range(len(self.destinations))]
+            for row in range(len(self.sources))
+        ]
+        return {
+            "distances": [[cell[0] for cell in cells] for cells in positions],
+            "durations": [[cell[1] for cell in cells] for cells in positions],
+        }
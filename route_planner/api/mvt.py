@@ -0,0 +1,267 @@
+import math
+import typing
+
+import numpy as np
+import numpy.typing as npt
+
+from .polyline import Coordinates
+
+
+# latitude of the edge of web mercator world
+MAX_LAT: float = 85.0511287798
+LINESTRING: int = 2
+MOVE_TO: int = 1
+LINE_TO: int = 2
+
+# (x0, y0, x1, y1) in web mercator units (the world is 1 x 1, y grows to the south)
+Box: typing.TypeAlias = tuple[float, float, float, float]
+# properties and parts of the line (arrays of tile coordinates) of the feature
+Feature: typing.TypeAlias = tuple[dict[str, str], list[npt.NDArray[np.int64]]]
+
+
+def pixel_size(zoom: int) -> float:
+    """It returns size of one pixel (256px tiles) at the zoom level in web mercator units."""
+    return 1.0 / (256 * 2**zoom)
+
+
+def mercator(coordinates: Coordinates) -> npt.NDArray[np.float64]:
+    """It projects (long, lat) coordinates to web mercator units.
+
+    Args:
+        coordinates: array of (long, lat[, elevation]) coordinates
+
+    Returns:
+        array of (x, y) in [0, 1]
+    """
+    lat = np.radians(np.clip(coordinates[:, 1], -MAX_LAT, MAX_LAT))
+    x = (coordinates[:, 0] + 180.0) / 360.0
+    y = 0.5 - np.log(np.tan(math.pi / 4 + lat / 2)) / (2 * math.pi)
+    return np.column_stack((x, y))
+
+
+def tile_box(zoom: int, x: int, y: int, buffer: float = 0.0) -> Box:
+    """It returns the box of the tile, widened by buffer given as a fraction of the tile."""
+    size: float = 1.0 / 2**zoom
+    return (x - buffer) * size, (y - buffer) * size, (x + 1 + buffer) * size, (y + 1 + buffer) * size
+
+
+def segment_distances(
+    points: npt.NDArray[np.float64], starts: npt.NDArray[np.float64], ends: npt.NDArray[np.float64]
+) -> npt.NDArray[np.float64]:
+    """It computes planar distances of points from their segments (row by row)."""
+    segments = ends - starts
+    length2 = np.einsum("ij,ij->i", segments, segments)
+    position = np.einsum("ij,ij->i", points - starts, segments) / np.where(length2 > 0.0, length2, 1.0)
+    return np.hypot(*(points - starts - np.clip(position, 0.0, 1.0)[:, np.newaxis] * segments).T)
+
+
+def _farthest(
+    points: npt.NDArray[np.float64], firsts: npt.NDArray[np.int64], lasts: npt.NDArray[np.int64]
+) -> tuple[npt.NDArray[np.int64], npt.NDArray[np.float64]]:
+    """It finds the farthest point between first and last point of every range at once."""
+    counts = lasts - firsts - 1
+    owners = np.repeat(np.arange(firsts.size), counts)
+    offsets = np.cumsum(counts) - counts
+    indexes = firsts[owners] + 1 + np.arange(owners.size) - offsets[owners]
+    distances = segment_distances(points[indexes], points[firsts[owners]], points[lasts[owners]])
+    maxima = np.maximum.reduceat(distances, offsets)
+    at_max = np.flatnonzero(distances == maxima[owners])
+    _, first_max = np.unique(owners[at_max], return_index=True)
+    return indexes[at_max[first_max]], maxima
+
+
+def importance(points: npt.NDArray[np.float64], tolerance: float) -> npt.NDArray[np.float64]:
+    """Douglas–Peucker tolerance of every point - simplification with any tolerance keeps exactly the points
+    more important than the tolerance, so the line is simplified once for all zoom levels.
+    All ranges of one level of the recursion are split at once.
+
+    Args:
+        points: array of (x, y) coordinates
+        tolerance: the smallest tolerance, less important points get zero
+
+    Returns:
+        importance of the points, infinite for the first and the last point
+    """
+    result = np.zeros(len(points))
+    result[[0, -1]] = np.inf
+    firsts, lasts = np.array([0]), np.array([len(points) - 1])
+    limits = np.array([np.inf])
+    while firsts.size:
+        ranges = lasts - firsts > 1
+        firsts, lasts, limits = firsts[ranges], lasts[ranges], limits[ranges]
+        if not firsts.size:
+            break
+        splits, maxima = _farthest(points, firsts, lasts)
+        split = maxima > tolerance
+        # point is never more important than its parent, so simplified lines are nested
+        values = np.minimum(maxima, limits)[split]
+        splits = splits[split]
+        result[splits] = values
+        firsts = np.concatenate((firsts[split], splits))
+        lasts = np.concatenate((splits, lasts[split]))
+        limits = np.concatenate((values, values))
+    return result
+
+
+def tile_source(coordinates: Coordinates, tolerance: float) -> npt.NDArray[np.float64]:
+    """It projects the line and it keeps only points visible at some zoom level.
+
+    Args:
+        coordinates: array of (long, lat[, elevation]) coordinates
+        tolerance: the smallest tolerance (pixel at the max. zoom level)
+
+    Returns:
+        array of (x, y, importance)
+    """
+    if len(coordinates) < 2:
+        return np.empty((0, 3))
+    points = mercator(coordinates)
+    weights = importance(points, tolerance)
+    kept = weights > 0.0
+    return np.column_stack((points[kept], weights[kept]))
+
+
+def _clip_segments(
+    starts: npt.NDArray[np.float64], segments: npt.NDArray[np.float64], box: Box
+) -> tuple[npt.NDArray[np.float64], npt.NDArray[np.float64]]:
+    """Liang–Barsky clipping of all segments at once.
+
+    Returns:
+        parameters where segments enter and leave the box, segment is outside if it leaves before it enters
+    """
+    enter, leave = np.zeros(len(starts)), np.ones(len(starts))
+    x0, y0, x1, y1 = box
+    edges = (
+        (-segments[:, 0], starts[:, 0] - x0),
+        (segments[:, 0], x1 - starts[:, 0]),
+        (-segments[:, 1], starts[:, 1] - y0),
+        (segments[:, 1], y1 - starts[:, 1]),
+    )
+    for direction, gap in edges:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = gap / direction
+        enter = np.where(direction < 0, np.maximum(enter, ratio), enter)
+        leave = np.where(direction > 0, np.minimum(leave, ratio), leave)
+        # parallel to the edge and outside of it
+        leave = np.where((direction == 0) & (gap < 0), -1.0, leave)
+    return enter, leave
+
+
+def clip(points: npt.NDArray[np.float64], box: Box) -> list[npt.NDArray[np.float64]]:
+    """It clips the line by the box.
+
+    Args:
+        points: array of (x, y) coordinates
+        box: clipping box
+
+    Returns:
+        parts of the line within the box
+    """
+    if len(points) < 2:
+        return []
+    starts, segments = points[:-1], np.diff(points, axis=0)
+    enter, leave = _clip_segments(starts, segments, box)
+    visible = np.flatnonzero(enter <= leave)
+    if not visible.size:
+        return []
+    # part continues if the previous segment is visible and both are not cut between them
+    continued = np.zeros(len(visible), dtype=bool)
+    continued[1:] = (np.diff(visible) == 1) & (leave[visible[:-1]] >= 1.0) & (enter[visible[1:]] <= 0.0)
+    counts = 2 - continued
+    ends = np.cumsum(counts) - 1
+    result = np.empty((int(counts.sum()), 2))
+    result[ends] = starts[visible] + leave[visible, np.newaxis] * segments[visible]
+    beginnings = ends[~continued] - 1
+    result[beginnings] = (starts[visible] + enter[visible, np.newaxis] * segments[visible])[~continued]
+    return np.split(result, beginnings[1:])
+
+
+def quantize(part: npt.NDArray[np.float64], zoom: int, x: int, y: int, extent: int) -> npt.NDArray[np.int64]:
+    """It converts the part of the line to integer tile coordinates without repeated points."""
+    scale: float = 2**zoom * extent
+    coordinates = np.rint((part - (x / 2**zoom, y / 2**zoom)) * scale).astype(np.int64)
+    moved = np.ones(len(coordinates), dtype=bool)
+    moved[1:] = np.any(coordinates[1:] != coordinates[:-1], axis=1)
+    return coordinates[moved]
+
+
+def varints(values: npt.NDArray[np.uint64]) -> bytes:
+    """It encodes unsigned integers as protobuf varints at once."""
+    values = np.asarray(values, dtype=np.uint64)
+    shifts = (7 * np.arange(10)).astype(np.uint64)
+    groups = values[:, np.newaxis] >> shifts
+    lengths = np.maximum((groups != 0).sum(axis=1), 1)
+    positions = np.arange(10)
+    more = positions < (lengths - 1)[:, np.newaxis]
+    data = ((groups & np.uint64(0x7F)) | (more * np.uint64(0x80))).astype(np.uint8)
+    return data[positions < lengths[:, np.newaxis]].tobytes()
+
+
+def zigzag(values: npt.NDArray[np.int64]) -> npt.NDArray[np.uint64]:
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def _key(field: int, wire_type: int) -> bytes:
+    return varints(np.array([field << 3 | wire_type]))
+
+
+def _uint(field: int, value: int) -> bytes:
+    return _key(field, 0) + varints(np.array([value]))
+
+
+def _message(field: int, payload: bytes) -> bytes:
+    return _key(field, 2) + varints(np.array([len(payload)])) + payload
+
+
+def geometry(parts: list[npt.NDArray[np.int64]]) -> npt.NDArray[np.uint64]:
+    """It encodes parts of the line as MVT geometry commands.
+
+    Args:
+        parts: arrays of (x, y) tile coordinates, every part has 2 points at least
+
+    Returns:
+        command integers
+    """
+    points = np.concatenate(parts)
+    # cursor is not reset between parts
+    deltas = zigzag(np.diff(points, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))).ravel()
+    starts = np.cumsum([0] + [len(part) for part in parts[:-1]])
+    commands = np.empty(2 * len(parts), dtype=np.uint64)
+    commands[0::2] = 1 << 3 | MOVE_TO
+    commands[1::2] = np.array([len(part) - 1 for part in parts], dtype=np.uint64) << np.uint64(3) | np.uint64(LINE_TO)
+    return np.insert(deltas, np.column_stack((2 * starts, 2 * starts + 2)).ravel(), commands)
+
+
+def encode_tile(name: str, features: list[Feature], extent: int = 4096) -> bytes:
+    """It encodes one layer of line features as Mapbox Vector Tile (version 2).
+
+    Args:
+        name: name of the layer
+        features: properties and parts of the lines
+        extent: size of the tile in tile coordinates
+
+    Returns:
+        protobuf encoded tile, empty if there is no feature
+    """
+    if not features:
+        return b""
+    keys: dict[str, int] = {}
+    values: dict[str, int] = {}
+    layer: list[bytes] = [_uint(15, 2), _message(1, name.encode("utf8"))]
+    for feature_id, (properties, parts) in enumerate(features, start=1):
+        tags = [
+            index
+            for key, value in properties.items()
+            for index in (keys.setdefault(key, len(keys)), values.setdefault(value, len(values)))
+        ]
+        feature = (
+            _uint(1, feature_id)
+            + _message(2, varints(np.array(tags, dtype=np.uint64)))
+            + _uint(3, LINESTRING)
+            + _message(4, varints(geometry(parts)))
+        )
+        layer.append(_message(2, feature))
+    layer.extend(_message(3, key.encode("utf8")) for key in keys)
+    layer.extend(_message(4, _message(1, value.encode("utf8"))) for value in values)
+    layer.append(_uint(5, extent))
+    return _message(3, b"".join(layer))
@@ -1,6 +1,13 @@
+import typing
+
+from pydantic import Field
 from ninja import Schema
 
-from .aliases import Point, Routes, GeoJson
+from django.conf import settings
+
+from .aliases import Point, Routes
+from .geometry import LineString
+from .simplify import SimplifyOptions
 
 
 class RouteQuestion(Schema):
@@ -8,28 +15,123 @@ class RouteQuestion(Schema):
     finish: Point
 
 
+class BatchRouteQuestion(Schema):
+    pairs: list[RouteQuestion] = Field(min_length=1, max_length=settings.ROUTE_BATCH["max_pairs"])
+
+
 class RoutesAnswer(Schema):
     start: Point
     finish: Point
     routes: Routes
 
 
-class GeoJsonQuestion(Schema):
+class MatrixQuestion(Schema):
+    sources: list[Point] = Field(min_length=1, max_length=settings.ROUTE_MATRIX["max_locations"])
+    destinations: list[Point] | None = Field(
+        default=None,
+        min_length=1,
+        max_length=settings.ROUTE_MATRIX["max_locations"],
+        description="Destinations of the routes, sources are used if they are not set.",
+    )
+
+
+class MatrixAnswer(Schema):
+    sources: list[Point]
+    destinations: list[Point]
+    distances: list[list[float | None]] = Field(description="Meters by source and destination, null if no route.")
+    durations: list[list[float | None]] = Field(description="Seconds by source and destination, null if no route.")
+
+
+class TourQuestion(Schema):
+    depot: Point
+    stops: list[Point] = Field(min_length=1, max_length=settings.ROUTE_OPTIMIZE["max_stops"])
+    round_trip: bool = Field(default=True, description="The tour returns to the depot.")
+    title: str = "Optimized tour"
+    route_title: str = "Tour"
+
+
+class TourAnswer(Schema):
+    order: list[int] = Field(description="Indexes of stops in the order of the tour.")
+    stops: list[Point] = Field(description="Stops in the order of the tour.")
+    distance: float = Field(description="Meters of the whole tour.")
+    duration: float = Field(description="Seconds of the whole tour.")
+    map: str
+
+
+class FuelQuestion(Schema):
+    start: Point
+    finish: Point
+    vehicle_range: float = Field(default=settings.FUEL["vehicle_range"], gt=0, description="Miles on full tank.")
+    mpg: float = Field(default=settings.FUEL["mpg"], gt=0, description="Miles per gallon of the vehicle.")
+
+
+class FuelStop(Schema):
+    name: str
+    lat: float
+    long: float
+    price: float = Field(description="Price of one gallon.")
+    position: float = Field(description="Miles from the start of the route.")
+    gallons: float = Field(description="Gallons bought at the station.")
+    cost: float
+
+
+class FuelAnswer(Schema):
+    start: Point
+    finish: Point
+    distance: float = Field(description="Miles of the route.")
+    gallons: float = Field(description="Gallons bought on the route, the vehicle starts with full tank.")
+    cost: float = Field(description="Money spent on fuel.")
+    stops: list[FuelStop]
+
+
+class CorridorQuestion(Schema):
+    geometry: str = Field(description="Geometry string read from route data structure returned from `/routes`.")
+    points: list[Point] = Field(min_length=1, max_length=settings.ROUTE_CORRIDOR["max_points"])
+    distance: float = Field(
+        gt=0, le=settings.ROUTE_CORRIDOR["max_distance"], description="Max. meters of the points from the route."
+    )
+
+
+class CorridorPoint(Schema):
+    index: int = Field(description="Index of the point in the request.")
+    point: Point
+    distance: float = Field(description="Meters from the route.")
+    position: float = Field(description="Meters from the start of the route to the nearest place of the route.")
+
+
+class CorridorAnswer(Schema):
+    points: list[CorridorPoint] = Field(description="Points within the distance, in the order along the route.")
+
+
+class SimplifyQuestion(Schema):
+    tolerance: float | None = Field(
+        default=None, gt=0, description="Max. deviation of simplified route from the original one in degrees."
+    )
+    max_points: int | None = Field(default=None, ge=2, description="Max. number of points of simplified route.")
+    zoom: int | None = Field(
+        default=None, ge=0, le=22, description="Zoom level of the map, details smaller than a pixel are removed."
+    )
+
+    def simplify_options(self) -> SimplifyOptions:
+        return SimplifyOptions(tolerance=self.tolerance, max_points=self.max_points, zoom=self.zoom)
+
+
+class GeoJsonQuestion(SimplifyQuestion):
     geometry: str
 
 
 class GeoJsonAnswer(Schema):
-    geojson: GeoJson
+    geojson: LineString
 
 
-class MapFromGeoJsonQuestion(Schema):
-    geojson: GeoJson
+class MapFromGeoJsonQuestion(SimplifyQuestion):
+    geojson: LineString
     title: str = "Default map title"
     route_title: str = "Default route title"
     filename: str = "default_filename.html"
 
 
-class MapQuestion(Schema):
+class MapQuestion(SimplifyQuestion):
     start: Point
     finish: Point
     title: str = "Default map title"
@@ -38,3 +140,42 @@ class MapQuestion(Schema):
 
 class MapAnswer(Schema):
     map: str
+    id: str | None = Field(default=None, description="Id of the map, its routes can be changed by `/maps/{id}`.")
+
+
+class MapLayerQuestion(Schema):
+    geometry: str = Field(description="Geometry string read from route data structure returned from `/routes`.")
+    title: str = Field(default="Driving path", description="Tooltip of the route.")
+
+
+class ComposeMapQuestion(SimplifyQuestion):
+    routes: list[MapLayerQuestion] = Field(min_length=1, max_length=settings.MAP_COMPOSITION["max_layers"])
+    title: str = "Composed map"
+    filename: str = "map.html"
+
+
+class UpdateMapQuestion(SimplifyQuestion):
+    title: str | None = Field(default=None, description="New title of the map.")
+    add: list[MapLayerQuestion] = Field(default=[], max_length=settings.MAP_COMPOSITION["max_layers"])
+    remove: list[str] = Field(default=[], description="Ids of removed routes (layers).")
+
+
+class MapLayerAnswer(Schema):
+    id: str
+    title: str
+
+
+class CompositionAnswer(Schema):
+    id: str = Field(description="Id of the map, it changes with every change of the map.")
+    title: str
+    map: str
+    layers: list[MapLayerAnswer]
+    tiles: str = Field(description="URL template of vector tiles (Mapbox Vector Tile) of the routes.")
+    tiled_map: str = Field(description="URL of the map which loads only vector tiles in view instead of whole routes.")
+
+
+class MapJobAnswer(Schema):
+    id: str
+    status: str = Field(description="State of the job - pending, done or failed.")
+    map: str | None = Field(default=None, description="URL of the map when the job is done.")
+    errors: list[dict[str, typing.Any]] | None = None
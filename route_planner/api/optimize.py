@@ -0,0 +1,150 @@
+import time
+import typing
+
+import numpy as np
+import numpy.typing as npt
+
+
+# cost of missing route (e.g. against one-way street), the tour avoids it if it can
+PENALTY: float = 1e9
+# max. number of consecutive stops moved at once by Or-opt
+OR_OPT_SEGMENT: int = 3
+
+Costs: typing.TypeAlias = npt.NDArray[np.float64]
+
+
+def cost_array(durations: list[list[float | None]], round_trip: bool) -> tuple[Costs, int]:
+    """It creates costs of the tour search - missing routes are penalized. The tour is a path with fixed ends,
+    it ends at the depot (0) for round trip, otherwise at added node which is reached from any stop for free.
+
+    Args:
+        durations: durations by source and destination, depot is the first location
+        round_trip: tour returns to the depot
+
+    Returns:
+        costs and the last node of the path
+    """
+    costs: Costs = np.nan_to_num(np.array(durations, dtype=np.float64), nan=PENALTY)
+    if round_trip:
+        return costs, 0
+    size: int = len(costs)
+    open_costs: Costs = np.full((size + 1, size + 1), PENALTY)
+    open_costs[:size, :size] = costs
+    open_costs[:size, size] = 0.0
+    return open_costs, size
+
+
+def nearest_neighbour(costs: Costs, stops: int) -> list[int]:
+    """It builds the initial tour - the nearest not visited stop is always the next one."""
+    tour: list[int] = [0]
+    visited = np.zeros(len(costs), dtype=bool)
+    visited[0] = True
+    visited[stops + 1 :] = True
+    for _ in range(stops):
+        candidates = np.where(visited, np.inf, costs[tour[-1]])
+        tour.append(int(np.argmin(candidates)))
+        visited[tour[-1]] = True
+    return tour
+
+
+def path_cost(costs: Costs, path: list[int]) -> float:
+    return float(costs[path[:-1], path[1:]].sum())
+
+
+def two_opt(costs: Costs, path: list[int], deadline: float) -> bool:
+    """It reverses the best segment of the path (in place) if it makes the path cheaper. Costs may be asymmetric,
+    so the reversed segment is priced in both directions (by prefix sums).
+
+    Args:
+        costs: costs between nodes
+        path: the path with fixed ends
+        deadline: time.monotonic() when the search stops
+
+    Returns:
+        whether the path is improved
+    """
+    nodes = np.array(path)
+    forward = np.concatenate(([0.0], np.cumsum(costs[nodes[:-1], nodes[1:]])))
+    backward = np.concatenate(([0.0], np.cumsum(costs[nodes[1:], nodes[:-1]])))
+    for first in range(1, len(path) - 2):
+        if time.monotonic() > deadline:
+            return False
+        lasts = np.arange(first + 1, len(path) - 1)
+        delta = (
+            costs[nodes[first - 1], nodes[lasts]]
+            + costs[nodes[first], nodes[lasts + 1]]
+            - costs[nodes[first - 1], nodes[first]]
+            - costs[nodes[lasts], nodes[lasts + 1]]
+            + (backward[lasts] - backward[first])
+            - (forward[lasts] - forward[first])
+        )
+        best: int = int(np.argmin(delta))
+        if delta[best] < -1e-9:
+            last: int = int(lasts[best])
+            path[first : last + 1] = path[first : last + 1][::-1]
+            return True
+    return False
+
+
+def or_opt(costs: Costs, path: list[int], deadline: float) -> bool:
+    """It moves the first segment of 1 - 3 consecutive stops (in place) whose move to other place
+    makes the path cheaper.
+
+    Args:
+        costs: costs between nodes
+        path: the path with fixed ends
+        deadline: time.monotonic() when the search stops
+
+    Returns:
+        whether the path is improved
+    """
+    for length in range(1, OR_OPT_SEGMENT + 1):
+        for first in range(1, len(path) - length):
+            if time.monotonic() > deadline:
+                return False
+            if _move_segment(costs, path, first, length):
+                return True
+    return False
+
+
+def _move_segment(costs: Costs, path: list[int], first: int, length: int) -> bool:
+    nodes = np.array(path)
+    last: int = first + length - 1
+    removal: float = (
+        costs[nodes[first - 1], nodes[first]]
+        + costs[nodes[last], nodes[last + 1]]
+        - costs[nodes[first - 1], nodes[last + 1]]
+    )
+    # the segment is inserted between `after` and the following node of the path without the segment
+    rest = np.concatenate((nodes[:first], nodes[last + 1 :]))
+    after = np.arange(len(rest) - 1)
+    insertion = (
+        costs[rest[after], nodes[first]] + costs[nodes[last], rest[after + 1]] - costs[rest[after], rest[after + 1]]
+    )
+    insertion[first - 1] = np.inf  # the original place
+    best: int = int(np.argmin(insertion))
+    if insertion[best] - removal >= -1e-9:
+        return False
+    segment: list[int] = path[first : last + 1]
+    path[:] = [*rest[: best + 1].tolist(), *segment, *rest[best + 1 :].tolist()]
+    return True
+
+
+def solve(durations: list[list[float | None]], time_budget: float, round_trip: bool = True) -> list[int]:
+    """It finds fast order of stops - nearest neighbour tour improved by 2-opt and Or-opt moves
+    until no move helps or the time budget is spent. It is CPU bound, so it runs in process pool.
+
+    Args:
+        durations: durations by source and destination, depot is the first location, stops follow
+        time_budget: max. seconds of improving
+        round_trip: tour returns to the depot
+
+    Returns:
+        indexes of stops (1 - n) in the order of the tour
+    """
+    deadline: float = time.monotonic() + time_budget
+    costs, end = cost_array(durations, round_trip)
+    path: list[int] = nearest_neighbour(costs, len(durations) - 1) + [end]
+    while time.monotonic() < deadline and (two_opt(costs, path, deadline) or or_opt(costs, path, deadline)):
+        pass
+    return path[1:-1]
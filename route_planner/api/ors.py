@@ -1,9 +1,20 @@
+import asyncio
+import random
+import time
+import typing
+
+import httpx
 from openrouteservice import Client
 from openrouteservice.directions import directions
-from openrouteservice.convert import decode_polyline
+from openrouteservice.distance_matrix import distance_matrix
+from openrouteservice.exceptions import ApiError, HTTPError, Timeout
 
 from django.conf import settings
-from .aliases import BoundingBox, Directions, GeoJson
+from .aliases import BoundingBox, Coordinate, Directions, Matrix
+from .upstream import record_upstream_call
+from .resilience import ResilientUpstream
+from .quota import ors_quota
+from .polyline import Coordinates, decode, decode_many
 
 
 osr_client = Client(
@@ -13,6 +24,88 @@ osr_client = Client(
 )
 
 
+class AsyncClient:
+    """Async counterpart of `openrouteservice.Client`, it keeps pool of keep-alive HTTP connections,
+    so that many ORS calls can be in flight within one event loop. It retries the same way as sync client.
+    """
+
+    base_url: str = "https://api.openrouteservice.org"
+    retriable_statuses: set[int] = {429, 503}
+
+    def __init__(self, key: str | None, timeout: float, retry_timeout: float, max_connections: int = 100):
+        self.key = key
+        self.timeout = timeout
+        self.retry_timeout = retry_timeout
+        self.max_connections = max_connections
+        self._session: httpx.AsyncClient | None = None
+
+    @property
+    def session(self) -> httpx.AsyncClient:
+        # it is created lazily to be bound to running event loop
+        if self._session is None or self._session.is_closed:
+            self._session = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                headers={"Authorization": self.key or "", "Content-Type": "application/json; charset=utf-8"},
+                limits=httpx.Limits(
+                    max_connections=self.max_connections, max_keepalive_connections=self.max_connections
+                ),
+            )
+        return self._session
+
+    async def request(self, url: str, post_json: dict[str, typing.Any]) -> typing.Any:
+        """It performs HTTP POST and returns decoded JSON body.
+
+        Args:
+            url: URL path of the request
+            post_json: body of the request
+
+        Returns:
+            decoded JSON body
+        """
+        first_request_time: float = time.monotonic()
+        retry_counter: int = 0
+        while True:
+            try:
+                response: httpx.Response = await self.session.post(url, json=post_json)
+            except httpx.TimeoutException:
+                raise Timeout()
+            elapsed: float = time.monotonic() - first_request_time
+            if response.status_code not in self.retriable_statuses or elapsed > self.retry_timeout:
+                return self.get_body(response)
+            retry_counter += 1
+            await asyncio.sleep(1.5 ** (retry_counter - 1) * (random.random() + 0.5))
+
+    @staticmethod
+    def get_body(response: httpx.Response) -> typing.Any:
+        try:
+            body = response.json()
+        except ValueError:
+            raise HTTPError(response.status_code)
+        if response.status_code != 200:
+            raise ApiError(response.status_code, body)
+        return body
+
+    async def aclose(self):
+        if self._session is not None:
+            await self._session.aclose()
+            self._session = None
+
+
+aors_client = AsyncClient(
+    key=settings.ROUTE["api_key"],
+    timeout=settings.ROUTE["timeout"],
+    retry_timeout=settings.ROUTE["retry_timeout"],
+    max_connections=settings.ROUTE["max_connections"],
+)
+
+# quota is acquired before the call, so waiting for it is not mistaken for slow ORS, hedges do not wait for it,
+# admitted calls are counted to the request, hedged ones apart (they are not part of budgets of handlers)
+ors_upstream = ResilientUpstream(
+    admit_hedge=ors_quota.try_acquire, record_call=record_upstream_call, **settings.ROUTE_RESILIENCE
+)
+
+
 def find_routes(coordinates: BoundingBox, include_bbox: bool = False, include_metadata: bool = False) -> Directions:
     """
     It receives coordinates of start and end of a required path and returns
@@ -26,7 +119,12 @@ def find_routes(coordinates: BoundingBox, include_bbox: bool = False, include_me
     Returns:
         list of routes (more structured)
     """
-    found_routes: Directions = directions(osr_client, coordinates, profile=settings.ROUTE["profile"])
+
+    def request() -> Directions:
+        return directions(osr_client, coordinates, profile=settings.ROUTE["profile"])
+
+    ors_quota.acquire()
+    found_routes: Directions = ors_upstream.call(request, hedge=True)
     return {
         "bbox": found_routes["bbox"] if include_bbox else None,
         "routes": found_routes["routes"],
@@ -34,13 +132,102 @@ def find_routes(coordinates: BoundingBox, include_bbox: bool = False, include_me
     }
 
 
-def extract_points(polyline: str) -> GeoJson:
-    """Extract geo json structure from polyline - encoded string.
+async def afind_routes(
+    coordinates: BoundingBox, include_bbox: bool = False, include_metadata: bool = False
+) -> Directions:
+    """Async version of `find_routes`, it does not block event loop while waiting for ORS.
+
+    Args:
+        coordinates: ((startX, startY), (endX, endY))
+        include_bbox: flag -> true if bbox should be returned
+        include_metadata: flag -> true if metadata should be returned
+
+    Returns:
+        list of routes (more structured)
+    """
+    url: str = f"/v2/directions/{settings.ROUTE['profile']}/json"
+
+    async def request() -> Directions:
+        return await aors_client.request(url, {"coordinates": coordinates})
+
+    await ors_quota.aacquire()
+    found_routes: Directions = await ors_upstream.acall(request, hedge=True)
+    return {
+        "bbox": found_routes["bbox"] if include_bbox else None,
+        "routes": found_routes["routes"],
+        "metadata": found_routes["metadata"] if include_metadata else None,
+    }
+
+
+def matrix_request(sources: list[Coordinate], destinations: list[Coordinate]) -> dict[str, typing.Any]:
+    """It creates parameters of ORS matrix call - sources are followed by destinations in locations."""
+    return {
+        "locations": [list(location) for location in (*sources, *destinations)],
+        "sources": list(range(len(sources))),
+        "destinations": list(range(len(sources), len(sources) + len(destinations))),
+        "metrics": ["distance", "duration"],
+    }
+
+
+def find_matrix(sources: list[Coordinate], destinations: list[Coordinate]) -> Matrix:
+    """It finds distances and durations from all sources to all destinations by one ORS call.
+
+    Args:
+        sources: (long, lat) coordinates of sources
+        destinations: (long, lat) coordinates of destinations
+
+    Returns:
+        distances and durations by source and destination
+    """
+
+    def request() -> dict[str, typing.Any]:
+        return distance_matrix(osr_client, profile=settings.ROUTE["profile"], **matrix_request(sources, destinations))
+
+    # matrix calls are not hedged, they are the most expensive ones
+    ors_quota.acquire()
+    found_matrix: dict[str, typing.Any] = ors_upstream.call(request)
+    return {"distances": found_matrix["distances"], "durations": found_matrix["durations"]}
+
+
+async def afind_matrix(sources: list[Coordinate], destinations: list[Coordinate]) -> Matrix:
+    """Async version of `find_matrix`.
+
+    Args:
+        sources: (long, lat) coordinates of sources
+        destinations: (long, lat) coordinates of destinations
+
+    Returns:
+        distances and durations by source and destination
+    """
+    url: str = f"/v2/matrix/{settings.ROUTE['profile']}"
+
+    async def request() -> dict[str, typing.Any]:
+        return await aors_client.request(url, matrix_request(sources, destinations))
+
+    await ors_quota.aacquire()
+    found_matrix: dict[str, typing.Any] = await ors_upstream.acall(request)
+    return {"distances": found_matrix["distances"], "durations": found_matrix["durations"]}
+
+
+def extract_coordinates(polyline: str) -> Coordinates:
+    """Extract coordinates from polyline - encoded string.
 
     Args:
         polyline: encoded route geometry
 
     Returns:
-        geo json data structure
+        array of (long, lat) coordinates
+    """
+    return decode(polyline)
+
+
+def extract_coordinates_many(polylines: list[str]) -> list[Coordinates]:
+    """Extract coordinates of many polylines at once.
+
+    Args:
+        polylines: encoded route geometries
+
+    Returns:
+        list of arrays of (long, lat) coordinates
     """
-    return decode_polyline(polyline, False)
+    return decode_many(polylines)
@@ -0,0 +1,152 @@
+import typing
+
+import numpy as np
+import numpy.typing as npt
+
+from .aliases import GeoJson
+
+
+# decoded polyline - contiguous array of (long, lat) or (long, lat, elevation) rows
+Coordinates: typing.TypeAlias = npt.NDArray[np.float64]
+
+
+class InvalidPolyline(ValueError):
+    """Polyline is not a valid encoded route geometry (e.g. it is truncated or it has non-ASCII characters)."""
+
+    def __init__(self):
+        super().__init__("Invalid polyline.")
+
+
+def _characters(polyline: str) -> npt.NDArray[np.uint8]:
+    try:
+        return np.frombuffer(polyline.encode("ascii"), dtype=np.uint8)
+    except UnicodeEncodeError:
+        raise InvalidPolyline()
+
+
+def _varints(data: npt.NDArray[np.uint8]) -> npt.NDArray[np.int64]:
+    """It decodes all zig-zag encoded integers from polyline characters at once.
+
+    Every character carries 5 bits, the last character of the integer is the one lower than 0x20.
+
+    Args:
+        data: polyline characters
+
+    Returns:
+        decoded integers (deltas of coordinates)
+    """
+    chunks: npt.NDArray[np.int64] = data.astype(np.int64) - 63
+    if chunks.size == 0:
+        return chunks
+    if chunks.min() < 0 or chunks.max() > 0x3F or chunks[-1] >= 0x20:
+        raise InvalidPolyline()
+    ends = np.flatnonzero(chunks < 0x20)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    shifts = 5 * (np.arange(chunks.size) - np.repeat(starts, ends - starts + 1))
+    values = np.add.reduceat((chunks & 0x1F) << shifts, starts)
+    return np.where(values & 1, ~(values >> 1), values >> 1)
+
+
+def _scale(points: npt.NDArray[np.int64], is3d: bool) -> Coordinates:
+    # polyline stores (lat, long[, elevation]) while ORS points are (long, lat[, elevation])
+    coordinates: Coordinates = np.empty(points.shape, dtype=np.float64)
+    np.divide(points[:, 1], 1e5, out=coordinates[:, 0])
+    np.divide(points[:, 0], 1e5, out=coordinates[:, 1])
+    if is3d:
+        # numpy rounds halves differently, elevation is rounded the same way as ORS does
+        coordinates[:, 2] = [round(elevation, 1) for elevation in (points[:, 2] * 1e-2).tolist()]
+    return coordinates
+
+
+def _deltas(data: npt.NDArray[np.uint8], is3d: bool) -> npt.NDArray[np.int64]:
+    values = _varints(data)
+    dimension: int = 3 if is3d else 2
+    if values.size % dimension:
+        raise InvalidPolyline()
+    return values.reshape(-1, dimension)
+
+
+def decode(polyline: str, is3d: bool = False) -> Coordinates:
+    """It decodes polyline (encoded route geometry) into array of coordinates,
+    values are the same as `openrouteservice.convert.decode_polyline` returns.
+
+    Args:
+        polyline: encoded route geometry
+        is3d: true if geometry contains elevation
+
+    Returns:
+        array of shape (N, 2) or (N, 3), `InvalidPolyline` is raised if the polyline is not valid
+    """
+    deltas = _deltas(_characters(polyline), is3d)
+    return _scale(np.cumsum(deltas, axis=0), is3d)
+
+
+def decode_many(polylines: typing.Sequence[str], is3d: bool = False) -> list[Coordinates]:
+    """It decodes many polylines in one pass, e.g. geometries of all found routes.
+
+    Args:
+        polylines: encoded route geometries
+        is3d: true if geometries contain elevation
+
+    Returns:
+        list of arrays - views of one contiguous array
+    """
+    if not polylines:
+        return []
+    data = _characters("".join(polylines))
+    deltas = _deltas(data, is3d)
+    # the first point of every polyline is index of its first integer divided by dimension
+    ends_count = np.concatenate(([0], np.cumsum(data < 63 + 0x20)))
+    lengths = np.fromiter(map(len, polylines), dtype=np.int64, count=len(polylines))
+    offsets = ends_count[np.concatenate(([0], np.cumsum(lengths)))] // deltas.shape[1]
+    # running sum restarts at the first point of every polyline
+    totals = np.cumsum(deltas, axis=0)
+    bases = np.concatenate((np.zeros((1, deltas.shape[1]), dtype=np.int64), totals))[offsets[:-1]]
+    totals -= np.repeat(bases, np.diff(offsets), axis=0)
+    return np.split(_scale(totals, is3d), offsets[1:-1])
+
+
+def encode(coordinates: Coordinates) -> str:
+    """It encodes coordinates into polyline, inverse of `decode` (elevation is not encoded).
+
+    Args:
+        coordinates: array of (long, lat[, elevation]) coordinates
+
+    Returns:
+        encoded route geometry
+    """
+    # polyline stores (lat, long) deltas of values rounded to 5 decimal places
+    points = np.rint(coordinates[:, 1::-1] * 1e5).astype(np.int64)
+    deltas = np.diff(points, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    values = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+    # every integer is split into 5 bit chunks, all chunks but the last one have 0x20 flag
+    shifts = 5 * np.arange(7)
+    chunks = (values[:, np.newaxis] >> shifts) & 0x1F
+    counts = np.maximum(1, (np.floor(np.log2(np.maximum(values, 1))).astype(np.int64) + 5) // 5)
+    used = shifts // 5 < counts[:, np.newaxis]
+    continued = shifts // 5 < counts[:, np.newaxis] - 1
+    return (chunks + 0x20 * continued + 63)[used].astype(np.uint8).tobytes().decode("ascii")
+
+
+def to_geojson(coordinates: Coordinates) -> GeoJson:
+    """It converts coordinates to GeoJson structure.
+
+    Args:
+        coordinates: decoded polyline
+
+    Returns:
+        GeoJson structure
+    """
+    return {"type": "LineString", "coordinates": coordinates.tolist()}
+
+
+def from_geojson(geojson: GeoJson) -> Coordinates:
+    """It converts GeoJson structure to coordinates.
+
+    Args:
+        geojson: GeoJson structure
+
+    Returns:
+        array of coordinates
+    """
+    return np.asarray(geojson["coordinates"], dtype=np.float64).reshape(len(geojson["coordinates"]), -1)
@@ -0,0 +1,148 @@
+import asyncio
+import contextlib
+import contextvars
+import fcntl
+import os
+import struct
+import tempfile
+import threading
+import time
+import typing
+
+from django.conf import settings
+from openrouteservice.exceptions import ApiError
+
+
+INTERACTIVE: int = 0
+BATCH: int = 1
+WARMUP: int = 2
+PRIORITIES: tuple[str, ...] = ("interactive", "batch", "warmup")
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar("ors_priority", default=INTERACTIVE)
+
+
+@contextlib.contextmanager
+def ors_priority(priority: int) -> typing.Iterator[None]:
+    """ORS calls made within the block (also in threads and tasks with copy of its context) have the priority."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    """It returns priority of ORS calls made in the current context (see `ors_priority`)."""
+    return _priority.get()
+
+
+class QuotaScheduler:
+    """Token bucket of ORS calls shared by all processes of the host (gunicorn workers, FastAPI app, commands),
+    its state is kept in locked file, so that bursts of all processes together fit into quota of the API key.
+    Every call waits for its token. Calls of lower priority do not get tokens while a call of higher priority
+    is waiting, so interactive requests go first and batches and warm-up use the rest of the quota.
+    Call which would wait longer than `max_wait` of its priority is rejected with `ApiError` 429 as ORS would do.
+
+    Args:
+        rate: ORS calls per second (0 = unlimited)
+        burst: max. number of calls at once
+        path: file of the shared state (the same for all processes)
+        max_wait: max. seconds of waiting by priority (interactive, batch, warm-up)
+        poll: seconds between two checks of the bucket while a call of higher priority waits
+    """
+
+    # tokens, time of the update and until when calls of every priority are waiting
+    state_format: struct.Struct = struct.Struct(f"<{2 + len(PRIORITIES)}d")
+
+    def __init__(
+        self,
+        rate: float = 0.0,
+        burst: int = 5,
+        path: str | None = None,
+        max_wait: tuple[float, ...] = (2.0, 30.0, 300.0),
+        poll: float = 0.05,
+    ):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.path = path or os.path.join(tempfile.gettempdir(), "route_planner_ors_quota")
+        self.max_wait = max_wait
+        self.poll = poll
+        self._fd: int | None = None
+        self._pid: int | None = None
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _state(self) -> typing.Iterator[list[float]]:
+        """It locks the shared state (against threads and other processes), changes of it are written back."""
+        with self._lock:
+            # forked process opens its own file, locks of shared file descriptor would not exclude processes
+            if self._fd is None or self._pid != os.getpid():
+                self._fd, self._pid = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600), os.getpid()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                data: bytes = os.pread(self._fd, self.state_format.size, 0)
+                state: list[float] = (
+                    list(self.state_format.unpack(data))
+                    if len(data) == self.state_format.size
+                    else [float(self.burst), time.time()] + [0.0] * len(PRIORITIES)
+                )
+                yield state
+                os.pwrite(self._fd, self.state_format.pack(*state), 0)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def take(self, priority: int, blocking: bool = True) -> float:
+        """It takes a token if it is available to the priority.
+
+        Args:
+            priority: priority of the call
+            blocking: the call is going to wait, calls of lower priority are held back meanwhile
+
+        Returns:
+            0 if the token is taken, otherwise seconds to wait before the next try
+        """
+        with self._state() as state:
+            now: float = time.time()
+            state[0] = min(float(self.burst), state[0] + max(now - state[1], 0.0) * self.rate)
+            state[1] = now
+            held_back: bool = any(until > now for until in state[2 : 2 + priority])
+            if not held_back and state[0] >= 1.0:
+                state[0] -= 1.0
+                return 0.0
+            wait: float = self.poll if held_back or state[0] >= 1.0 else (1.0 - state[0]) / self.rate
+            if blocking:
+                state[2 + priority] = max(state[2 + priority], now + wait + self.poll)
+            return wait
+
+    def try_acquire(self) -> bool:
+        """It takes a token without waiting (e.g. for hedged request)."""
+        return self.rate <= 0 or not self.take(_priority.get(), blocking=False)
+
+    def _deadline(self) -> tuple[int, float]:
+        priority: int = _priority.get()
+        return priority, time.monotonic() + self.max_wait[priority]
+
+    def _check(self, wait: float, deadline: float):
+        if time.monotonic() + wait > deadline:
+            raise ApiError(429, {"error": {"code": "ors_quota", "message": "Quota of ORS calls is exhausted."}})
+
+    def acquire(self):
+        """It waits for a token of the current priority (see `ors_priority`)."""
+        if self.rate <= 0:
+            return
+        priority, deadline = self._deadline()
+        while wait := self.take(priority):
+            self._check(wait, deadline)
+            time.sleep(wait)
+
+    async def aacquire(self):
+        """Async version of `acquire`, it does not block event loop while waiting."""
+        if self.rate <= 0:
+            return
+        priority, deadline = self._deadline()
+        while wait := self.take(priority):
+            self._check(wait, deadline)
+            await asyncio.sleep(wait)
+
+
+ors_quota = QuotaScheduler(**settings.ROUTE_QUOTA)
@@ -0,0 +1,83 @@
+import json
+import typing
+
+import folium
+
+from .polyline import Coordinates
+
+
+class StreamedPolyLine(folium.PolyLine):
+    """PolyLine which coordinates are not rendered by folium template, only marker is rendered instead of them.
+    Coordinates are written by `render_map` in chunks directly from decoded geometry.
+
+    Args:
+        coordinates: array of (long, lat[, elevation]) coordinates
+        tooltip: tooltip of the line
+    """
+
+    def __init__(self, coordinates: Coordinates, tooltip: str | None = None, **kwargs: typing.Any):
+        super().__init__([[0.0, 0.0]], tooltip=tooltip, **kwargs)
+        # (lat, long) view without copy
+        self.coordinates: Coordinates = coordinates[:, 1::-1]
+        self.locations: typing.Any = self.marker_name
+
+    @property
+    def marker_name(self) -> str:
+        return f"streamed:{self.get_name()}"
+
+    @property
+    def marker(self) -> str:
+        # how template renders locations (string is dumped to JSON)
+        return json.dumps(self.marker_name)
+
+    def _get_self_bounds(self) -> list[list[float | None]]:
+        if not len(self.coordinates):
+            return [[None, None], [None, None]]
+        south, west = self.coordinates.min(axis=0)[:2].tolist()
+        north, east = self.coordinates.max(axis=0)[:2].tolist()
+        return [[south, west], [north, east]]
+
+    def chunks(self, chunk_size: int) -> typing.Iterator[bytes]:
+        """It renders coordinates the same way as template does, chunk by chunk."""
+        yield b"["
+        for start in range(0, len(self.coordinates), chunk_size):
+            separator = ", " if start else ""
+            yield (separator + json.dumps(self.coordinates[start : start + chunk_size].tolist())[1:-1]).encode("utf8")
+        yield b"]"
+
+
+def render_map(created_map: folium.Map, chunk_size: int = 4096) -> typing.Iterator[bytes]:
+    """It renders HTML page of the map - coordinates of streamed lines are rendered in chunks,
+    so that the whole page is never in memory.
+
+    Args:
+        created_map: map to render
+        chunk_size: number of points rendered at once
+
+    Returns:
+        generator of HTML chunks
+    """
+    lines = [child for child in created_map._children.values() if isinstance(child, StreamedPolyLine)]
+    yield from render_html(created_map.get_root().render(), lines, chunk_size)
+
+
+def render_html(html: str, lines: typing.Iterable[StreamedPolyLine], chunk_size: int = 4096) -> typing.Iterator[bytes]:
+    """It replaces markers of streamed lines in rendered HTML (or script) by their coordinates.
+
+    Args:
+        html: rendered HTML
+        lines: streamed lines of the HTML
+        chunk_size: number of points rendered at once
+
+    Returns:
+        generator of HTML chunks
+    """
+    position: int = 0
+    found: list[tuple[int, StreamedPolyLine]] = sorted(
+        ((html.find(line.marker), line) for line in lines if line.marker in html), key=lambda item: item[0]
+    )
+    for index, line in found:
+        yield html[position:index].encode("utf8")
+        yield from line.chunks(chunk_size)
+        position = index + len(line.marker)
+    yield html[position:].encode("utf8")
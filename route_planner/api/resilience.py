@@ -0,0 +1,350 @@
+import asyncio
+import collections
+import contextvars
+import logging
+import math
+import threading
+import time
+import typing
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait
+
+from openrouteservice.exceptions import ApiError
+
+
+logger = logging.getLogger(__name__)
+
+T = typing.TypeVar("T")
+
+CLOSED: str = "closed"
+OPEN: str = "open"
+HALF_OPEN: str = "half-open"
+
+
+def is_failure(exc: BaseException) -> bool:
+    """ORS is failing (timeout, connection error, 429 or 5xx), other errors (e.g. no route found) are its answers."""
+    return not isinstance(exc, ApiError) or exc.status == 429 or exc.status >= 500
+
+
+def unavailable(message: str) -> ApiError:
+    # the same error as ORS returns, so it is handled as any other ORS failure
+    return ApiError(503, {"error": {"code": "ors_unavailable", "message": message}})
+
+
+class AdaptiveLimit:
+    """AIMD limit of concurrent calls - the limit grows by one call per `limit` successful calls, it is multiplied
+    by `backoff` when a call fails or it is slower than `latency_target` (once per congestion, calls started before
+    the last decrease do not decrease it again). Calls over the limit wait max. `max_wait` seconds for a free slot
+    (e.g. when concurrent batches fan out), then they are rejected instead of waiting for slow ORS.
+
+    Args:
+        initial: initial limit
+        minimum: min. limit
+        maximum: max. limit
+        latency_target: seconds of the slowest healthy call
+        backoff: multiplier of the limit when ORS is congested
+        max_wait: max. seconds of waiting for a free slot
+        poll: seconds between tries of async waiting
+    """
+
+    def __init__(
+        self,
+        initial: int = 10,
+        minimum: int = 1,
+        maximum: int = 100,
+        latency_target: float = 2.5,
+        backoff: float = 0.5,
+        max_wait: float = 0.0,
+        poll: float = 0.05,
+    ):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.max_wait = max_wait
+        self.poll = poll
+        self.limit: float = float(min(max(initial, minimum), maximum))
+        self.in_flight: int = 0
+        self._decreased: float = -math.inf
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+
+    def acquire(self, wait: bool = True) -> bool:
+        """It takes a slot, it waits max. `max_wait` seconds for it if `wait` is on.
+
+        Returns:
+            True if the slot is taken
+        """
+        with self._released:
+            if not self._released.wait_for(lambda: self.in_flight < int(self.limit), self.max_wait if wait else 0):
+                return False
+            self.in_flight += 1
+            return True
+
+    async def aacquire(self, wait: bool = True) -> bool:
+        """Async version of `acquire`, it does not block event loop while waiting."""
+        deadline: float = time.monotonic() + (self.max_wait if wait else 0)
+        while not self.acquire(wait=False):
+            if time.monotonic() + self.poll > deadline:
+                return False
+            await asyncio.sleep(self.poll)
+        return True
+
+    def cancel(self):
+        """It releases the call without changing the limit (the call has not been answered)."""
+        with self._released:
+            self.in_flight -= 1
+            self._released.notify()
+
+    def release(self, started: float, latency: float, failed: bool):
+        with self._released:
+            self.in_flight -= 1
+            self._released.notify_all()
+            if not failed and latency <= self.latency_target:
+                self.limit = min(float(self.maximum), self.limit + 1.0 / self.limit)
+            elif started >= self._decreased:
+                self.limit = max(float(self.minimum), self.limit * self.backoff)
+                self._decreased = time.monotonic()
+
+
+class CircuitBreaker:
+    """The circuit opens after `failure_threshold` consecutive failures, all calls are rejected at once then.
+    After `reset_timeout` seconds one probe call is let through (half-open), the circuit is closed if it succeeds.
+
+    Args:
+        failure_threshold: number of consecutive failures which open the circuit
+        reset_timeout: seconds until the probe call
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state: str = CLOSED
+        self.failures: int = 0
+        self._opened: float = 0.0
+        self._probing: bool = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self._opened >= self.reset_timeout:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return self.state == CLOSED
+
+    def cancel(self):
+        """The call has not been answered, another probe can be let through."""
+        with self._lock:
+            self._probing = False
+
+    def record(self, failed: bool):
+        with self._lock:
+            self._probing = False
+            if not failed:
+                self.state, self.failures = CLOSED, 0
+                return
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                logger.warning("ORS circuit is open after %s failures.", self.failures)
+                self.state, self._opened = OPEN, time.monotonic()
+
+
+class Latencies:
+    """Seconds of recent successful calls."""
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._values: collections.deque[float] = collections.deque(maxlen=size)
+
+    def add(self, latency: float):
+        self._values.append(latency)
+
+    def percentile(self, percentile: float) -> float | None:
+        """It returns the percentile, None if there is not enough samples yet."""
+        values: list[float] = sorted(self._values)
+        if len(values) < self.min_samples:
+            return None
+        return values[min(len(values) - 1, int(len(values) * percentile / 100))]
+
+
+def first_answer(calls: list[Future]) -> typing.Any:
+    """It returns the first successful result, the last error is raised if all calls fail."""
+    errors: list[Exception] = []
+    for call in as_completed(calls):
+        try:
+            return call.result()
+        except Exception as exc:
+            errors.append(exc)
+    raise errors[-1]
+
+
+async def afirst_answer(calls: list[asyncio.Task]) -> typing.Any:
+    errors: list[Exception] = []
+    for call in asyncio.as_completed(calls):
+        try:
+            return await call
+        except Exception as exc:
+            errors.append(exc)
+    raise errors[-1]
+
+
+class ResilientUpstream:
+    """Resilience of ORS calls, so that slow or failing ORS does not block all workers:
+
+    - concurrent calls are limited by AIMD limit (see `AdaptiveLimit`), calls over it wait max. `queue_timeout`
+      seconds for a free slot, then they fail (hedged requests do not wait),
+    - circuit breaker (see `CircuitBreaker`) fails all calls at once while ORS is failing,
+    - hedged requests - idempotent call which is not answered within `hedge_percentile` of recent latencies
+      is sent once more and the first answer is used (it costs one more ORS call, so it is optional),
+      admitted calls are passed to `record_call` with flag whether the call is the hedged one.
+
+    Rejected calls raise `ApiError` 503 as ORS does (`ORSException` of the adapter).
+
+    Args:
+        concurrency: initial limit of concurrent calls
+        min_concurrency: min. limit of concurrent calls
+        max_concurrency: max. limit of concurrent calls
+        latency_target: seconds of the slowest healthy call
+        queue_timeout: max. seconds of waiting for a free slot of the limit
+        failure_threshold: number of consecutive failures which open the circuit
+        reset_timeout: seconds the circuit is open
+        hedge: hedged requests are sent
+        hedge_percentile: percentile of latencies after which the request is sent again
+        hedge_min_delay: min. seconds after which the request is sent again
+        admit_hedge: it is asked whether the hedged request can be sent (e.g. quota of ORS calls allows it)
+        record_call: it is called when the call is admitted, with True for the hedged request (e.g. to count them)
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 10,
+        min_concurrency: int = 1,
+        max_concurrency: int = 100,
+        latency_target: float = 2.5,
+        queue_timeout: float = 0.0,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        hedge: bool = False,
+        hedge_percentile: float = 95.0,
+        hedge_min_delay: float = 0.05,
+        admit_hedge: typing.Callable[[], bool] | None = None,
+        record_call: typing.Callable[[bool], None] | None = None,
+    ):
+        self.limit = AdaptiveLimit(
+            concurrency, min_concurrency, max_concurrency, latency_target, max_wait=queue_timeout
+        )
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.latencies = Latencies()
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.admit_hedge = admit_hedge or (lambda: True)
+        self.record_call = record_call or (lambda hedged: None)
+        self._executor: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        # threads of hedged sync calls, it is created lazily (only if hedging is on)
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(2 * self.limit.maximum, thread_name_prefix="ors-hedge")
+            return self._executor
+
+    def hedge_delay(self, hedge: bool) -> float | None:
+        """It returns seconds after which the request is sent again, None if it is not hedged."""
+        if not (hedge and self.hedge):
+            return None
+        latency: float | None = self.latencies.percentile(self.hedge_percentile)
+        return None if latency is None else max(latency, self.hedge_min_delay)
+
+    def enter(self, hedged: bool = False) -> float:
+        """It admits the call or it raises `ApiError` 503.
+
+        Args:
+            hedged: the call is hedged request, it does not wait for a free slot of the limit
+
+        Returns:
+            start of the call
+        """
+        return self._admit(self.limit.acquire(wait=not hedged), hedged)
+
+    async def aenter(self, hedged: bool = False) -> float:
+        """Async version of `enter`, it does not block event loop while waiting for a free slot."""
+        return self._admit(await self.limit.aacquire(wait=not hedged), hedged)
+
+    def _admit(self, acquired: bool, hedged: bool) -> float:
+        if not acquired:
+            raise unavailable("Too many concurrent ORS calls, ORS is slow.")
+        if not self.breaker.allow():
+            self.limit.cancel()
+            raise unavailable("ORS is failing, calls are suspended.")
+        self.record_call(hedged)
+        return time.monotonic()
+
+    def exit(self, started: float, exc: BaseException | None = None):
+        latency: float = time.monotonic() - started
+        if isinstance(exc, asyncio.CancelledError):
+            # the loser of hedged call
+            self.limit.cancel()
+            self.breaker.cancel()
+            return
+        failed: bool = exc is not None and is_failure(exc)
+        self.limit.release(started, latency, failed)
+        self.breaker.record(failed)
+        if exc is None:
+            self.latencies.add(latency)
+
+    def call(self, request: typing.Callable[[], T], hedge: bool = False) -> T:
+        """It calls ORS.
+
+        Args:
+            request: ORS call
+            hedge: the call is idempotent, it can be sent twice
+
+        Returns:
+            result of the call
+        """
+        delay: float | None = self.hedge_delay(hedge)
+        if delay is None:
+            return self._call(request)
+        # copy of the context for every thread (e.g. counter of ORS calls of the request)
+        calls: list[Future] = [self.executor.submit(contextvars.copy_context().run, self._call, request)]
+        if not wait(calls, timeout=delay).done and self.admit_hedge():
+            calls.append(self.executor.submit(contextvars.copy_context().run, self._call, request, True))
+        return first_answer(calls)
+
+    def _call(self, request: typing.Callable[[], T], hedged: bool = False) -> T:
+        started: float = self.enter(hedged)
+        try:
+            result: T = request()
+        except Exception as exc:
+            self.exit(started, exc)
+            raise
+        self.exit(started)
+        return result
+
+    async def acall(self, request: typing.Callable[[], typing.Awaitable[T]], hedge: bool = False) -> T:
+        """Async version of `call`, the loser of hedged call is cancelled."""
+        delay: float | None = self.hedge_delay(hedge)
+        if delay is None:
+            return await self._acall(request)
+        calls: list[asyncio.Task] = [asyncio.ensure_future(self._acall(request))]
+        try:
+            if not (await asyncio.wait(calls, timeout=delay))[0] and self.admit_hedge():
+                calls.append(asyncio.ensure_future(self._acall(request, True)))
+            return await afirst_answer(calls)
+        finally:
+            for call in calls:
+                call.cancel()
+
+    async def _acall(self, request: typing.Callable[[], typing.Awaitable[T]], hedged: bool = False) -> T:
+        started: float = await self.aenter(hedged)
+        try:
+            result: T = await request()
+        except (Exception, asyncio.CancelledError) as exc:
+            self.exit(started, exc)
+            raise
+        self.exit(started)
+        return result
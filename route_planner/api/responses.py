@@ -0,0 +1,81 @@
+import typing
+
+import orjson
+from pydantic import BaseModel
+from django.http import HttpResponse
+from starlette.responses import Response
+
+from .geometry import LineString
+
+
+MVT = "application/vnd.mapbox-vector-tile"
+# tiles of content addressed maps never change
+TILE_HEADERS: dict[str, str] = {"Cache-Control": "public, max-age=31536000, immutable"}
+
+
+def default(value: typing.Any) -> typing.Any:
+    # types which orjson does not serialize itself
+    if isinstance(value, LineString):
+        # coordinates are written by orjson directly from the array buffer
+        return {"type": "LineString", "coordinates": value.coordinates}
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(content: typing.Any) -> bytes:
+    """It encodes data created by the service layer (found routes, geometries) to JSON,
+    they are not validated again by response schemas.
+
+    Args:
+        content: data to encode
+
+    Returns:
+        JSON encoded data
+    """
+    return orjson.dumps(content, default=default, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+class FastJsonResponse(HttpResponse):
+    """Django (Ninja) response encoded by `dumps`."""
+
+    def __init__(self, content: typing.Any, status: int = 200, **kwargs: typing.Any):
+        kwargs.setdefault("content_type", "application/json")
+        super().__init__(dumps(content), status=status, **kwargs)
+
+
+class GeometryResponse(HttpResponse):
+    """Django (Ninja) response with route geometries in binary media type (see `formats`)."""
+
+    def __init__(self, content: bytes, media_type: str, **kwargs: typing.Any):
+        super().__init__(content, content_type=media_type, headers={"Vary": "Accept"}, **kwargs)
+
+
+class TileResponse(HttpResponse):
+    """Django (Ninja) response with vector tile of stored map (see `composition`)."""
+
+    def __init__(self, content: bytes, **kwargs: typing.Any):
+        super().__init__(content, content_type=MVT, headers=TILE_HEADERS, **kwargs)
+
+
+class FastAPIJsonResponse(Response):
+    """FastAPI response encoded by `dumps`."""
+
+    media_type = "application/json"
+
+    def render(self, content: typing.Any) -> bytes:
+        return dumps(content)
+
+
+class FastAPIGeometryResponse(Response):
+    """FastAPI response with route geometries in binary media type (see `formats`)."""
+
+    def __init__(self, content: bytes, media_type: str, **kwargs: typing.Any):
+        super().__init__(content, media_type=media_type, headers={"Vary": "Accept"}, **kwargs)
+
+
+class FastAPITileResponse(Response):
+    """FastAPI response with vector tile of stored map (see `composition`)."""
+
+    def __init__(self, content: bytes, **kwargs: typing.Any):
+        super().__init__(content, media_type=MVT, headers=TILE_HEADERS, **kwargs)
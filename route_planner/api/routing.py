@@ -0,0 +1,224 @@
+import abc
+import asyncio
+import functools
+import logging
+import os
+import typing
+
+from openrouteservice.exceptions import ApiError
+
+from django.conf import settings
+
+from .aliases import BoundingBox, Coordinate, Directions, Matrix, Route
+from .graph import RoadGraph, NoPathFound
+from .hierarchy import ContractionHierarchy, IndexMismatch, META as HIERARCHY_META
+from .spatial import GridIndex, META as INDEX_META
+from .snapping import Unroutable, nearest_node
+from .polyline import Coordinates, encode
+from .ors import (
+    find_routes as ors_find_routes,
+    afind_routes as ors_afind_routes,
+    find_matrix as ors_find_matrix,
+    afind_matrix as ors_afind_matrix,
+)
+
+
+logger = logging.getLogger(__name__)
+
+# ORS instruction types
+DEPART: int = 11
+ARRIVE: int = 10
+
+
+class RoutingBackend(abc.ABC):
+    """Interface of routing backends - they find routes from start to finish in ORS format,
+    failures are raised as `openrouteservice.exceptions.ApiError` the same way ORS does.
+    """
+
+    name: str
+
+    @property
+    @abc.abstractmethod
+    def profile(self) -> str:
+        """Identification of found routes (e.g. in cache keys)."""
+
+    @abc.abstractmethod
+    def find_routes(self, coordinates: BoundingBox) -> Directions:
+        """It finds routes from start to finish."""
+
+    @abc.abstractmethod
+    async def afind_routes(self, coordinates: BoundingBox) -> Directions:
+        """Async version of `find_routes`."""
+
+    @abc.abstractmethod
+    def find_matrix(self, sources: list[Coordinate], destinations: list[Coordinate]) -> Matrix:
+        """It finds distances and durations from all sources to all destinations (one tile of matrix)."""
+
+    @abc.abstractmethod
+    async def afind_matrix(self, sources: list[Coordinate], destinations: list[Coordinate]) -> Matrix:
+        """Async version of `find_matrix`."""
+
+    def load(self):
+        """It prepares the backend at startup of worker process."""
+
+
+class ORSBackend(RoutingBackend):
+    """Hosted Open Route Service."""
+
+    name = "ors"
+
+    @property
+    def profile(self) -> str:
+        return settings.ROUTE["profile"]
+
+    def find_routes(self, coordinates: BoundingBox) -> Directions:
+        return ors_find_routes(coordinates)
+
+    async def afind_routes(self, coordinates: BoundingBox) -> Directions:
+        return await ors_afind_routes(coordinates)
+
+    def find_matrix(self, sources: list[Coordinate], destinations: list[Coordinate]) -> Matrix:
+        return ors_find_matrix(sources, destinations)
+
+    async def afind_matrix(self, sources: list[Coordinate], destinations: list[Coordinate]) -> Matrix:
+        return await ors_afind_matrix(sources, destinations)
+
+
+class LocalBackend(RoutingBackend):
+    """In-process routing over road graph (see `build_road_graph` command), it works offline.
+    Routes are found by contraction hierarchy and start/finish are snapped by spatial index if they
+    are built (see `build_contraction_hierarchy` command), A* search and full scan of nodes are used otherwise.
+
+    Args:
+        graph_dir: directory of memory-mapped road graph
+        snap_distance: max. distance in meters of start/finish from the nearest node of the graph
+    """
+
+    name = "local"
+
+    def __init__(self, graph_dir: str | None = None, snap_distance: float = 350.0):
+        self.graph_dir = graph_dir
+        self.snap_distance = snap_distance
+
+    @functools.cached_property
+    def graph(self) -> RoadGraph:
+        if not self.graph_dir:
+            raise ValueError("Directory of road graph is not set (ROUTE_GRAPH_DIR).")
+        return RoadGraph.load(self.graph_dir)
+
+    def _has(self, meta: str) -> bool:
+        return os.path.exists(os.path.join(self.graph_dir or "", f"{meta}.json"))
+
+    @functools.cached_property
+    def hierarchy(self) -> ContractionHierarchy | None:
+        return ContractionHierarchy.load(self.graph_dir, self.graph) if self._has(HIERARCHY_META) else None
+
+    @functools.cached_property
+    def index(self) -> GridIndex | None:
+        return GridIndex.load(self.graph_dir, self.graph) if self._has(INDEX_META) else None
+
+    def load(self):
+        """It maps files of the graph (e.g. at startup of worker), so the first request is not delayed.
+        Missing or outdated files are only logged, management commands which (re)build them have to start.
+        """
+        try:
+            _ = self.graph, self.hierarchy, self.index
+        except (ValueError, OSError, IndexMismatch) as exc:
+            logger.warning("Road graph of local routing backend is not loaded - %s", exc)
+
+    @property
+    def profile(self) -> str:
+        return f"{self.name}-{self.graph.profile}"
+
+    def snap(self, index: int, long: float, lat: float) -> int:
+        """It returns the node nearest to the point, ORS error is raised when it is too far."""
+        node: int | None = nearest_node(self.graph, self.index, long, lat, self.snap_distance)
+        if node is None:
+            raise ApiError(404, Unroutable(index, long, lat, self.snap_distance).error)
+        return node
+
+    def find_routes(self, coordinates: BoundingBox) -> Directions:
+        (start_long, start_lat), (finish_long, finish_lat) = coordinates
+        source: int = self.snap(0, start_long, start_lat)
+        target: int = self.snap(1, finish_long, finish_lat)
+        try:
+            path: list[int] = (self.hierarchy or self.graph).shortest_path(source, target)
+        except NoPathFound as exc:
+            raise ApiError(404, {"error": {"code": 2009, "message": f"Route could not be found - {exc}."}})
+        return {"bbox": None, "routes": [self.route(path)], "metadata": None}
+
+    async def afind_routes(self, coordinates: BoundingBox) -> Directions:
+        # the search is CPU bound, so it does not block event loop
+        return await asyncio.to_thread(self.find_routes, coordinates)
+
+    def find_matrix(self, sources: list[Coordinate], destinations: list[Coordinate]) -> Matrix:
+        """It runs one Dijkstra search from every source, cells of sources or destinations
+        without routable node nearby are None (the same as unreachable destinations)."""
+        targets: list[int | None] = self.nearest_nodes(destinations)
+        reachable: set[int] = {target for target in targets if target is not None}
+        matrix: Matrix = {"distances": [], "durations": []}
+        for source in self.nearest_nodes(sources):
+            costs = self.graph.costs(source, reachable) if source is not None else {}
+            cells = [costs.get(target) if target is not None else None for target in targets]
+            matrix["distances"].append([round(cell[0], 2) if cell else None for cell in cells])
+            matrix["durations"].append([round(cell[1], 2) if cell else None for cell in cells])
+        return matrix
+
+    def nearest_nodes(self, coordinates: list[Coordinate]) -> list[int | None]:
+        return [nearest_node(self.graph, self.index, long, lat, self.snap_distance) for long, lat in coordinates]
+
+    async def afind_matrix(self, sources: list[Coordinate], destinations: list[Coordinate]) -> Matrix:
+        return await asyncio.to_thread(self.find_matrix, sources, destinations)
+
+    def route(self, path: list[int]) -> Route:
+        """It creates route in ORS format from nodes of the path.
+
+        Args:
+            path: nodes of the path
+
+        Returns:
+            the route
+        """
+        coordinates: Coordinates = self.graph.nodes[path]
+        route_distance, route_duration = (round(value, 1) for value in self.graph.path_costs(path))
+        last: int = len(path) - 1
+        west, south = coordinates.min(axis=0).tolist()
+        east, north = coordinates.max(axis=0).tolist()
+        return {
+            "summary": {"distance": route_distance, "duration": route_duration},
+            "segments": [
+                {
+                    "distance": route_distance,
+                    "duration": route_duration,
+                    "steps": [
+                        {
+                            "distance": route_distance,
+                            "duration": route_duration,
+                            "type": DEPART,
+                            "instruction": "Head towards destination",
+                            "name": "-",
+                            "way_points": [0, last],
+                        },
+                        {
+                            "distance": 0.0,
+                            "duration": 0.0,
+                            "type": ARRIVE,
+                            "instruction": "Arrive at your destination",
+                            "name": "-",
+                            "way_points": [last, last],
+                        },
+                    ],
+                }
+            ],
+            "bbox": [west, south, east, north],
+            "geometry": encode(coordinates),
+            "way_points": [0, last],
+        }
+
+
+BACKENDS: dict[str, typing.Callable[..., RoutingBackend]] = {
+    ORSBackend.name: lambda **options: ORSBackend(),
+    LocalBackend.name: LocalBackend,
+}
+
+routing_backend: RoutingBackend = BACKENDS[settings.ROUTE_BACKEND["name"]](**settings.ROUTE_BACKEND["options"])
@@ -1,10 +1,13 @@
 import typing
-import folium
 
 from rest_framework import serializers
 
-from .aliases import Point
-from .adapter import create_map, File
+from .aliases import Point, Routes
+from django.conf import settings
+
+from .adapter import ORSException
+from .fuel import FuelPlan, fuel_stations
+from .services import RoutePlannerService, RoutePair, fuel_plan
 
 
 class Location(serializers.Serializer):
@@ -18,17 +21,106 @@ class Location(serializers.Serializer):
     )
 
 
+class FuelStopSer(serializers.Serializer):
+    name = serializers.CharField()
+    lat = serializers.FloatField()
+    long = serializers.FloatField()
+    price = serializers.FloatField(help_text="Price of one gallon.")
+    position = serializers.FloatField(help_text="Miles from the start of the route.")
+    gallons = serializers.FloatField(help_text="Gallons bought at the station.")
+    cost = serializers.FloatField()
+
+
+class FuelPlanSer(serializers.Serializer):
+    distance = serializers.FloatField(help_text="Miles of the route.")
+    gallons = serializers.FloatField(help_text="Gallons bought on the route, the vehicle starts with full tank.")
+    cost = serializers.FloatField(help_text="Money spent on fuel.")
+    stops = FuelStopSer(many=True)
+
+
 class Route(serializers.Serializer):
     map = serializers.FileField(help_text="URL of rendered HTML map.")
+    fuel = FuelPlanSer(
+        allow_null=True,
+        help_text="The cheapest fuel stops, null if fuel stations are not configured or fuel planning failed.",
+    )
+    fuel_error = serializers.JSONField(
+        allow_null=True, help_text="Why fuel planning failed (e.g. no station within the range), null otherwise."
+    )
 
 
 class RouteSer(serializers.Serializer):
     start = Location(write_only=True, help_text="Starting point of the requested route.")
     finish = Location(write_only=True, help_text="Finishing point of the requested route.")
+    vehicle_range = serializers.FloatField(
+        write_only=True, min_value=1.0, default=settings.FUEL["vehicle_range"], help_text="Miles on full tank."
+    )
+    mpg = serializers.FloatField(
+        write_only=True, min_value=0.1, default=settings.FUEL["mpg"], help_text="Miles per gallon of the vehicle."
+    )
     route = Route(read_only=True)
 
     def create(self, validated_data: dict[str, typing.Any]) -> dict[str, typing.Any]:
         start: Point = Point(**validated_data["start"])
         finish: Point = Point(**validated_data["finish"])
-        created_map: folium.Map = create_map(start, finish)
-        return {"route": {"map": File("found_route.html", created_map)}}
+        routes: Routes = RoutePlannerService.find_routes(start, finish)
+        fuel: FuelPlan | None = None
+        fuel_error: dict[str, typing.Any] | None = None
+        if fuel_stations.enabled:
+            try:
+                fuel = fuel_plan(routes, validated_data["vehicle_range"], validated_data["mpg"])
+            except ORSException as exc:
+                # the route itself is found, so it is returned without fuel stops
+                fuel_error = {"msg": exc.message, "type": exc.code, "ctx": {"status": exc.status, "error": exc.data}}
+        return {
+            "route": {
+                "map": RoutePlannerService.routes_map(routes, filename="found_route.html"),
+                "fuel": fuel,
+                "fuel_error": fuel_error,
+            }
+        }
+
+
+class RoutePairSer(serializers.Serializer):
+    start = Location(help_text="Starting point of the requested route.")
+    finish = Location(help_text="Finishing point of the requested route.")
+
+
+class BatchRouteSer(serializers.Serializer):
+    pairs = serializers.ListField(
+        child=RoutePairSer(),
+        min_length=1,
+        max_length=settings.ROUTE_BATCH["max_pairs"],
+        help_text="Start and finish points of requested routes.",
+    )
+
+    def route_pairs(self) -> list[RoutePair]:
+        return [(Point(**pair["start"]), Point(**pair["finish"])) for pair in self.validated_data["pairs"]]
+
+
+class MatrixSer(serializers.Serializer):
+    sources = serializers.ListField(
+        child=Location(),
+        min_length=1,
+        max_length=settings.ROUTE_MATRIX["max_locations"],
+        help_text="Starting points of the routes.",
+    )
+    destinations = serializers.ListField(
+        child=Location(),
+        required=False,
+        min_length=1,
+        max_length=settings.ROUTE_MATRIX["max_locations"],
+        help_text="Finishing points of the routes, starting points are used if they are not set.",
+    )
+    distances = serializers.JSONField(read_only=True, help_text="Meters by source and destination, null if no route.")
+    durations = serializers.JSONField(read_only=True, help_text="Seconds by source and destination, null if no route.")
+
+    def create(self, validated_data: dict[str, typing.Any]) -> dict[str, typing.Any]:
+        sources: list[Point] = [Point(**source) for source in validated_data["sources"]]
+        destinations: list[Point] = [Point(**destination) for destination in validated_data.get("destinations", [])]
+        matrix = RoutePlannerService.find_matrix(sources, destinations or None)
+        return {
+            "sources": validated_data["sources"],
+            "destinations": validated_data.get("destinations", validated_data["sources"]),
+            **matrix,
+        }
@@ -1,22 +1,322 @@
-import uuid
+import asyncio
+import contextvars
+import logging
+import typing
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
 
-from .aliases import Point, Route, Routes, GeoJson
+import numpy as np
+
+from django.conf import settings
+
+from .aliases import Matrix, Point, Route, Routes
+from .geometry import LineString
+from .polyline import Coordinates, InvalidPolyline
+from .composition import Composition, Layer, map_composer
+from .corridor import CorridorMatch, InvalidRoute, corridor
+from .fuel import FuelPlan, OutOfRange, fuel_stations, METERS_PER_MILE
+from .jobs import map_jobs, MapJob
+from .matrix import max_tiles
+from .optimize import solve
+from .quota import BATCH, ors_priority
+from .responses import dumps
+from .formats import encode_geometries
+from .simplify import SimplifyOptions
+from .upstream import UpstreamCalls, count_upstream_calls
 from .adapter import (
+    ORSException,
     find_routes as find_routes_adapter,
-    extract_points,
-    create_map_from_geojson,
+    afind_routes as afind_routes_adapter,
+    find_matrix as find_matrix_adapter,
+    afind_matrix as afind_matrix_adapter,
+    extract_coordinates,
+    extract_coordinates_many,
+    routes_bounds,
     File,
-    create_map,
 )
 
 
+logger = logging.getLogger(__name__)
+
+RoutePair: typing.TypeAlias = tuple[Point, Point]
+BatchResult: typing.TypeAlias = tuple[int, Routes | ORSException]
+
+
+def pair_error(exc: Exception) -> ORSException:
+    """It converts failure of one pair of the batch to its error line, unexpected errors are logged
+    and reported without details, so that they do not stop the stream of the other pairs."""
+    if isinstance(exc, ORSException):
+        return exc
+    logger.error("Routes of batch pair failed.", exc_info=exc)
+    return ORSException(500, "internal_error", "Routes of the pair are not found because of internal error", None)
+
+
+def batch_line(index: int, pair: RoutePair, result: Routes | ORSException) -> bytes:
+    """It creates one NDJSON line of batch result - found routes or error of the pair.
+
+    Args:
+        index: index of the pair in the batch
+        pair: start and finish
+        result: found routes or ORS exception
+
+    Returns:
+        JSON encoded line
+    """
+    start, finish = pair
+    line: dict[str, typing.Any] = {"index": index, "start": start.model_dump(), "finish": finish.model_dump()}
+    if isinstance(result, ORSException):
+        line["errors"] = [
+            {"msg": result.message, "type": result.code, "ctx": {"status": result.status, "error": result.data}}
+        ]
+    else:
+        line["routes"] = result
+    return dumps(line) + b"\n"
+
+
+def batch_summary(pairs: int, calls: UpstreamCalls) -> bytes:
+    """It creates the last NDJSON line of batch result - number of pairs and ORS calls (and hedged ones) made for
+    them. Pairs are resolved while the response is streamed, so the calls are not included in `X-Upstream-Calls`
+    header."""
+    summary: dict[str, int] = {"pairs": pairs, "upstream_calls": calls.count, "hedged_calls": calls.hedged}
+    return dumps({"summary": summary}) + b"\n"
+
+
+def batch_lines(pairs: typing.Sequence[RoutePair]) -> typing.Iterator[bytes]:
+    """It streams NDJSON lines of the pairs as their routes are found (see `find_routes_batch`), then the summary."""
+    with count_upstream_calls() as calls:
+        for index, result in RoutePlannerService.find_routes_batch(pairs):
+            yield batch_line(index, pairs[index], result)
+        yield batch_summary(len(pairs), calls)
+
+
+async def abatch_lines(pairs: typing.Sequence[RoutePair]) -> typing.AsyncIterator[bytes]:
+    """Async version of `batch_lines`."""
+    with count_upstream_calls() as calls:
+        async for index, result in RoutePlannerService.afind_routes_batch(pairs):
+            yield batch_line(index, pairs[index], result)
+        yield batch_summary(len(pairs), calls)
+
+
+@dataclass
+class Tour:
+    """Optimized multi-stop tour - order of stops (their indexes), totals of its legs and map of the tour."""
+
+    order: list[int]
+    distance: float
+    duration: float
+    map: File
+
+
+def max_tour_calls() -> int:
+    """Max. number of upstream calls of one tour - matrix tiles and legs."""
+    locations: int = settings.ROUTE_OPTIMIZE["max_stops"] + 1
+    return max_tiles(locations) + locations
+
+
+def unreachable_stops(durations: list[list[float | None]], round_trip: bool) -> list[int]:
+    """It returns indexes of stops (from 0) which can not be reached from the depot (or back)."""
+    return [
+        index - 1
+        for index in range(1, len(durations))
+        if durations[0][index] is None or (round_trip and durations[index][0] is None)
+    ]
+
+
+def check_reachable(durations: list[list[float | None]], round_trip: bool):
+    unreachable: list[int] = unreachable_stops(durations, round_trip)
+    if unreachable:
+        raise ORSException(404, "unreachable_stops", "Stops can not be reached from the depot", unreachable)
+
+
+def tour_legs(depot: Point, stops: list[Point], order: list[int], round_trip: bool) -> list[RoutePair]:
+    points: list[Point] = [depot, *(stops[index - 1] for index in order), *([depot] if round_trip else [])]
+    return list(zip(points, points[1:]))
+
+
+def tour_geometry(routes: Routes) -> LineString:
+    """It joins geometries of the legs, the first point of a leg is the last one of the previous leg."""
+    legs = extract_coordinates_many(routes)
+    return LineString(np.concatenate([legs[0], *(leg[1:] for leg in legs[1:])]))
+
+
+def first_routes(legs: list[RoutePair], results: typing.Iterable[BatchResult]) -> Routes:
+    """It returns the first found route of every leg in order of the legs, ORS exception of any leg is raised."""
+    routes: list[Route | None] = [None] * len(legs)
+    for index, result in results:
+        if isinstance(result, ORSException):
+            raise result
+        routes[index] = result[0]
+    return typing.cast(Routes, routes)
+
+
+def fuel_plan(routes: Routes, vehicle_range: float, mpg: float) -> FuelPlan:
+    """It finds the cheapest fuel stops of the first route, ORS exception is raised if there is no station
+    within the range or if stations are not loaded."""
+    if not fuel_stations.enabled:
+        raise ORSException(503, "fuel_stations_unavailable", "Fuel stations are not configured", None)
+    try:
+        return fuel_stations.plan(extract_coordinates(routes[0]), vehicle_range, mpg)
+    except OutOfRange as exc:
+        raise ORSException(404, "fuel_out_of_range", str(exc), {"position": round(exc.position / METERS_PER_MILE, 1)})
+
+
 class RoutePlannerService:
     @staticmethod
     def find_routes(start: Point, finish: Point) -> Routes:
         return find_routes_adapter(start, finish)
 
     @staticmethod
-    def extract_geojson(geometry: str) -> GeoJson:
+    async def afind_routes(start: Point, finish: Point) -> Routes:
+        return await afind_routes_adapter(start, finish)
+
+    @staticmethod
+    def find_routes_batch(
+        pairs: typing.Sequence[RoutePair], concurrency: int | None = None
+    ) -> typing.Iterator[BatchResult]:
+        """It finds routes of many pairs with bounded concurrency, results are yielded as they are done,
+        so they are not in the order of pairs. Exception of one pair does not stop the others.
+        """
+        with ThreadPoolExecutor(max_workers=concurrency or settings.ROUTE_BATCH["concurrency"]) as executor:
+            # every pair runs in copy of the context, so that its upstream calls are counted to the request
+            futures = {
+                executor.submit(contextvars.copy_context().run, RoutePlannerService._find_routes_pair, *pair): index
+                for index, pair in enumerate(pairs)
+            }
+            try:
+                for future in as_completed(futures):
+                    try:
+                        yield futures[future], future.result()
+                    except Exception as exc:
+                        yield futures[future], pair_error(exc)
+            finally:
+                executor.shutdown(cancel_futures=True)
+
+    @staticmethod
+    def _find_routes_pair(start: Point, finish: Point) -> Routes:
+        # interactive requests of other clients go first
+        with ors_priority(BATCH):
+            return find_routes_adapter(start, finish)
+
+    @staticmethod
+    async def afind_routes_batch(
+        pairs: typing.Sequence[RoutePair], concurrency: int | None = None
+    ) -> typing.AsyncIterator[BatchResult]:
+        """Async version of `find_routes_batch`."""
+        semaphore = asyncio.Semaphore(concurrency or settings.ROUTE_BATCH["concurrency"])
+        tasks: list[asyncio.Task[BatchResult]] = [
+            asyncio.ensure_future(RoutePlannerService._afind_routes_pair(semaphore, index, pair))
+            for index, pair in enumerate(pairs)
+        ]
+        try:
+            for done in asyncio.as_completed(tasks):
+                yield await done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @staticmethod
+    async def _afind_routes_pair(semaphore: asyncio.Semaphore, index: int, pair: RoutePair) -> BatchResult:
+        async with semaphore:
+            try:
+                with ors_priority(BATCH):
+                    return index, await afind_routes_adapter(*pair)
+            except Exception as exc:
+                return index, pair_error(exc)
+
+    @staticmethod
+    def find_matrix(sources: list[Point], destinations: list[Point] | None = None) -> Matrix:
+        """It finds distances and durations from all sources to all destinations (to sources
+        if destinations are not given), without geometries of the routes."""
+        return find_matrix_adapter(sources, sources if destinations is None else destinations)
+
+    @staticmethod
+    async def afind_matrix(sources: list[Point], destinations: list[Point] | None = None) -> Matrix:
+        return await afind_matrix_adapter(sources, sources if destinations is None else destinations)
+
+    @staticmethod
+    def optimize_tour(
+        depot: Point,
+        stops: list[Point],
+        round_trip: bool = True,
+        title: str = "Optimized tour",
+        route_title: str = "Tour",
+    ) -> Tour:
+        """It orders stops of the tour from the depot to make it as fast as possible and renders its map.
+
+        Args:
+            depot: start (and finish of round trip) of the tour
+            stops: stops of the tour
+            round_trip: tour returns to the depot
+            title: map title
+            route_title: tour tooltip
+
+        Returns:
+            optimized tour
+        """
+        matrix: Matrix = find_matrix_adapter([depot, *stops], [depot, *stops])
+        check_reachable(matrix["durations"], round_trip)
+        order: list[int] = map_jobs.run(
+            solve, matrix["durations"], settings.ROUTE_OPTIMIZE["time_budget"], round_trip
+        ).result()
+        legs: list[RoutePair] = tour_legs(depot, stops, order, round_trip)
+        routes: Routes = first_routes(legs, RoutePlannerService.find_routes_batch(legs))
+        file: File = RoutePlannerService.map_from_geojson(tour_geometry(routes), title, route_title, "tour.html")
+        return RoutePlannerService.tour(order, routes, file)
+
+    @staticmethod
+    async def aoptimize_tour(
+        depot: Point,
+        stops: list[Point],
+        round_trip: bool = True,
+        title: str = "Optimized tour",
+        route_title: str = "Tour",
+    ) -> Tour:
+        """Async version of `optimize_tour`."""
+        matrix: Matrix = await afind_matrix_adapter([depot, *stops], [depot, *stops])
+        check_reachable(matrix["durations"], round_trip)
+        order: list[int] = await asyncio.wrap_future(
+            map_jobs.run(solve, matrix["durations"], settings.ROUTE_OPTIMIZE["time_budget"], round_trip)
+        )
+        legs: list[RoutePair] = tour_legs(depot, stops, order, round_trip)
+        routes: Routes = first_routes(legs, [result async for result in RoutePlannerService.afind_routes_batch(legs)])
+        file: File = await asyncio.to_thread(
+            RoutePlannerService.map_from_geojson, tour_geometry(routes), title, route_title, "tour.html"
+        )
+        return RoutePlannerService.tour(order, routes, file)
+
+    @staticmethod
+    def tour(order: list[int], routes: Routes, file: File) -> Tour:
+        return Tour(
+            order=[index - 1 for index in order],
+            # ORS leaves out zero distance and duration (e.g. of stops at the same place)
+            distance=round(sum(route["summary"].get("distance", 0.0) for route in routes), 1),
+            duration=round(sum(route["summary"].get("duration", 0.0) for route in routes), 1),
+            map=file,
+        )
+
+    @staticmethod
+    def plan_fuel(start: Point, finish: Point, vehicle_range: float, mpg: float) -> tuple[Routes, FuelPlan]:
+        """It finds routes and the cheapest fuel stops of the first one.
+
+        Args:
+            start: starting point
+            finish: finishing point
+            vehicle_range: miles on full tank
+            mpg: miles per gallon
+
+        Returns:
+            found routes and fuel stops
+        """
+        routes: Routes = find_routes_adapter(start, finish)
+        return routes, fuel_plan(routes, vehicle_range, mpg)
+
+    @staticmethod
+    async def aplan_fuel(start: Point, finish: Point, vehicle_range: float, mpg: float) -> tuple[Routes, FuelPlan]:
+        routes: Routes = await afind_routes_adapter(start, finish)
+        return routes, await asyncio.to_thread(fuel_plan, routes, vehicle_range, mpg)
+
+    @staticmethod
+    def extract_coordinates(geometry: str) -> Coordinates:
         route: Route = {
             "way_points": [],
             "summary": {"distance": 0.0, "duration": 0.0},
@@ -24,20 +324,189 @@ class RoutePlannerService:
             "bbox": [0.0, 0.0, 0.0, 0.0],
             "geometry": geometry,
         }
-        geojson: GeoJson = extract_points(route)
-        return geojson
+        return extract_coordinates(route)
+
+    @staticmethod
+    def extract_geojson(geometry: str, simplify: SimplifyOptions | None = None) -> LineString:
+        coordinates = RoutePlannerService.extract_coordinates(geometry)
+        if simplify:
+            coordinates = simplify.apply(coordinates)
+        return LineString(coordinates)
+
+    @staticmethod
+    def corridor(geometry: str, points: list[Point], distance: float) -> list[dict[str, typing.Any]]:
+        """It finds points within the distance from the route.
+
+        Args:
+            geometry: encoded polyline of the route
+            points: the points
+            distance: max. distance of the points from the route in meters
+
+        Returns:
+            index of the point, the point, its meters from the route and meters from the start of the route
+            to the nearest place of the route - sorted by the latter, `InvalidRoute` is raised if the geometry
+            is not a line
+        """
+        try:
+            route: Coordinates = RoutePlannerService.extract_coordinates(geometry)
+        except InvalidPolyline:
+            raise InvalidRoute("Geometry is not a valid encoded polyline.")
+        match: CorridorMatch = corridor(route, np.array([(point.long, point.lat) for point in points]), distance)
+        return [
+            {"index": index, "point": points[index], "distance": round(near, 1), "position": round(position, 1)}
+            for index, near, position in zip(match.indexes.tolist(), match.distances.tolist(), match.positions.tolist())
+        ]
+
+    @staticmethod
+    def encode_geometries(
+        geometries: typing.Sequence[str], media_type: str, simplify: SimplifyOptions | None = None
+    ) -> bytes:
+        """It encodes route geometries into binary media type (see `formats`)."""
+        return encode_geometries(geometries, media_type, simplify)
 
     @staticmethod
     def map_from_geojson(
-        geojson: GeoJson,
+        geometry: LineString,
         title: str = "Default map title",
         route_title: str = "Default route title",
         filename: str = "default_file_name.html",
+        simplify: SimplifyOptions | None = None,
+    ) -> File:
+        layer: Layer = map_composer.layer(geometry.coordinates, route_title, simplify=simplify)
+        return map_composer.compose(title, [layer], filename).file
+
+    @staticmethod
+    def routes_map(
+        routes: Routes,
+        title: str = "Found routes",
+        route_title: str = "Driving path",
+        filename: str | None = None,
+        simplify: SimplifyOptions | None = None,
+    ) -> File:
+        """It returns map of found routes, only routes which are not stored as layers yet are rendered."""
+        layers: list[Layer] = [
+            map_composer.layer(coordinates, route_title, routes_bounds([route]), simplify)
+            for route, coordinates in zip(routes, extract_coordinates_many(routes))
+        ]
+        return map_composer.compose(title, layers, filename or "map.html").file
+
+    @staticmethod
+    def compose_map(
+        geometries: list[tuple[str, str]],
+        title: str = "Composed map",
+        filename: str = "map.html",
+        simplify: SimplifyOptions | None = None,
+    ) -> Composition:
+        """It composes map of routes given by encoded polylines.
+
+        Args:
+            geometries: encoded polyline and tooltip of every route
+            title: map title
+            filename: filename of the map
+            simplify: simplification of the routes before they are drawn
+
+        Returns:
+            stored composition
+        """
+        return map_composer.compose(title, RoutePlannerService.map_layers(geometries, simplify), filename)
+
+    @staticmethod
+    def map_layers(geometries: list[tuple[str, str]], simplify: SimplifyOptions | None = None) -> list[Layer]:
+        return [
+            map_composer.layer(RoutePlannerService.extract_coordinates(geometry), route_title, simplify=simplify)
+            for geometry, route_title in geometries
+        ]
+
+    @staticmethod
+    def map_composition(map_id: str) -> Composition:
+        """It returns stored composition, `MapNotFound` is raised if it does not exist."""
+        return map_composer.load(map_id)
+
+    @staticmethod
+    def update_map(
+        map_id: str,
+        title: str | None = None,
+        add: list[tuple[str, str]] | None = None,
+        remove: list[str] | None = None,
+        simplify: SimplifyOptions | None = None,
+    ) -> Composition:
+        """It composes new map from the stored one - it changes the title, adds and removes routes.
+
+        Args:
+            map_id: id of the stored composition
+            title: new title of the map
+            add: encoded polyline and tooltip of every added route
+            remove: ids of removed layers
+            simplify: simplification of the added routes before they are drawn
+
+        Returns:
+            the new composition
+        """
+        return map_composer.update(map_id, title, RoutePlannerService.map_layers(add or [], simplify), remove)
+
+    @staticmethod
+    def map_tile(map_id: str, zoom: int, x: int, y: int) -> bytes:
+        """It returns vector tile of stored composition (empty if no route crosses the tile),
+        `MapNotFound` or `TileNotFound` is raised if the map or the tile does not exist.
+        """
+        return map_composer.tile(map_id, zoom, x, y)
+
+    @staticmethod
+    def tiled_map(composition: Composition, tiles_url: str) -> File:
+        """It returns map of the composition which loads only vector tiles in view from `tiles_url` template."""
+        return map_composer.tiled_map(composition, tiles_url)
+
+    @staticmethod
+    def create_map(
+        start: Point,
+        finish: Point,
+        title: str = "Found routes",
+        route_title: str = "Driving path",
+        filename: str | None = None,
+        simplify: SimplifyOptions | None = None,
+    ) -> File:
+        routes: Routes = find_routes_adapter(start, finish)
+        return RoutePlannerService.routes_map(routes, title, route_title, filename, simplify)
+
+    @staticmethod
+    async def acreate_map(
+        start: Point,
+        finish: Point,
+        title: str = "Found routes",
+        route_title: str = "Driving path",
+        filename: str | None = None,
+        simplify: SimplifyOptions | None = None,
     ) -> File:
-        created_map = create_map_from_geojson(geojson, title, route_title)
-        return File(filename, created_map)
+        routes: Routes = await afind_routes_adapter(start, finish)
+        # rendering and storing of the map is blocking, so it runs in a thread
+        return await asyncio.to_thread(RoutePlannerService.routes_map, routes, title, route_title, filename, simplify)
+
+    @staticmethod
+    def submit_map(
+        start: Point,
+        finish: Point,
+        title: str = "Found routes",
+        route_title: str = "Driving path",
+        simplify: SimplifyOptions | None = None,
+    ) -> MapJob:
+        """It submits `create_map` to the pool of map jobs."""
+        return map_jobs.submit(RoutePlannerService.create_map, start, finish, title, route_title, None, simplify)
+
+    @staticmethod
+    def submit_map_from_geojson(
+        geometry: LineString,
+        title: str = "Default map title",
+        route_title: str = "Default route title",
+        filename: str = "default_file_name.html",
+        simplify: SimplifyOptions | None = None,
+    ) -> MapJob:
+        """It submits `map_from_geojson` to the pool of map jobs."""
+        return map_jobs.submit(RoutePlannerService.map_from_geojson, geometry, title, route_title, filename, simplify)
+
+    @staticmethod
+    def map_job(job_id: str, wait: float = 0.0) -> MapJob | None:
+        return map_jobs.poll(job_id, wait)
 
     @staticmethod
-    def create_map(start: Point, finish: Point, title: str = "Found routes", route_title: str = "Driving path") -> File:
-        created_map = create_map(start, finish, title, route_title)
-        return File(f"{uuid.uuid4()}.html", created_map)
+    async def amap_job(job_id: str, wait: float = 0.0) -> MapJob | None:
+        return await map_jobs.apoll(job_id, wait)
@@ -0,0 +1,148 @@
+import heapq
+from dataclasses import dataclass
+
+import numpy as np
+import numpy.typing as npt
+
+from .polyline import Coordinates
+
+
+def zoom_tolerance(zoom: int) -> float:
+    """It returns size of one pixel (256px tiles) in degrees at the zoom level,
+    details smaller than this are not visible on the map.
+
+    Args:
+        zoom: map zoom level
+
+    Returns:
+        tolerance in degrees
+    """
+    return 360.0 / (256 * 2**zoom)
+
+
+def segment_distances(points: Coordinates, start: Coordinates, end: Coordinates) -> npt.NDArray[np.float64]:
+    """It computes planar distances of points from the segment.
+
+    Args:
+        points: array of (long, lat) coordinates
+        start: start of the segment
+        end: end of the segment
+
+    Returns:
+        distances of the points
+    """
+    segment = end - start
+    length2: float = float(segment @ segment)
+    if length2 == 0.0:
+        return np.hypot(*(points - start).T)
+    position = np.clip(((points - start) @ segment) / length2, 0.0, 1.0)
+    return np.hypot(*(points - start - position[:, np.newaxis] * segment).T)
+
+
+def douglas_peucker(coordinates: Coordinates, tolerance: float) -> Coordinates:
+    """Ramer–Douglas–Peucker simplification, it keeps points further than tolerance from simplified line.
+
+    Args:
+        coordinates: array of (long, lat[, elevation]) coordinates
+        tolerance: max. distance in degrees
+
+    Returns:
+        simplified coordinates, routes with less than 3 points are returned unchanged
+    """
+    if len(coordinates) < 3:
+        return coordinates
+    points = coordinates[:, :2]
+    keep = np.zeros(len(coordinates), dtype=bool)
+    keep[[0, -1]] = True
+    stack: list[tuple[int, int]] = [(0, len(coordinates) - 1)]
+    while stack:
+        first, last = stack.pop()
+        distances = segment_distances(points[first + 1 : last], points[first], points[last])
+        if distances.size and distances.max() > tolerance:
+            index = first + 1 + int(distances.argmax())
+            keep[index] = True
+            stack.extend(((first, index), (index, last)))
+    return coordinates[keep]
+
+
+class _EffectiveAreas:
+    """Points linked to their neighbours with effective area of triangle they form."""
+
+    def __init__(self, points: Coordinates):
+        self.xs: list[float] = points[:, 0].tolist()
+        self.ys: list[float] = points[:, 1].tolist()
+        self.previous: list[int] = list(range(-1, len(points) - 1))
+        self.following: list[int] = list(range(1, len(points) + 1))
+        self.areas: list[float] = [float("inf")] + [self.area(i) for i in range(1, len(points) - 1)] + [float("inf")]
+
+    def area(self, index: int) -> float:
+        p, f = self.previous[index], self.following[index]
+        xs, ys = self.xs, self.ys
+        return abs((xs[p] - xs[index]) * (ys[f] - ys[index]) - (xs[f] - xs[index]) * (ys[p] - ys[index])) / 2
+
+    def remove(self, index: int) -> list[tuple[float, int]]:
+        """It unlinks the point and returns updated areas of its neighbours."""
+        p, f = self.previous[index], self.following[index]
+        self.following[p], self.previous[f] = f, p
+        updated: list[tuple[float, int]] = []
+        for neighbour in (p, f):
+            if self.areas[neighbour] != float("inf"):
+                # area never decreases, so the removal order stays meaningful
+                self.areas[neighbour] = max(self.area(neighbour), self.areas[index])
+                updated.append((self.areas[neighbour], neighbour))
+        return updated
+
+
+def visvalingam(coordinates: Coordinates, max_points: int) -> Coordinates:
+    """Visvalingam–Whyatt simplification, it removes points with the smallest effective area
+    until there is `max_points` points.
+
+    Args:
+        coordinates: array of (long, lat[, elevation]) coordinates
+        max_points: target number of points (at least 2)
+
+    Returns:
+        simplified coordinates
+    """
+    if len(coordinates) <= max(max_points, 2):
+        return coordinates
+    areas = _EffectiveAreas(coordinates[:, :2])
+    heap: list[tuple[float, int]] = [(area, index) for index, area in enumerate(areas.areas[1:-1], start=1)]
+    heapq.heapify(heap)
+    keep = np.ones(len(coordinates), dtype=bool)
+    for _ in range(len(coordinates) - max(max_points, 2)):
+        area, index = heapq.heappop(heap)
+        while not keep[index] or area != areas.areas[index]:  # outdated entry
+            area, index = heapq.heappop(heap)
+        keep[index] = False
+        for entry in areas.remove(index):
+            heapq.heappush(heap, entry)
+    return coordinates[keep]
+
+
+@dataclass(frozen=True)
+class SimplifyOptions:
+    """Options of route simplification - tolerance in degrees or zoom level of the map
+    (tolerance is one pixel) and/or target number of points.
+    """
+
+    tolerance: float | None = None
+    max_points: int | None = None
+    zoom: int | None = None
+
+    def __bool__(self) -> bool:
+        return any(option is not None for option in (self.tolerance, self.max_points, self.zoom))
+
+    @property
+    def effective_tolerance(self) -> float | None:
+        if self.tolerance is None and self.zoom is not None:
+            return zoom_tolerance(self.zoom)
+        return self.tolerance
+
+    def apply(self, coordinates: Coordinates) -> Coordinates:
+        tolerance: float | None = self.effective_tolerance
+        if tolerance is not None:
+            coordinates = douglas_peucker(coordinates, tolerance)
+        if self.max_points is not None:
+            coordinates = visvalingam(coordinates, self.max_points)
+        return coordinates
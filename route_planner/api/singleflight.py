@@ -0,0 +1,95 @@
+import asyncio
+import threading
+import typing
+from dataclasses import dataclass
+
+
+T = typing.TypeVar("T")
+
+
+@dataclass
+class SingleFlightStats:
+    calls: int = 0
+    coalesced: int = 0
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: typing.Any = None
+        self.error: BaseException | None = None
+
+    def result(self) -> typing.Any:
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class SingleFlight:
+    """It deduplicates concurrent calls with the same key - only the first caller (leader) does the call,
+    the others wait for its result (or exception). It works for threads (gevent patches `threading`)
+    and for tasks of running event loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[str, _Call] = {}
+        self._tasks: dict[tuple[asyncio.AbstractEventLoop, str], asyncio.Future] = {}
+        self.stats = SingleFlightStats()
+
+    def do(self, key: str, call: typing.Callable[[], T]) -> T:
+        """It calls `call` or waits for the same call already in flight.
+
+        Args:
+            key: identification of the call
+            call: the call itself
+
+        Returns:
+            result of the call
+        """
+        with self._lock:
+            leader: bool = key not in self._calls
+            if leader:
+                self._calls[key] = _Call()
+                self.stats.calls += 1
+            else:
+                self.stats.coalesced += 1
+            in_flight: _Call = self._calls[key]
+        if not leader:
+            return in_flight.result()
+        try:
+            in_flight.value = call()
+        except BaseException as exc:
+            in_flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            in_flight.done.set()
+        return in_flight.value
+
+    async def ado(self, key: str, call: typing.Callable[[], typing.Awaitable[T]]) -> T:
+        """Async version of `do`, the call runs as separate task, so cancelled caller does not cancel
+        the call for the others.
+
+        Args:
+            key: identification of the call
+            call: coroutine function
+
+        Returns:
+            result of the call
+        """
+        loop_key = (asyncio.get_running_loop(), key)
+        with self._lock:
+            task: asyncio.Future | None = self._tasks.get(loop_key)
+            if task is not None:
+                self.stats.coalesced += 1
+            else:
+                task = self._tasks[loop_key] = asyncio.ensure_future(call())
+                task.add_done_callback(lambda _: self._tasks.pop(loop_key, None))
+                self.stats.calls += 1
+        return await asyncio.shield(task)
+
+
+directions_flight = SingleFlight()
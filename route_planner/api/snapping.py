@@ -0,0 +1,129 @@
+import functools
+import logging
+import os
+import typing
+
+from django.conf import settings
+
+from .aliases import Point
+from .graph import RoadGraph, distance
+from .hierarchy import IndexMismatch
+from .spatial import GridIndex, META as INDEX_META
+
+
+logger = logging.getLogger(__name__)
+
+
+class Unroutable(Exception):
+    """There is no routable node near the point."""
+
+    def __init__(self, index: int, long: float, lat: float, max_distance: float):
+        self.index = index
+        self.long = long
+        self.lat = lat
+        self.max_distance = max_distance
+
+    def __str__(self):
+        return (
+            f"Could not find routable point within a radius of {self.max_distance} meters "
+            f"of specified coordinate {self.index}: {self.long:.7f} {self.lat:.7f}."
+        )
+
+    @property
+    def error(self) -> dict[str, typing.Any]:
+        """The error in the same format as ORS returns it."""
+        return {"error": {"code": 2010, "message": str(self)}}
+
+
+def nearest_node(graph: RoadGraph, index: GridIndex | None, long: float, lat: float, max_distance: float) -> int | None:
+    """It returns the node of the graph nearest to the point.
+
+    Args:
+        graph: road graph
+        index: spatial index of the graph, all nodes are scanned without it
+        long: longitude of the point
+        lat: latitude of the point
+        max_distance: max. distance in meters
+
+    Returns:
+        the node or None if there is no node within the distance
+    """
+    if index is not None:
+        return index.nearest(long, lat, max_distance)
+    node: int = graph.nearest(long, lat)
+    return node if distance(long, lat, *graph.nodes[node].tolist()) <= max_distance else None
+
+
+class Snapper:
+    """It moves start/finish to the nearest node of road graph before routing - points far from roads
+    are rejected without calling routing backend and nearby points share the same node (and cache entry).
+
+    Args:
+        enabled: snapping is on
+        graph_dir: directory of road graph (see `build_road_graph` command) and its spatial index
+        max_distance: max. distance in meters of the point from the nearest node
+    """
+
+    def __init__(self, enabled: bool = False, graph_dir: str | None = None, max_distance: float = 350.0):
+        self.enabled = enabled
+        self.graph_dir = graph_dir
+        self.max_distance = max_distance
+
+    @functools.cached_property
+    def graph(self) -> RoadGraph:
+        if not self.graph_dir:
+            raise ValueError("Directory of road graph for snapping is not set (ROUTE_SNAP_GRAPH_DIR).")
+        return RoadGraph.load(self.graph_dir)
+
+    @functools.cached_property
+    def index(self) -> GridIndex:
+        # index built by `build_contraction_hierarchy` is mapped, it is built in memory otherwise
+        if os.path.exists(os.path.join(self.graph_dir or "", f"{INDEX_META}.json")):
+            return GridIndex.load(typing.cast(str, self.graph_dir), self.graph)
+        return GridIndex.build(self.graph.nodes, graph=self.graph.id)
+
+    def load(self):
+        """It maps the graph and its index at startup of worker process (see `LocalBackend.load`)."""
+        if not self.enabled:
+            return
+        try:
+            _ = self.index
+        except (ValueError, OSError, IndexMismatch) as exc:
+            logger.warning("Road graph for snapping of points is not loaded - %s", exc)
+
+    def snap(self, index: int, point: Point) -> Point:
+        """It returns the nearest node as point, `Unroutable` is raised when it is too far.
+
+        Args:
+            index: order of the point in request (0 start, 1 finish)
+            point: the point
+
+        Returns:
+            snapped point
+        """
+        node: int | None = nearest_node(self.graph, self.index, point.long, point.lat, self.max_distance)
+        if node is None:
+            raise Unroutable(index, point.long, point.lat, self.max_distance)
+        long, lat = self.graph.nodes[node].tolist()
+        return Point(lat=lat, long=long)
+
+    def routable(self, points: typing.Sequence[Point]) -> list[Point | None]:
+        """It snaps points if snapping is enabled, points without road nearby are None."""
+        if not self.enabled:
+            return list(points)
+        return [self.snap_or_none(index, point) for index, point in enumerate(points)]
+
+    def snap_or_none(self, index: int, point: Point) -> Point | None:
+        try:
+            return self.snap(index, point)
+        except Unroutable:
+            return None
+
+    def snap_all(self, *points: Point) -> list[Point]:
+        """It snaps all points if snapping is enabled."""
+        if not self.enabled:
+            return list(points)
+        return [self.snap(index, point) for index, point in enumerate(points)]
+
+
+point_snapper = Snapper(**settings.ROUTE_SNAP)
@@ -0,0 +1,174 @@
+import math
+import typing
+
+import numpy as np
+import numpy.typing as npt
+
+from .graph import RoadGraph, EARTH_RADIUS, haversine, save_arrays, load_arrays, load_meta
+from .polyline import Coordinates
+from .hierarchy import check_meta
+
+
+VERSION: int = 1
+META: str = "index"
+ARRAYS: tuple[str, ...] = ("index_cells", "index_offsets", "index_nodes")
+
+# meters of one degree of latitude
+DEGREE: float = math.pi * EARTH_RADIUS / 180
+
+
+class GridIndex:
+    """Spatial index of points (e.g. graph nodes) - points are sorted by cells of regular (long, lat) grid,
+    the nearest point is searched in rings of cells around the query point until no closer point can be found
+    in the next ring.
+
+    Args:
+        points: array of (long, lat) coordinates of indexed points
+        arrays: sorted keys of non-empty cells, offsets of their points and points ordered by cells
+        meta: version, size of cell (degrees) and id of the graph
+    """
+
+    def __init__(self, points: Coordinates, arrays: dict[str, npt.NDArray[typing.Any]], meta: dict[str, typing.Any]):
+        self.points = points
+        self.arrays = arrays
+        self.meta = meta
+        self.cell_size: float = float(meta["cell_size"])
+        self.cells = arrays["index_cells"]
+        self.offsets = arrays["index_offsets"]
+        self.nodes = arrays["index_nodes"]
+
+    @staticmethod
+    def keys(columns: npt.NDArray[np.int64], rows: npt.NDArray[np.int64]) -> npt.NDArray[np.int64]:
+        # rows of latitude are within (-90, 90) degrees, so they do not overlap
+        return columns * (1 << 32) + rows
+
+    def cell(self, long: float, lat: float) -> tuple[int, int]:
+        return math.floor(long / self.cell_size), math.floor(lat / self.cell_size)
+
+    def cells_of(self, coordinates: Coordinates) -> tuple[npt.NDArray[np.int64], npt.NDArray[np.int64]]:
+        """It returns columns and rows of cells of (long, lat) coordinates."""
+        return (
+            np.floor(coordinates[:, 0] / self.cell_size).astype(np.int64),
+            np.floor(coordinates[:, 1] / self.cell_size).astype(np.int64),
+        )
+
+    @classmethod
+    def build(cls, points: Coordinates, cell_size: float = 0.01, **meta: typing.Any) -> "GridIndex":
+        """It sorts points by cells.
+
+        Args:
+            points: array of (long, lat) coordinates
+            cell_size: size of cell in degrees
+            meta: other information about the index (e.g. id of the graph of the nodes)
+
+        Returns:
+            the index
+        """
+        columns = np.floor(points[:, 0] / cell_size).astype(np.int64)
+        rows = np.floor(points[:, 1] / cell_size).astype(np.int64)
+        keys = cls.keys(columns, rows)
+        order = np.argsort(keys, kind="stable")
+        cells, counts = np.unique(keys[order], return_counts=True)
+        arrays: dict[str, npt.NDArray[typing.Any]] = {
+            "index_cells": cells,
+            "index_offsets": np.concatenate(([0], np.cumsum(counts))).astype(np.int64),
+            "index_nodes": order.astype(np.int32),
+        }
+        return cls(points, arrays, {**meta, "version": VERSION, "cell_size": cell_size})
+
+    def save(self, directory: str):
+        save_arrays(directory, self.arrays, self.meta, META)
+
+    @classmethod
+    def load(cls, directory: str, graph: RoadGraph) -> "GridIndex":
+        """It maps the index of the graph, `IndexMismatch` is raised if it is built for other graph."""
+        meta: dict[str, typing.Any] = load_meta(directory, META)
+        check_meta(meta, graph, META, directory, VERSION)
+        return cls(graph.nodes, load_arrays(directory, ARRAYS), meta)
+
+    def lookup(self, keys: npt.NDArray[np.int64]) -> tuple[npt.NDArray[np.int64], npt.NDArray[np.int64]]:
+        """It returns the first position (in `nodes`) and number of points of every cell, 0 for empty cells."""
+        positions = np.searchsorted(self.cells, keys)
+        found = positions < len(self.cells)
+        found[found] = self.cells[positions[found]] == keys[found]
+        starts = np.where(found, self.offsets[np.minimum(positions, len(self.cells) - 1)], 0)
+        ends = np.where(found, self.offsets[np.minimum(positions, len(self.cells) - 1) + 1], 0)
+        return starts, ends - starts
+
+    def pairs(self, coordinates: Coordinates, radius: int = 1) -> tuple[npt.NDArray[np.int64], npt.NDArray[np.int32]]:
+        """It pairs query coordinates with indexed points in the same or neighbouring cells (up to `radius` cells
+        in both directions) - it is a prefilter of point to point distances, there is no loop over query points.
+
+        Args:
+            coordinates: array of (long, lat) query coordinates
+            radius: number of neighbouring cells
+
+        Returns:
+            indexes of query coordinates and indexes of indexed points of the pairs
+        """
+        columns, rows = self.cells_of(coordinates)
+        shifts = np.arange(-radius, radius + 1)
+        column_shifts, row_shifts = (shift.ravel() for shift in np.meshgrid(shifts, shifts))
+        queries = np.repeat(np.arange(len(coordinates)), len(column_shifts))
+        starts, counts = self.lookup(
+            self.keys(
+                np.repeat(columns, len(column_shifts)) + np.tile(column_shifts, len(columns)),
+                np.repeat(rows, len(row_shifts)) + np.tile(row_shifts, len(rows)),
+            )
+        )
+        # every cell is expanded to its points
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return np.repeat(queries, counts), self.nodes[np.repeat(starts, counts) + within]
+
+    def ring(self, column: int, row: int, radius: int) -> npt.NDArray[np.int32]:
+        """It returns points in cells on the ring of the radius (in cells) around the cell."""
+        offsets = np.arange(-radius, radius + 1)
+        if radius:
+            edge = np.full(len(offsets), radius)
+            columns = np.concatenate((offsets, offsets, -edge[1:-1], edge[1:-1]))
+            rows = np.concatenate((-edge, edge, offsets[1:-1], offsets[1:-1]))
+        else:
+            columns = rows = offsets
+        starts, counts = self.lookup(self.keys(column + columns.astype(np.int64), row + rows.astype(np.int64)))
+        return np.concatenate(
+            [self.nodes[start : start + count] for start, count in zip(starts.tolist(), counts.tolist())]
+            or [np.empty(0, dtype=np.int32)]
+        )
+
+    def nearest(self, long: float, lat: float, max_distance: float) -> int | None:
+        """It returns the point nearest to the query point, `None` if there is no point within the distance.
+
+        Args:
+            long: longitude of the point
+            lat: latitude of the point
+            max_distance: max. distance in meters
+
+        Returns:
+            index of the nearest point or None
+        """
+        column, row = self.cell(long, lat)
+        best_node, best_distance = None, math.inf
+        radius: int = 0
+        last: float = self.max_radius(lat, max_distance)
+        while self.bound(lat, radius) <= min(best_distance, max_distance) and radius <= last:
+            nodes = self.ring(column, row, radius)
+            if len(nodes):
+                distances = haversine(self.points[nodes], long, lat)
+                closest: int = int(np.argmin(distances))
+                if distances[closest] < best_distance:
+                    best_node, best_distance = int(nodes[closest]), float(distances[closest])
+            radius += 1
+        return best_node if best_distance <= max_distance else None
+
+    def bound(self, lat: float, radius: int) -> float:
+        """Lower bound of distance in meters from the point to nodes on the ring (the point lies within
+        the central cell, cells of the ring are at least `radius - 1` cells far away)."""
+        return max(radius - 1, 0) * self.cell_size * DEGREE * self.shrink(lat, radius)
+
+    def shrink(self, lat: float, radius: int) -> float:
+        # width of cell is the smallest on the side closer to pole
+        return math.cos(math.radians(min(abs(lat) + (radius + 1) * self.cell_size, 90.0)))
+
+    def max_radius(self, lat: float, max_distance: float) -> float:
+        """The ring which is certainly farther than the max. distance (it stops search near poles too)."""
+        return max_distance / (self.cell_size * DEGREE * max(self.shrink(lat, 1), 1e-6)) + 1
@@ -1,3 +1,617 @@
-from django.test import TestCase
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from openrouteservice.exceptions import ApiError, Timeout
+
+from django.conf import settings
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+
+from . import adapter, mvt, ors
+from .cache import DirectionsCache, LRUCache, directions_cache
+from .formats import FLOAT32, JSON
+from .graph import NoPathFound, RoadGraph, haversine
+from .hierarchy import ContractionHierarchy
+from .spatial import GridIndex
+from .fuel import OutOfRange, fuel_stations, refuel
+from .resilience import AdaptiveLimit, ResilientUpstream
+from .routing import ORSBackend
+from .aliases import Point
+from .services import RoutePlannerService, fuel_plan
+from .polyline import InvalidPolyline, decode, decode_many
+from .simplify import douglas_peucker, visvalingam
+from .singleflight import SingleFlight, directions_flight
+from .quota import BATCH, ors_priority
+from .upstream import UpstreamBudgetExceeded, count_upstream_calls, record_upstream_call, upstream_budget
+
+try:
+    import mapbox_vector_tile
+except ImportError:
+    mapbox_vector_tile = None
+
+
+NEW_YORK: dict[str, float] = {"lat": 40.658714, "long": -73.801984}
+LOS_ANGELES: dict[str, float] = {"lat": 33.948344, "long": -118.395067}
+CHICAGO: dict[str, float] = {"lat": 41.978367, "long": -87.904712}
+HOUSTON: dict[str, float] = {"lat": 29.990295, "long": -95.336654}
+
+DIRECTIONS: dict = {
+    "bbox": [-118.395067, 33.948344, -73.801984, 40.658714],
+    "routes": [
+        {
+            "summary": {"distance": 4500000.0, "duration": 150000.0},
+            "geometry": "_p~iF~ps|U_ulLnnqC_mqNvxq`@",
+            "bbox": [-120.95, 38.5, -120.2, 43.252],
+            "way_points": [0, 2],
+        }
+    ],
+    "metadata": {},
+}
+
+
+class UpstreamCallsTest(TestCase):
+    """ORS is mocked (`openrouteservice.directions`), so the tests count calls which would be made to it."""
+
+    def setUp(self):
+        for patch in (
+            mock.patch.object(adapter, "routing_backend", ORSBackend()),
+            mock.patch.object(directions_cache, "enabled", False),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+        directions = mock.patch.object(ors, "directions", return_value=DIRECTIONS)
+        self.directions = directions.start()
+        self.addCleanup(directions.stop)
+
+    def test_routes_call_ors_once(self):
+        response = self.client.post(
+            "/ninja/v2/routes",
+            json.dumps({"start": NEW_YORK, "finish": LOS_ANGELES}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["routes"]), 1)
+        self.assertEqual(self.directions.call_count, 1)
+        self.assertEqual(response["X-Upstream-Calls"], "1")
+
+    def test_route_is_returned_when_fuel_is_out_of_range(self):
+        with (
+            mock.patch.object(fuel_stations, "path", "stations.csv"),
+            mock.patch.object(fuel_stations, "plan", side_effect=OutOfRange(160934.4, 804672.0)),
+        ):
+            response = self.client.post(
+                "/api/v1/routes/",
+                json.dumps({"start": NEW_YORK, "finish": LOS_ANGELES}),
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 201)
+        route = response.json()["route"]
+        self.assertTrue(route["map"])
+        self.assertIsNone(route["fuel"])
+        self.assertEqual(route["fuel_error"]["type"], "fuel_out_of_range")
+        self.assertEqual(route["fuel_error"]["ctx"], {"status": 404, "error": {"position": 100.0}})
+
+    def test_matrix_timeout_is_ors_exception(self):
+        sources = [Point(**NEW_YORK), Point(**CHICAGO)]
+        with mock.patch.object(ors, "distance_matrix", side_effect=Timeout()):
+            with self.assertRaises(adapter.ORSException) as raised:
+                RoutePlannerService.find_matrix(sources, None)
+        self.assertEqual((raised.exception.status, raised.exception.code), (504, "ors_timeout"))
+
+    @override_settings(
+        ROUTE_UPSTREAM={"header": "X-Upstream-Calls", "hedged_header": "X-Upstream-Hedged-Calls", "strict_budget": True}
+    )
+    def test_strict_budget_raises_exceeded_budget(self):
+        @upstream_budget(1)
+        def handler():
+            record_upstream_call()
+            record_upstream_call()
+
+        with self.assertRaises(UpstreamBudgetExceeded):
+            handler()
+
+    @override_settings(
+        ROUTE_UPSTREAM={"header": "X-Upstream-Calls", "hedged_header": "X-Upstream-Hedged-Calls", "strict_budget": True}
+    )
+    def test_hedged_call_is_counted_apart_from_budget(self):
+        upstream = ResilientUpstream(hedge=True, hedge_min_delay=0.01, record_call=record_upstream_call)
+        for _ in range(upstream.latencies.min_samples):
+            upstream.latencies.add(0.001)
+        delays = iter([0.3, 0.0])
+
+        def slow_first(*args, **kwargs):
+            time.sleep(next(delays))
+            return DIRECTIONS
+
+        self.directions.side_effect = slow_first
+        with mock.patch.object(ors, "ors_upstream", upstream):
+            response = self.client.post(
+                "/ninja/v2/routes",
+                json.dumps({"start": NEW_YORK, "finish": LOS_ANGELES}),
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.directions.call_count, 2)
+        self.assertEqual((response["X-Upstream-Calls"], response["X-Upstream-Hedged-Calls"]), ("1", "1"))
+
+    @override_settings(
+        ROUTE_UPSTREAM={
+            "header": "X-Upstream-Calls",
+            "hedged_header": "X-Upstream-Hedged-Calls",
+            "strict_budget": False,
+        }
+    )
+    def test_budget_is_only_logged_by_default(self):
+        @upstream_budget(0)
+        def handler():
+            record_upstream_call()
+            return "done"
+
+        with self.assertLogs("api.upstream", "WARNING"):
+            self.assertEqual(handler(), "done")
+
+    def test_batch_streams_line_per_pair(self):
+        self.directions.side_effect = [DIRECTIONS, ApiError(404, {"error": "no route"})]
+        response = self.client.post(
+            "/ninja/v2/routes/batch",
+            json.dumps({"pairs": [{"start": NEW_YORK, "finish": LOS_ANGELES}, {"start": CHICAGO, "finish": HOUSTON}]}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        *lines, summary = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(summary, {"summary": {"pairs": 2, "upstream_calls": 2, "hedged_calls": 0}})
+        self.assertEqual(sorted(line["index"] for line in lines), [0, 1])
+        self.assertEqual(sum("routes" in line for line in lines), 1)
+        self.assertEqual([line["errors"][0]["ctx"]["status"] for line in lines if "errors" in line], [404])
+        self.assertEqual(self.directions.call_count, 2)
+
+    def test_batch_counts_ors_calls_of_pairs(self):
+        pairs = [(Point(**NEW_YORK), Point(**LOS_ANGELES)), (Point(**CHICAGO), Point(**HOUSTON))]
+        with count_upstream_calls() as calls:
+            results = list(RoutePlannerService.find_routes_batch(pairs))
+        self.assertEqual(len(results), 2)
+        self.assertEqual(calls.count, 2)
+
+
+class AdaptiveLimitTest(TestCase):
+    def test_call_over_limit_waits_for_free_slot(self):
+        upstream = ResilientUpstream(concurrency=2, min_concurrency=2, queue_timeout=5.0)
+
+        def request():
+            time.sleep(0.05)
+            return "done"
+
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(lambda _: upstream.call(request), range(8)))
+        self.assertEqual(results, ["done"] * 8)
+        self.assertEqual(upstream.limit.in_flight, 0)
+
+    def test_call_is_rejected_after_max_wait(self):
+        limit = AdaptiveLimit(initial=1, max_wait=0.05)
+        self.assertTrue(limit.acquire())
+        started = time.monotonic()
+        self.assertFalse(limit.acquire())
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+        # hedged requests do not wait
+        self.assertFalse(limit.acquire(wait=False))
+
+    def test_async_call_over_limit_waits_for_free_slot(self):
+        upstream = ResilientUpstream(concurrency=2, min_concurrency=2, queue_timeout=5.0)
+
+        async def request():
+            await asyncio.sleep(0.05)
+            return "done"
+
+        async def calls():
+            return await asyncio.gather(*(upstream.acall(request) for _ in range(8)))
+
+        self.assertEqual(asyncio.run(calls()), ["done"] * 8)
+        self.assertEqual(upstream.limit.in_flight, 0)
+
+    def test_async_call_is_rejected_after_max_wait(self):
+        limit = AdaptiveLimit(initial=1, max_wait=0.05, poll=0.01)
+        self.assertTrue(limit.acquire())
+        self.assertFalse(asyncio.run(limit.aacquire()))
+
+
+class CorridorTest(TestCase):
+    def test_route_which_is_not_line_is_rejected(self):
+        for geometry in ("", "_p~iF~ps|U", "_p~iF"):
+            with self.subTest(geometry=geometry):
+                response = self.client.post(
+                    "/ninja/v2/corridor",
+                    json.dumps({"geometry": geometry, "points": [NEW_YORK], "distance": 1000}),
+                    content_type="application/json",
+                )
+                self.assertEqual(response.status_code, 400)
+
+    def test_points_within_distance_are_found(self):
+        response = self.client.post(
+            "/ninja/v2/corridor",
+            json.dumps(
+                {
+                    "geometry": DIRECTIONS["routes"][0]["geometry"],
+                    "points": [LOS_ANGELES, {"lat": 40.7, "long": -120.95}],
+                    "distance": 1000,
+                }
+            ),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([point["index"] for point in response.json()["points"]], [1])
+
+
+class DirectionsCacheTest(TestCase):
+    def setUp(self):
+        self.cache = DirectionsCache(precision=3, ttl=60, max_entries=2, backend="default", namespace="test")
+        self.addCleanup(caches["default"].clear)
+
+    def test_points_within_quantization_step_share_key(self):
+        start, finish = Point(**NEW_YORK), Point(**LOS_ANGELES)
+        nearby = Point(lat=NEW_YORK["lat"] + 0.0002, long=NEW_YORK["long"] - 0.0002)
+        farther = Point(lat=NEW_YORK["lat"] + 0.002, long=NEW_YORK["long"])
+        key = self.cache.key("driving-car", start, finish)
+        self.assertEqual(self.cache.key("driving-car", nearby, finish), key)
+        self.assertNotEqual(self.cache.key("driving-car", farther, finish), key)
+        self.assertNotEqual(self.cache.key("driving-hgv", start, finish), key)
+        self.assertNotEqual(self.cache.key("driving-car", start, finish, alternatives=2), key)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        lru = LRUCache(max_entries=2, ttl=60)
+        lru.set("a", 1)
+        lru.set("b", 2)
+        lru.get("a")
+        self.assertEqual(lru.set("c", 3), 1)
+        self.assertEqual((lru.get("a"), lru.get("b"), lru.get("c")), (1, None, 3))
+
+    def test_entry_expires_after_ttl(self):
+        lru = LRUCache(max_entries=2, ttl=60)
+        with mock.patch("api.cache.time.monotonic", return_value=1000.0):
+            lru.set("a", 1)
+        with mock.patch("api.cache.time.monotonic", return_value=1059.0):
+            self.assertEqual(lru.get("a"), 1)
+        with mock.patch("api.cache.time.monotonic", return_value=1061.0):
+            self.assertIsNone(lru.get("a"))
+        self.assertEqual(len(lru), 0)
+
+    def test_evicted_entry_is_read_from_backend(self):
+        for key in ("a", "b", "c"):
+            self.cache.set(key, [{"key": key}])
+        self.assertEqual(len(self.cache.local), 2)
+        self.assertEqual(self.cache.get("a"), [{"key": "a"}])
+        self.assertEqual((self.cache.stats.backend_hits, self.cache.stats.evictions), (1, 2))
+
+    def test_stale_entry_is_served_only_within_stale_ttl(self):
+        cache = DirectionsCache(ttl=60, stale_ttl=600, namespace="test")
+        with mock.patch("api.cache.time.monotonic", return_value=1000.0):
+            cache.set("a", [{"key": "a"}])
+        with mock.patch("api.cache.time.monotonic", return_value=1100.0):
+            self.assertIsNone(cache.get("a"))
+            self.assertEqual(cache.get_stale("a"), [{"key": "a"}])
+        with mock.patch("api.cache.time.monotonic", return_value=1700.0):
+            self.assertIsNone(cache.get_stale("a"))
+        self.assertIsNone(DirectionsCache(ttl=60, namespace="test").get_stale("a"))
+
+    def test_expired_route_is_served_when_ors_fails(self):
+        # stale routes are served by default (ROUTE_CACHE["stale_ttl"])
+        cache = DirectionsCache(ttl=60, stale_ttl=settings.ROUTE_CACHE["stale_ttl"], namespace="test")
+        start, finish = Point(**NEW_YORK), Point(**LOS_ANGELES)
+        with (
+            mock.patch.object(adapter, "routing_backend", ORSBackend()),
+            mock.patch.object(adapter, "directions_cache", cache),
+            mock.patch.object(ors, "directions", side_effect=[DIRECTIONS, ApiError(503, {"error": "unavailable"})]),
+        ):
+            with mock.patch("api.cache.time.monotonic", return_value=1000.0):
+                routes = adapter.find_routes(start, finish)
+            with mock.patch("api.cache.time.monotonic", return_value=1100.0):
+                self.assertEqual(adapter.find_routes(start, finish), routes)
+
+    def test_many_keys_are_read_at_once(self):
+        self.cache.set_many({"a": 1, "b": 2, "c": 3})
+        self.cache.local.clear()
+        self.cache.set("b", 20)
+        self.assertEqual(self.cache.get_many(["a", "b", "d"]), {"a": 1, "b": 20})
+        stats = self.cache.stats
+        self.assertEqual((stats.local_hits, stats.backend_hits, stats.misses), (1, 1, 1))
+
+
+class SingleFlightTest(TestCase):
+    callers: int = 5
+
+    def wait_for_waiters(self, flight: SingleFlight):
+        deadline: float = time.monotonic() + 5
+        while flight.stats.coalesced < self.callers - 1 and time.monotonic() < deadline:
+            time.sleep(0.001)
+
+    def coalesce(self, flight: SingleFlight, call) -> list:
+        def caller():
+            try:
+                return flight.do("key", call)
+            except Exception as exc:
+                return exc
+
+        with ThreadPoolExecutor(self.callers) as executor:
+            futures = [executor.submit(caller) for _ in range(self.callers)]
+            return [future.result(timeout=5) for future in futures]
+
+    def test_only_leader_calls(self):
+        flight = SingleFlight()
+        calls: list[int] = []
+
+        def call():
+            self.wait_for_waiters(flight)
+            calls.append(1)
+            return "routes"
+
+        self.assertEqual(self.coalesce(flight, call), ["routes"] * self.callers)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual((flight.stats.calls, flight.stats.coalesced), (1, self.callers - 1))
+
+    def test_exception_of_leader_reaches_waiters(self):
+        flight = SingleFlight()
+        error = ValueError("ORS failed")
+
+        def call():
+            self.wait_for_waiters(flight)
+            raise error
+
+        self.assertEqual(self.coalesce(flight, call), [error] * self.callers)
+        self.assertEqual(flight.stats.calls, 1)
+        # the failed call is not kept, the next caller is the leader again
+        self.assertEqual(flight.do("key", lambda: "routes"), "routes")
+
+    def test_tasks_are_coalesced(self):
+        flight = SingleFlight()
+        calls: list[int] = []
+
+        async def call():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "routes"
+
+        async def callers():
+            return await asyncio.gather(*(flight.ado("key", call) for _ in range(self.callers)))
+
+        self.assertEqual(asyncio.run(callers()), ["routes"] * self.callers)
+        self.assertEqual(len(calls), 1)
+
+    def test_callers_of_other_priority_do_not_join(self):
+        started, finished = threading.Event(), threading.Event()
+        calls: list[int] = []
+
+        def request_routes(start, finish):
+            calls.append(1)
+            started.set()
+            finished.wait(5)
+            return DIRECTIONS["routes"]
+
+        def batch_caller():
+            with ors_priority(BATCH):
+                return adapter.find_routes(Point(**NEW_YORK), Point(**LOS_ANGELES))
+
+        with (
+            mock.patch.object(adapter, "request_routes", side_effect=request_routes),
+            mock.patch.object(directions_cache, "enabled", False),
+            ThreadPoolExecutor(2) as executor,
+        ):
+            batch = executor.submit(batch_caller)
+            self.assertTrue(started.wait(5))
+            coalesced: int = directions_flight.stats.coalesced
+            # the interactive caller makes its own call instead of waiting for the batch
+            interactive = executor.submit(adapter.find_routes, Point(**NEW_YORK), Point(**LOS_ANGELES))
+            deadline: float = time.monotonic() + 5
+            while len(calls) < 2 and time.monotonic() < deadline:
+                time.sleep(0.001)
+            finished.set()
+            self.assertEqual([batch.result(5), interactive.result(5)], [DIRECTIONS["routes"]] * 2)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(directions_flight.stats.coalesced, coalesced)
+
+
+class PolylineTest(TestCase):
+    def test_invalid_polyline_is_rejected(self):
+        for polyline in ("???", "_p~iF", "_p~iF~ps|", "é"):
+            with self.subTest(polyline=polyline):
+                self.assertRaises(InvalidPolyline, decode, polyline)
+                self.assertRaises(InvalidPolyline, decode_many, [DIRECTIONS["routes"][0]["geometry"], polyline])
+
+    def test_invalid_geometry_is_bad_request(self):
+        for accept in (JSON, FLOAT32):
+            with self.subTest(accept=accept):
+                response = self.client.post(
+                    "/ninja/v2/geojson",
+                    json.dumps({"geometry": "???"}),
+                    content_type="application/json",
+                    HTTP_ACCEPT=accept,
+                )
+                self.assertEqual(response.status_code, 400)
+
+
+class SimplifyTest(TestCase):
+    def test_short_routes_are_not_changed(self):
+        route = np.array([[-120.2, 38.5], [-120.95, 40.7]])
+        for length in (0, 1, 2):
+            with self.subTest(length=length):
+                np.testing.assert_array_equal(douglas_peucker(route[:length], 0.1), route[:length])
+                np.testing.assert_array_equal(visvalingam(route[:length], 2), route[:length])
+
+    def test_empty_geometry_is_simplified(self):
+        response = self.client.post(
+            "/ninja/v2/geojson", json.dumps({"geometry": "", "tolerance": 0.1}), content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["geojson"]["coordinates"], [])
+
+
+def random_graph(rng: np.random.Generator, nodes: int, edges: int) -> RoadGraph:
+    """Directed graph of random points within about 50 km with random edges (some pairs are unreachable)."""
+    coordinates = np.column_stack((rng.uniform(-88.2, -87.6, nodes), rng.uniform(41.6, 42.0, nodes)))
+    sources, targets = rng.integers(0, nodes, edges), rng.integers(0, nodes, edges)
+    distances = haversine(coordinates[sources], coordinates[targets, 0], coordinates[targets, 1])
+    durations = distances / rng.uniform(5.0, 35.0, edges)
+    return RoadGraph.build(coordinates, sources, targets, distances, durations)
+
+
+class ContractionHierarchyTest(TestCase):
+    def test_paths_are_as_fast_as_dijkstra(self):
+        rng = np.random.default_rng(7)
+        for settled_limit in (2, 500):
+            graph = random_graph(rng, 150, 450)
+            hierarchy = ContractionHierarchy.build(graph, settled_limit=settled_limit)
+            for source, target in rng.integers(0, len(graph), (200, 2)).tolist():
+                with self.subTest(settled_limit=settled_limit, source=source, target=target):
+                    expected = graph.costs(source, {target}).get(target)
+                    if expected is None:
+                        self.assertRaises(NoPathFound, hierarchy.shortest_path, source, target)
+                        continue
+                    path = hierarchy.shortest_path(source, target)
+                    self.assertEqual((path[0], path[-1]), (source, target))
+                    # costs of the path fail if its consecutive nodes are not connected by an edge
+                    self.assertAlmostEqual(graph.path_costs(path)[1], expected[1], delta=1e-6 * max(expected[1], 1))
+
+
+class GridIndexTest(TestCase):
+    def test_nearest_is_the_same_as_full_scan(self):
+        rng = np.random.default_rng(11)
+        for south, north in ((25.0, 26.0), (64.0, 65.0)):
+            points = np.column_stack((rng.uniform(-100.0, -99.0, 500), rng.uniform(south, north, 500)))
+            index = GridIndex.build(points, cell_size=0.02)
+            # queries reach out of the points, so some of them have no point within the distance
+            for long, lat, max_distance in zip(
+                rng.uniform(-100.1, -98.9, 300), rng.uniform(south - 0.1, north + 0.1, 300), rng.uniform(100, 8000, 300)
+            ):
+                with self.subTest(long=long, lat=lat, max_distance=max_distance):
+                    distances = haversine(points, long, lat)
+                    found = index.nearest(long, lat, max_distance)
+                    if distances.min() > max_distance:
+                        self.assertIsNone(found)
+                    else:
+                        self.assertIsNotNone(found)
+                        self.assertAlmostEqual(distances[found], distances.min(), places=6)
+
+
+def cheapest_refuel(positions: list[int], prices: list[int], length: int, vehicle_range: int) -> float | None:
+    """Cost of the cheapest refuelling by DP over whole units of fuel (the optimum is whole for whole inputs),
+    None if the finish is not reachable."""
+    costs = np.full(vehicle_range + 1, np.inf)
+    costs[vehicle_range] = 0.0
+    levels = np.arange(vehicle_range + 1)
+    position = 0
+    for station, price in [*zip(positions, prices), (length, None)]:
+        driven = station - position
+        costs = np.concatenate((costs[driven:], np.full(min(driven, vehicle_range + 1), np.inf)))[: vehicle_range + 1]
+        if price is not None:
+            # fuel is bought up to every level from any lower one
+            costs = np.minimum.accumulate(costs - price * levels) + price * levels
+        position = station
+    cheapest = float(costs.min())
+    return None if cheapest == np.inf else cheapest
+
+
+class RefuelTest(TestCase):
+    def test_greedy_refuelling_is_the_cheapest(self):
+        rng = np.random.default_rng(5)
+        for case in range(3000):
+            vehicle_range = int(rng.integers(5, 30))
+            length = int(rng.integers(1, 4 * vehicle_range))
+            positions = sorted(rng.integers(0, length + 1, rng.integers(0, 16)).tolist())
+            prices = rng.integers(1, 10, len(positions)).tolist()
+            arguments = (np.array(positions, dtype=float), np.array(prices, dtype=float), length, vehicle_range)
+            expected = cheapest_refuel(positions, prices, length, vehicle_range)
+            with self.subTest(case=case):
+                if expected is None:
+                    self.assertRaises(OutOfRange, refuel, *arguments)
+                    continue
+                bought = refuel(*arguments)
+                self.assertAlmostEqual(sum(prices[station] * amount for station, amount in bought), expected)
+
+    def test_station_out_of_range_is_reported(self):
+        with self.assertRaises(OutOfRange) as raised:
+            refuel(np.array([100.0, 150.0, 400.0]), np.array([3.0, 2.0, 1.0]), 500.0, 200.0)
+        self.assertEqual(raised.exception.position, 150.0)
+
+    def test_out_of_range_is_ors_exception(self):
+        routes = DIRECTIONS["routes"]
+        with (
+            mock.patch.object(fuel_stations, "path", "stations.csv"),
+            mock.patch.object(fuel_stations, "plan", side_effect=OutOfRange(160934.4, 804672.0)),
+        ):
+            with self.assertRaises(adapter.ORSException) as raised:
+                fuel_plan(routes, 500.0, 10.0)
+        self.assertEqual((raised.exception.status, raised.exception.code), (404, "fuel_out_of_range"))
+        self.assertEqual(raised.exception.data, {"position": 100.0})
+
+
+class VectorTileTest(TestCase):
+    def test_varints_of_boundary_values(self):
+        for value, expected in (
+            (0, b"\x00"),
+            (1, b"\x01"),
+            (127, b"\x7f"),
+            (128, b"\x80\x01"),
+            (300, b"\xac\x02"),
+            (2**63, b"\x80" * 9 + b"\x01"),
+            (2**64 - 1, b"\xff" * 9 + b"\x01"),
+        ):
+            with self.subTest(value=value):
+                self.assertEqual(mvt.varints(np.array([value], dtype=np.uint64)), expected)
+        values = np.array([0, 127, 128, 2**63], dtype=np.uint64)
+        self.assertEqual(mvt.varints(values), b"\x00\x7f\x80\x01" + b"\x80" * 9 + b"\x01")
+
+    def test_zigzag_of_negative_values(self):
+        values = np.array([0, -1, 1, -2, 2, -4096, 2**31 - 1, -(2**31), 2**63 - 1, -(2**63)], dtype=np.int64)
+        expected = [0, 1, 2, 3, 4, 8191, 2**32 - 2, 2**32 - 1, 2**64 - 2, 2**64 - 1]
+        self.assertEqual(mvt.zigzag(values).tolist(), expected)
+
+    def test_geometry_of_multi_part_line(self):
+        parts = [np.array([[5, 5], [10, 5], [10, 0]]), np.array([[3, 8], [0, 8]])]
+        move_to = 1 << 3 | mvt.MOVE_TO
+        # cursor stays at the end of the previous part, so the second MoveTo is relative to (10, 0)
+        expected = [move_to, 10, 10, 2 << 3 | mvt.LINE_TO, 10, 0, 0, 9, move_to, 13, 16, 1 << 3 | mvt.LINE_TO, 5, 0]
+        self.assertEqual(mvt.geometry(parts).tolist(), expected)
+
+    def test_clip_of_line_leaving_and_reentering_box(self):
+        box = (0.0, 0.0, 1.0, 1.0)
+        points = np.array([[0.5, 0.2], [1.5, 0.2], [1.5, 0.8], [0.5, 0.8], [0.5, 0.5], [-1.0, 0.5], [2.0, 0.5]])
+        parts = mvt.clip(points, box)
+        self.assertEqual(len(parts), 3)
+        np.testing.assert_allclose(parts[0], [[0.5, 0.2], [1.0, 0.2]])
+        np.testing.assert_allclose(parts[1], [[1.0, 0.8], [0.5, 0.8], [0.5, 0.5], [0.0, 0.5]])
+        np.testing.assert_allclose(parts[2], [[0.0, 0.5], [1.0, 0.5]])
+        self.assertEqual(mvt.clip(np.array([[2.0, 2.0], [3.0, 3.0]]), box), [])
+
+    def test_tile_is_read_by_decoder(self):
+        if mapbox_vector_tile is None:
+            self.skipTest("it requires `mapbox-vector-tile` package")
+        parts = [np.array([[5, 5], [10, 5], [10, 0]]), np.array([[3, 8], [0, 8]])]
+        features = [({"route": "0", "kind": "main"}, parts), ({"route": "1", "kind": "main"}, parts[:1])]
+        layer = mapbox_vector_tile.decode(mvt.encode_tile("routes", features), default_options={"y_coord_down": True})[
+            "routes"
+        ]
+        self.assertEqual((layer["extent"], layer["version"]), (4096, 2))
+        self.assertEqual([feature["id"] for feature in layer["features"]], [1, 2])
+        self.assertEqual([feature["properties"] for feature in layer["features"]], [props for props, _ in features])
+        self.assertEqual(
+            layer["features"][0]["geometry"],
+            {"type": "MultiLineString", "coordinates": [[[5, 5], [10, 5], [10, 0]], [[3, 8], [0, 8]]]},
+        )
+        self.assertEqual(
+            layer["features"][1]["geometry"], {"type": "LineString", "coordinates": [[5, 5], [10, 5], [10, 0]]}
+        )
+
+
+class MapCompositionTest(TestCase):
+    def test_route_which_is_not_line_is_rejected(self):
+        for geometry in ("", "_p~iF~ps|U", "_p~iF", "???"):
+            for path, body in (
+                ("/ninja/v2/maps", {"routes": [{"geometry": geometry}]}),
+                ("/ninja/v2/maps/unknown", {"add": [{"geometry": geometry}]}),
+            ):
+                with self.subTest(geometry=geometry, path=path):
+                    response = self.client.post(path, json.dumps(body), content_type="application/json")
+                    self.assertEqual(response.status_code, 400)
@@ -0,0 +1,155 @@
+import contextlib
+import contextvars
+import functools
+import inspect
+import logging
+import threading
+import typing
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamBudgetExceeded(Exception):
+    def __init__(self, handler: str, budget: int, calls: int):
+        self.handler = handler
+        self.budget = budget
+        self.calls = calls
+
+    def __str__(self):
+        return f"{self.handler} made {self.calls} ORS calls, but its budget is {self.budget}"
+
+
+class UpstreamCalls:
+    """Counter of ORS calls made while one request is handled, hedged requests (see `ResilientUpstream`) are counted
+    apart - they are sent only when ORS is slow, so they are not part of the budget of the handler."""
+
+    def __init__(self):
+        self.count: int = 0
+        self.hedged: int = 0
+        self._lock = threading.Lock()
+
+    def record(self, hedged: bool = False):
+        with self._lock:
+            if hedged:
+                self.hedged += 1
+            else:
+                self.count += 1
+
+
+# the counter is mutable, so copies of the context count into the same one - tasks get the copy implicitly,
+# threads of executors do not, their work has to be submitted as `contextvars.copy_context().run`
+_upstream_calls: contextvars.ContextVar[UpstreamCalls | None] = contextvars.ContextVar("upstream_calls", default=None)
+
+
+def record_upstream_call(hedged: bool = False):
+    """It counts one ORS call to the current request (if any).
+
+    Args:
+        hedged: the call is hedged request, the same call has been sent already
+    """
+    calls: UpstreamCalls | None = _upstream_calls.get()
+    if calls is not None:
+        calls.record(hedged)
+
+
+@contextlib.contextmanager
+def count_upstream_calls() -> typing.Iterator[UpstreamCalls]:
+    """It starts to count ORS calls, already started counting is reused."""
+    calls: UpstreamCalls | None = _upstream_calls.get()
+    if calls is not None:
+        yield calls
+        return
+    calls = UpstreamCalls()
+    token = _upstream_calls.set(calls)
+    try:
+        yield calls
+    finally:
+        _upstream_calls.reset(token)
+
+
+def check_budget(handler: str, budget: int, calls: int):
+    if calls <= budget:
+        return
+    if settings.ROUTE_UPSTREAM["strict_budget"]:
+        raise UpstreamBudgetExceeded(handler, budget, calls)
+    logger.warning("%s made %s ORS calls, but its budget is %s", handler, calls, budget)
+
+
+def upstream_budget(budget: int) -> typing.Callable:
+    """It declares max. number of ORS calls the handler may do. If the handler does more calls,
+    it is logged or `UpstreamBudgetExceeded` is raised (setting ROUTE_UPSTREAM["strict_budget"], e.g. in tests).
+
+    Args:
+        budget: max. number of ORS calls
+
+    Returns:
+        decorator of sync or async handler
+    """
+
+    def decorator(handler: typing.Callable) -> typing.Callable:
+        if inspect.iscoroutinefunction(handler):
+
+            @functools.wraps(handler)
+            async def async_wrapper(*args, **kwargs):
+                with count_upstream_calls() as calls:
+                    done_calls = calls.count
+                    result = await handler(*args, **kwargs)
+                    check_budget(handler.__qualname__, budget, calls.count - done_calls)
+                return result
+
+            return async_wrapper
+
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            with count_upstream_calls() as calls:
+                done_calls = calls.count
+                result = handler(*args, **kwargs)
+                check_budget(handler.__qualname__, budget, calls.count - done_calls)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+class UpstreamCallsMiddleware:
+    """Django middleware - it adds number of ORS calls (and hedged ones) made by the request to response headers."""
+
+    def __init__(self, get_response: typing.Callable):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with count_upstream_calls() as calls:
+            response = self.get_response(request)
+        response[settings.ROUTE_UPSTREAM["header"]] = str(calls.count)
+        response[settings.ROUTE_UPSTREAM["hedged_header"]] = str(calls.hedged)
+        return response
+
+
+class UpstreamCallsASGIMiddleware:
+    """ASGI (FastAPI) middleware - it adds number of ORS calls (and hedged ones) made by the request to response
+    headers."""
+
+    def __init__(self, app: typing.Callable):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        header: bytes = settings.ROUTE_UPSTREAM["header"].lower().encode("latin-1")
+        hedged_header: bytes = settings.ROUTE_UPSTREAM["hedged_header"].lower().encode("latin-1")
+        with count_upstream_calls() as calls:
+
+            async def send_with_header(message):
+                if message["type"] == "http.response.start":
+                    message["headers"] = [
+                        *message.get("headers", []),
+                        (header, str(calls.count).encode("latin-1")),
+                        (hedged_header, str(calls.hedged).encode("latin-1")),
+                    ]
+                await send(message)
+
+            await self.app(scope, receive, send_with_header)
@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter, APIRootView, Route
-from .views import RoutesViewSet
+from .views import RoutesViewSet, BatchRoutesViewSet, MatrixViewSet
 
 
 class RouteRootView(APIRootView):
@@ -28,6 +28,8 @@ class RouteRouter(DefaultRouter):
 
 drf_router = RouteRouter()
 drf_router.register("routes", RoutesViewSet, basename="routes")
+drf_router.register("routes/batch", BatchRoutesViewSet, basename="routes-batch")
+drf_router.register("matrix", MatrixViewSet, basename="matrix")
 
 
 urlpatterns = [
@@ -1,21 +1,46 @@
+import dataclasses
 import typing
 from rest_framework import mixins, viewsets
 from ninja import NinjaAPI, throttling
 
 from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.urls import reverse
 
 from .adapter import ORSException
+from .aliases import Point
 from .ninja_schema import (
     RouteQuestion,
+    BatchRouteQuestion,
     RoutesAnswer,
+    MatrixQuestion,
+    MatrixAnswer,
+    TourQuestion,
+    TourAnswer,
+    FuelQuestion,
+    FuelAnswer,
     GeoJsonQuestion,
     GeoJsonAnswer,
+    CorridorQuestion,
+    CorridorAnswer,
     MapFromGeoJsonQuestion,
     MapQuestion,
     MapAnswer,
+    ComposeMapQuestion,
+    UpdateMapQuestion,
+    CompositionAnswer,
+    MapJobAnswer,
 )
-from .services import RoutePlannerService
-from .serializers import RouteSer
+from .composition import Composition, MapNotFound, TileNotFound, map_composer
+from .corridor import InvalidRoute
+from .polyline import InvalidPolyline
+from .jobs import MapJob, JobQueueFull
+from .matrix import max_tiles
+from .formats import negotiate, JSON
+from .responses import FastJsonResponse, GeometryResponse, TileResponse
+from .upstream import upstream_budget
+from .services import RoutePlannerService, RoutePair, Tour, batch_lines, max_tour_calls
+from .serializers import RouteSer, BatchRouteSer, MatrixSer
 
 
 api = NinjaAPI(
@@ -33,6 +58,7 @@ api = NinjaAPI(
 
 
 @api.post("/routes", response=RoutesAnswer, tags=["Routes"])
+@upstream_budget(1)
 def find_routes(request, route: RouteQuestion):
     """### Call parameters
     - **start** route location
@@ -41,6 +67,12 @@ def find_routes(request, route: RouteQuestion):
     ### Call result
     - includes start end finish points of the requested routes
     - textual representation of the all found routes
+    - only geometries of the routes if binary format is requested by `Accept` header:
+        - `application/vnd.route-planner.polyline` encoded polylines (as returned by ORS), one per line
+        - `application/vnd.route-planner.coordinates+float32` (or `+float64`) for every route
+          uint32 number of points and (long, lat) pairs, little-endian
+        - `application/vnd.route-planner.columnar` uint32 number of routes, uint32 offsets of routes,
+          float64 longitudes and float64 latitudes of all points, little-endian
 
     Example:
     ```json
@@ -59,28 +91,185 @@ def find_routes(request, route: RouteQuestion):
     from ninja.errors import ValidationError
 
     try:
-        RoutePlannerService().find_routes(route.start, route.finish)
+        routes = RoutePlannerService().find_routes(route.start, route.finish)
+    except ORSException as exc:
+        error_details: list[dict[str, typing.Any]] = [
+            {"msg": exc.message, "type": exc.code, "ctx": {"status": exc.status, "error": exc.data}}
+        ]
+        raise ValidationError(error_details)
+    media_type: str = negotiate(request.headers.get("accept"))
+    if media_type != JSON:
+        geometries: list[str] = [found_route["geometry"] for found_route in routes]
+        return GeometryResponse(RoutePlannerService().encode_geometries(geometries, media_type), media_type)
+    return FastJsonResponse(
+        {"start": route.start, "finish": route.finish, "routes": routes}, headers={"Vary": "Accept"}
+    )
+
+
+@api.post("/routes/batch", tags=["Routes"])
+def find_routes_batch(request, batch: BatchRouteQuestion):
+    """### Call parameters
+    - **pairs** list of **start** and **finish** route locations
+
+    ### Call result
+    - NDJSON stream, one line per pair as soon as its routes are found (not in order of pairs)
+    - each line includes **index** of the pair, its **start** and **finish** and
+      **routes** or **errors** if Open Route Service failed for the pair
+    - the last line is **summary** with number of **pairs**, **upstream_calls** (ORS calls) and **hedged_calls**
+      (hedged ORS calls) made for them,
+      `X-Upstream-Calls` header is sent before the pairs are resolved, so it does not include them
+
+    Example:
+    ```json
+    {
+        "pairs": [
+            {
+                "start": {"lat": 40.658714, "long": -73.801984},
+                "finish": {"lat": 33.948344, "long": -118.395067}
+            },
+            {
+                "start": {"lat": 41.978367, "long": -87.904712},
+                "finish": {"lat": 29.990295, "long": -95.336654}
+            }
+        ]
+    }
+    ```
+    """
+    pairs: list[RoutePair] = [(pair.start, pair.finish) for pair in batch.pairs]
+    return StreamingHttpResponse(batch_lines(pairs), content_type="application/x-ndjson")
+
+
+@api.post("/matrix", response=MatrixAnswer, tags=["Routes"])
+@upstream_budget(max_tiles())
+def find_matrix(request, query: MatrixQuestion):
+    """### Call parameters
+    - **sources** route locations
+    - **destinations** optional route locations, **sources** are used if they are not set
+
+    ### Call result
+    - **distances** (meters) and **durations** (seconds) of the fastest routes from every source (row)
+      to every destination (column), `null` if there is no route, geometries of the routes are not included
+
+    Example:
+    ```json
+    {
+        "sources": [
+            {"lat": 40.658714, "long": -73.801984},
+            {"lat": 41.978367, "long": -87.904712}
+        ],
+        "destinations": [
+            {"lat": 33.948344, "long": -118.395067},
+            {"lat": 29.990295, "long": -95.336654}
+        ]
+    }
+    ```
+    """
+    from ninja.errors import ValidationError
+
+    destinations: list[Point] = query.destinations or query.sources
+    try:
+        matrix = RoutePlannerService().find_matrix(query.sources, destinations)
+    except ORSException as exc:
+        error_details: list[dict[str, typing.Any]] = [
+            {"msg": exc.message, "type": exc.code, "ctx": {"status": exc.status, "error": exc.data}}
+        ]
+        raise ValidationError(error_details)
+    return FastJsonResponse({"sources": query.sources, "destinations": destinations, **matrix})
+
+
+@api.post("/tour", response=TourAnswer, tags=["Routes"])
+@upstream_budget(max_tour_calls())
+def optimize_tour(request, query: TourQuestion):
+    """### Call parameters
+    - **depot** start of the tour (and its finish if **round_trip** is set, default)
+    - **stops** locations to visit (in any order)
+    - **title** title of the map
+    - **route_title** title of the tour
+
+    ### Call result
+    - **order** indexes of **stops** in the order of the fastest found tour and **stops** in this order
+    - **distance** (meters) and **duration** (seconds) of the whole tour
+    - **map** URL of the map of the tour
+
+    Example:
+    ```json
+    {
+        "depot": {"lat": 40.658714, "long": -73.801984},
+        "stops": [
+            {"lat": 41.978367, "long": -87.904712},
+            {"lat": 33.948344, "long": -118.395067},
+            {"lat": 29.990295, "long": -95.336654}
+        ]
+    }
+    ```
+    """
+    from ninja.errors import ValidationError
+
+    try:
+        tour: Tour = RoutePlannerService().optimize_tour(
+            query.depot, query.stops, query.round_trip, query.title, query.route_title
+        )
     except ORSException as exc:
         error_details: list[dict[str, typing.Any]] = [
             {"msg": exc.message, "type": exc.code, "ctx": {"status": exc.status, "error": exc.data}}
         ]
         raise ValidationError(error_details)
     return {
-        "start": route.start,
-        "finish": route.finish,
-        "routes": RoutePlannerService().find_routes(route.start, route.finish),
+        "order": tour.order,
+        "stops": [query.stops[index] for index in tour.order],
+        "distance": tour.distance,
+        "duration": tour.duration,
+        "map": request.build_absolute_uri(tour.map.url),
+    }
+
+
+@api.post("/fuel", response=FuelAnswer, tags=["Routes"])
+@upstream_budget(1)
+def plan_fuel(request, query: FuelQuestion):
+    """### Call parameters
+    - **start** route location
+    - **finish** route location (both within the **USA**)
+    - **vehicle_range** miles on full tank and **mpg** miles per gallon (optional)
+
+    ### Call result
+    - **distance** miles of the route
+    - **stops** the cheapest stations to fuel up (the vehicle starts with full tank), gallons bought there and cost
+    - **gallons** and **cost** of the fuel bought on the route
+
+    Example:
+    ```json
+    {
+        "start": {"lat": 40.658714, "long": -73.801984},
+        "finish": {"lat": 33.948344, "long": -118.395067},
+        "vehicle_range": 500,
+        "mpg": 10
     }
+    ```
+    """
+    from ninja.errors import ValidationError
+
+    try:
+        _, plan = RoutePlannerService().plan_fuel(query.start, query.finish, query.vehicle_range, query.mpg)
+    except ORSException as exc:
+        error_details: list[dict[str, typing.Any]] = [
+            {"msg": exc.message, "type": exc.code, "ctx": {"status": exc.status, "error": exc.data}}
+        ]
+        raise ValidationError(error_details)
+    return {"start": query.start, "finish": query.finish, **dataclasses.asdict(plan)}
 
 
 @api.post("/geojson", response=GeoJsonAnswer, tags=["Routes"])
+@upstream_budget(0)
 def extract_geojson(request, route: GeoJsonQuestion):
     """### Call parameters
     - **geometry** geometry string read from route data structure returned from `/routes` endpoint.
+    - **tolerance**, **max_points**, **zoom** optional simplification of the route
 
     ### Call result
     - geojson structure
         - type = "LineString"
         - coordinates: list of Open Route Service points(coordinates)
+    - or binary format requested by `Accept` header, the same as `/routes` provides
 
     Example:
     ```json
@@ -89,39 +278,93 @@ def extract_geojson(request, route: GeoJsonQuestion):
     }
     ```
     """
-    return {"geojson": RoutePlannerService().extract_geojson(route.geometry)}
+    from ninja.errors import HttpError
+
+    media_type: str = negotiate(request.headers.get("accept"))
+    try:
+        if media_type != JSON:
+            return GeometryResponse(
+                RoutePlannerService().encode_geometries([route.geometry], media_type, route.simplify_options()),
+                media_type,
+            )
+        geojson = RoutePlannerService().extract_geojson(route.geometry, route.simplify_options())
+    except InvalidPolyline as exc:
+        raise HttpError(400, str(exc))
+    return FastJsonResponse({"geojson": geojson}, headers={"Vary": "Accept"})
+
+
+@api.post("/corridor", response=CorridorAnswer, tags=["Routes"])
+@upstream_budget(0)
+def find_corridor(request, query: CorridorQuestion):
+    """### Call parameters
+    - **geometry** geometry string read from route data structure returned from `/routes` endpoint
+    - **points** locations (e.g. stations or depots)
+    - **distance** max. meters of the points from the route
+
+    ### Call result
+    - **points** within the distance from the route in the order along the route, with index of the point
+      in the request, meters from the route and meters from the start of the route
+
+    Example:
+    ```json
+    {
+        "geometry": "cddwFbomaM...",
+        "points": [{"lat": 40.658714, "long": -73.801984}, {"lat": 41.978367, "long": -87.904712}],
+        "distance": 1000
+    }
+    ```
+    """
+    from ninja.errors import HttpError
+
+    try:
+        points = RoutePlannerService().corridor(query.geometry, query.points, query.distance)
+    except InvalidRoute as exc:
+        raise HttpError(400, str(exc))
+    return FastJsonResponse({"points": points})
 
 
 @api.post("/map_from_geojson", response=MapAnswer, tags=["Routes"])
+@upstream_budget(0)
 def map_from_geo_json(request, query: MapFromGeoJsonQuestion):
     """### Call parameters
     - **geojson** data structure of route returned from `/geojson` endpoint.
     - **title** title of the map
     - **route_title** title of the route
     - **filename** filename of the map
+    - **tolerance**, **max_points**, **zoom** optional simplification of the route
 
     ### Call result
     - map: URL of the map
+    - id: id of the map, see `/maps/{map_id}`
     """
-    file = RoutePlannerService().map_from_geojson(
-        query.geojson,
-        title=query.title,
-        route_title=query.route_title,
-        filename=query.filename,
-    )
-    return {"map": request.build_absolute_uri(file.url)}
+    from ninja.errors import HttpError
+
+    try:
+        file = RoutePlannerService().map_from_geojson(
+            query.geojson,
+            title=query.title,
+            route_title=query.route_title,
+            filename=query.filename,
+            simplify=query.simplify_options(),
+        )
+    except InvalidRoute as exc:
+        raise HttpError(400, str(exc))
+    return {"map": request.build_absolute_uri(file.url), "id": map_composer.map_id(file)}
 
 
 @api.post("/map", response=MapAnswer, tags=["Routes"])
+@upstream_budget(1)
 def create_map(request, query: MapQuestion):
     """### Call parameters
     - **start** route location
     - **finish** route location (both within the **USA**)
     - **title** title of the map
     - **route_title** title of the route
+    - **tolerance**, **max_points**, **zoom** optional simplification of the route
 
     ### Call result
     - map: URL of the map
+    - id: id of the map, see `/maps/{map_id}`
 
      Example:
     ```json
@@ -144,20 +387,218 @@ def create_map(request, query: MapQuestion):
         query.finish,
         query.title,
         query.route_title,
+        simplify=query.simplify_options(),
+    )
+    return {"map": request.build_absolute_uri(file.url), "id": map_composer.map_id(file)}
+
+
+def tiles_url(request, map_id: str) -> str:
+    path: str = reverse(f"{api.urls_namespace}:map_tile", kwargs={"map_id": map_id, "zoom": 0, "x": 0, "y": 0})
+    # placeholders of Leaflet instead of the first tile
+    return request.build_absolute_uri(path).replace("/0/0/0.mvt", "/{z}/{x}/{y}.mvt")
+
+
+def composition_answer(request, composition: Composition) -> dict[str, typing.Any]:
+    tiles: str = tiles_url(request, composition.id)
+    return {
+        "id": composition.id,
+        "title": composition.title,
+        "map": request.build_absolute_uri(composition.file.url),
+        "layers": [{"id": layer.id, "title": layer.title} for layer in composition.layers],
+        "tiles": tiles,
+        "tiled_map": request.build_absolute_uri(RoutePlannerService().tiled_map(composition, tiles).url),
+    }
+
+
+@api.post("/maps", response=CompositionAnswer, tags=["Maps"])
+@upstream_budget(0)
+def compose_map(request, query: ComposeMapQuestion):
+    """### Call parameters
+    - **routes** geometry strings read from route data structure returned from `/routes` endpoint
+      and tooltips of the routes
+    - **title** title of the map
+    - **filename** filename of the map
+    - **tolerance**, **max_points**, **zoom** optional simplification of the routes
+
+    ### Call result
+    - **id** of the map and **map** URL of the map
+    - **layers** ids and tooltips of the routes, see `/maps/{map_id}`
+    - **tiles** URL template of vector tiles of the routes, see `/maps/{map_id}/tiles/{zoom}/{x}/{y}.mvt`
+    - **tiled_map** URL of the map which loads only tiles in view, its size does not depend on length of routes
+
+    Routes which were already drawn (with the same tooltip and simplification) are not rendered again.
+    """
+    from ninja.errors import HttpError
+
+    try:
+        composition: Composition = RoutePlannerService().compose_map(
+            [(route.geometry, route.title) for route in query.routes],
+            query.title,
+            query.filename,
+            query.simplify_options(),
+        )
+    except (InvalidPolyline, InvalidRoute) as exc:
+        raise HttpError(400, str(exc))
+    return composition_answer(request, composition)
+
+
+@api.get("/maps/{map_id}", response=CompositionAnswer, tags=["Maps"])
+@upstream_budget(0)
+def map_composition(request, map_id: str):
+    """### Call parameters
+    - **map_id** id of the map
+
+    ### Call result
+    - the same as `/maps`
+    """
+    from ninja.errors import HttpError
+
+    try:
+        return composition_answer(request, RoutePlannerService().map_composition(map_id))
+    except MapNotFound as exc:
+        raise HttpError(404, str(exc))
+
+
+@api.post("/maps/{map_id}", response=CompositionAnswer, tags=["Maps"])
+@upstream_budget(0)
+def update_map(request, map_id: str, query: UpdateMapQuestion):
+    """### Call parameters
+    - **map_id** id of the map
+    - **title** new title of the map (optional)
+    - **add** routes added to the map, the same as **routes** of `/maps`
+    - **remove** ids of routes (layers) removed from the map
+    - **tolerance**, **max_points**, **zoom** optional simplification of the added routes
+
+    ### Call result
+    - the same as `/maps`, the changed map is stored as a new map with new **id**
+
+    Only added routes are rendered, the other routes of the map are reused.
+    """
+    from ninja.errors import HttpError
+
+    try:
+        composition: Composition = RoutePlannerService().update_map(
+            map_id,
+            query.title,
+            [(route.geometry, route.title) for route in query.add],
+            query.remove,
+            query.simplify_options(),
+        )
+    except MapNotFound as exc:
+        raise HttpError(404, str(exc))
+    except (InvalidPolyline, InvalidRoute) as exc:
+        raise HttpError(400, str(exc))
+    return composition_answer(request, composition)
+
+
+@api.get("/maps/{map_id}/tiles/{zoom}/{x}/{y}.mvt", url_name="map_tile", tags=["Maps"])
+@upstream_budget(0)
+def map_tile(request, map_id: str, zoom: int, x: int, y: int):
+    """### Call parameters
+    - **map_id** id of the map
+    - **zoom**, **x**, **y** the tile
+
+    ### Call result
+    - Mapbox Vector Tile with layer "routes", one line per route of the map with its **id** and **title**,
+      lines are simplified for the zoom level and clipped by the tile, the tile is empty if no route crosses it
+    """
+    from ninja.errors import HttpError
+
+    try:
+        return TileResponse(RoutePlannerService().map_tile(map_id, zoom, x, y))
+    except (MapNotFound, TileNotFound) as exc:
+        raise HttpError(404, str(exc))
+
+
+def job_answer(request, job: MapJob) -> dict[str, typing.Any]:
+    answer: dict[str, typing.Any] = {"id": job.id, "status": job.status, "map": None, "errors": job.errors}
+    if job.map is not None:
+        answer["map"] = request.build_absolute_uri(job.map)
+    return answer
+
+
+def submit_job(request, submit: typing.Callable[[], MapJob]) -> tuple[int, dict[str, typing.Any]]:
+    from ninja.errors import HttpError
+
+    try:
+        return 202, job_answer(request, submit())
+    except JobQueueFull as exc:
+        raise HttpError(503, str(exc))
+
+
+@api.post("/map_from_geojson/jobs", response={202: MapJobAnswer}, tags=["Map jobs"])
+@upstream_budget(0)
+def submit_map_from_geo_json(request, query: MapFromGeoJsonQuestion):
+    """### Call parameters
+    - the same as `/map_from_geojson`
+
+    ### Call result
+    - id of the job which renders the map in background, see `/map/jobs/{job_id}`
+    """
+    return submit_job(
+        request,
+        lambda: RoutePlannerService().submit_map_from_geojson(
+            query.geojson,
+            title=query.title,
+            route_title=query.route_title,
+            filename=query.filename,
+            simplify=query.simplify_options(),
+        ),
     )
-    return {"map": request.build_absolute_uri(file.url)}
+
+
+@api.post("/map/jobs", response={202: MapJobAnswer}, tags=["Map jobs"])
+@upstream_budget(0)
+def submit_map(request, query: MapQuestion):
+    """### Call parameters
+    - the same as `/map`
+
+    ### Call result
+    - id of the job which finds the route and renders the map in background, see `/map/jobs/{job_id}`
+    """
+    return submit_job(
+        request,
+        lambda: RoutePlannerService().submit_map(
+            query.start,
+            query.finish,
+            query.title,
+            query.route_title,
+            simplify=query.simplify_options(),
+        ),
+    )
+
+
+@api.get("/map/jobs/{job_id}", response=MapJobAnswer, tags=["Map jobs"])
+def map_job(request, job_id: str, wait: float = 0.0):
+    """### Call parameters
+    - **job_id** id of the job
+    - **wait** optional seconds to wait until the job is finished (long-poll)
+
+    ### Call result
+    - **status** pending, done or failed
+    - **map** URL of the map when the job is done
+    - **errors** when the job failed
+    """
+    from ninja.errors import HttpError
+
+    job: MapJob | None = RoutePlannerService().map_job(job_id, wait)
+    if job is None:
+        raise HttpError(404, "Unknown map job")
+    return job_answer(request, job)
 
 
 class RoutesViewSet(mixins.CreateModelMixin, viewsets.GenericViewSet):
     """### Call parameters
     - **start** route location
     - **finish** route location (both within the **USA**)
+    - **vehicle_range** miles on full tank and **mpg** miles per gallon (optional)
 
     ### Call result
     - **a map** of the route
-    - **optimal locations** to fuel up
+    - **optimal locations** to fuel up, gallons and money spent there (null if fuel stations are not configured)
+    - **fuel_error** why fuel stops are null although stations are configured (e.g. no station within the range)
 
-    *optimal* mostly means cost-effective based on fuel prices
+    *optimal* mostly means cost-effective based on fuel prices, the vehicle starts with full tank
 
     Example:
     ```json
@@ -176,6 +617,7 @@ class RoutesViewSet(mixins.CreateModelMixin, viewsets.GenericViewSet):
 
     serializer_class = RouteSer
 
+    @upstream_budget(1)
     def perform_create(self, ser: RouteSer):
         from rest_framework.exceptions import ValidationError
 
@@ -186,3 +628,72 @@ class RoutesViewSet(mixins.CreateModelMixin, viewsets.GenericViewSet):
                 {"msg": exc.message, "type": exc.code, "ctx": {"status": exc.status, "error": exc.data}}
             ]
             raise ValidationError(error_details)
+
+
+class BatchRoutesViewSet(viewsets.GenericViewSet):
+    """### Call parameters
+    - **pairs** list of **start** and **finish** route locations
+
+    ### Call result
+    - NDJSON stream, one line per pair as soon as its routes are found (not in order of pairs)
+    - each line includes **index** of the pair, its **start** and **finish** and
+      **routes** or **errors** if Open Route Service failed for the pair
+    - the last line is **summary** with number of **pairs**, **upstream_calls** (ORS calls) and **hedged_calls**
+      (hedged ORS calls) made for them,
+      `X-Upstream-Calls` header is sent before the pairs are resolved, so it does not include them
+
+    Example:
+    ```json
+    {
+        "pairs": [
+            {
+                "start": {"lat": 40.658714, "long": -73.801984},
+                "finish": {"lat": 33.948344, "long": -118.395067}
+            }
+        ]
+    }
+    ```
+    """
+
+    serializer_class = BatchRouteSer
+
+    def create(self, request, *args, **kwargs):
+        ser = BatchRouteSer(data=request.data, context=self.get_serializer_context())
+        ser.is_valid(raise_exception=True)
+        pairs: list[RoutePair] = ser.route_pairs()
+        return StreamingHttpResponse(batch_lines(pairs), content_type="application/x-ndjson")
+
+
+class MatrixViewSet(mixins.CreateModelMixin, viewsets.GenericViewSet):
+    """### Call parameters
+    - **sources** route locations
+    - **destinations** optional route locations, **sources** are used if they are not set
+
+    ### Call result
+    - **distances** (meters) and **durations** (seconds) of the fastest routes from every source (row)
+      to every destination (column), `null` if there is no route
+
+    Example:
+    ```json
+    {
+        "sources": [
+            {"lat": 40.658714, "long": -73.801984},
+            {"lat": 41.978367, "long": -87.904712}
+        ]
+    }
+    ```
+    """
+
+    serializer_class = MatrixSer
+
+    @upstream_budget(max_tiles())
+    def perform_create(self, ser: MatrixSer):
+        from rest_framework.exceptions import ValidationError
+
+        try:
+            ser.save()
+        except ORSException as exc:
+            error_details: list[dict[str, typing.Any]] = [
+                {"msg": exc.message, "type": exc.code, "ctx": {"status": exc.status, "error": exc.data}}
+            ]
+            raise ValidationError(error_details)
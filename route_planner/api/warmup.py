@@ -0,0 +1,285 @@
+import csv
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from django.conf import settings
+
+from .adapter import ORSException, find_routes, snap
+from .aliases import Point, Routes
+from .cache import directions_cache
+from .quota import WARMUP, ors_priority
+from .routing import routing_backend
+from .services import RoutePlannerService
+
+
+logger = logging.getLogger(__name__)
+
+CACHED: str = "cached"
+FETCHED: str = "fetched"
+FAILED: str = "failed"
+SKIPPED: str = "skipped"
+
+
+@dataclass
+class Lane:
+    start: Point
+    finish: Point
+
+    @property
+    def key(self) -> tuple[float, float, float, float]:
+        return self.start.lat, self.start.long, self.finish.lat, self.finish.long
+
+
+def _csv_lane(row: dict[str, str]) -> dict[str, typing.Any]:
+    return {
+        "start": {"lat": row["start_lat"], "long": row["start_long"]},
+        "finish": {"lat": row["finish_lat"], "long": row["finish_long"]},
+    }
+
+
+def _jsonl_lane(line: str) -> dict[str, typing.Any] | None:
+    return json.loads(line) if line.strip() else None
+
+
+def read_lanes(path: str) -> list[Lane]:
+    """It reads lanes from CSV (columns "start_lat", "start_long", "finish_lat", "finish_long")
+    or JSON lines (objects with "start" and "finish" points as in `/routes` request), repeated lanes are left out.
+
+    Args:
+        path: file of lanes, ".csv" is read as CSV, anything else as JSON lines
+
+    Returns:
+        lanes in the order of the file
+    """
+    is_csv: bool = os.path.splitext(path)[1].lower() == ".csv"
+    parse: typing.Callable[[typing.Any], dict[str, typing.Any] | None] = _csv_lane if is_csv else _jsonl_lane
+    lanes: dict[tuple[float, float, float, float], Lane] = {}
+    with open(path, newline="", encoding="utf8") as file:
+        for number, row in enumerate(csv.DictReader(file) if is_csv else file, start=1):
+            try:
+                lane: dict[str, typing.Any] | None = parse(row)
+                if lane is not None:
+                    found: Lane = Lane(Point(**lane["start"]), Point(**lane["finish"]))
+                    lanes.setdefault(found.key, found)
+            except (KeyError, TypeError, ValueError) as exc:
+                raise ValueError(f"Invalid lane {number} in {path}: {exc}")
+    return list(lanes.values())
+
+
+class RateLimit:
+    """Token bucket - `rate` tokens per second, up to `burst` tokens are saved for later.
+    Callers reserve their token in order and wait until it is available.
+
+    Args:
+        rate: tokens per second (0 = unlimited)
+        burst: max. number of saved tokens
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens: float = float(self.burst)
+        self._updated: float = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now: float = time.monotonic()
+            self._tokens = min(float(self.burst), self._tokens + (now - self._updated) * self.rate) - 1.0
+            self._updated = now
+            wait: float = -self._tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+@dataclass
+class WarmupStats:
+    lanes: int = 0
+    counts: dict[str, int] = field(default_factory=lambda: {CACHED: 0, FETCHED: 0, FAILED: 0, SKIPPED: 0})
+    maps: int = 0
+    started: float = field(default_factory=time.monotonic)
+
+    @property
+    def done(self) -> int:
+        return sum(self.counts.values())
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def __str__(self):
+        elapsed: float = max(self.elapsed, 1e-9)
+        return (
+            f"{self.done}/{self.lanes} lanes ({', '.join(f'{count} {name}' for name, count in self.counts.items())}, "
+            f"{self.maps} maps) in {self.elapsed:.1f} s - {self.done / elapsed:.1f} lanes/s, "
+            f"{self.counts[FETCHED] / elapsed:.2f} ORS calls/s"
+        )
+
+
+class RouteWarmup:
+    """Warm-up of hot lanes - routes of the lanes are found and put into the directions cache
+    (and maps of them are rendered into map artifacts), so the first requests of the lanes do not wait for ORS.
+    Lanes found in the cache already are not requested again, so interrupted warm-up is resumed by running it again.
+    Its ORS calls have the lowest priority in the quota of ORS calls (see `QuotaScheduler`).
+    The lanes are also warmed up by server process at its startup and then periodically, if they are configured
+    and `scheduled` is on. Only one process of the host warms them up - the one which holds the lock file,
+    the others try to take it over at every interval (e.g. when the holding worker is restarted).
+
+    Args:
+        lanes: file of the lanes (see `read_lanes`)
+        interval: seconds between two periodic warm-ups (0 = only at startup)
+        scheduled: lanes are warmed up by server process (off = only by `warm_up` command, e.g. run by cron)
+        lock: lock file of the scheduled warm-up (the same for all processes)
+        rate: max. ORS calls per second
+        burst: max. ORS calls at once
+        concurrency: number of lanes warmed up at once
+        maps: maps of the routes are rendered too
+        title: title of the maps (the same as `/routes` renders)
+        route_title: tooltip of the routes
+        filename: filename of the maps
+    """
+
+    def __init__(
+        self,
+        lanes: str | None = None,
+        interval: int = 0,
+        scheduled: bool = True,
+        lock: str | None = None,
+        rate: float = 0.5,
+        burst: int = 1,
+        concurrency: int = 4,
+        maps: bool = True,
+        title: str = "Found routes",
+        route_title: str = "Driving path",
+        filename: str = "found_route.html",
+    ):
+        self.lanes = lanes
+        self.interval = interval
+        self.scheduled = scheduled
+        self.lock = lock or os.path.join(tempfile.gettempdir(), "route_planner_warmup.lock")
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.maps = maps
+        self.title = title
+        self.route_title = route_title
+        self.filename = filename
+        self._stop = threading.Event()
+        self._scheduler: threading.Thread | None = None
+        self._lock_fd: int | None = None
+
+    def run(
+        self, lanes: list[Lane], progress: typing.Callable[[WarmupStats], None] | None = None, **options: typing.Any
+    ) -> WarmupStats:
+        """It warms up the lanes.
+
+        Args:
+            lanes: lanes to warm up
+            progress: it is called after every lane
+            options: options of this run instead of the configured ones (see the class)
+
+        Returns:
+            statistics of the warm-up
+        """
+        options = {name: options.get(name, getattr(self, name)) for name in ("rate", "burst", "concurrency", "maps")}
+        limit = RateLimit(options["rate"], options["burst"])
+        stats = WarmupStats(lanes=len(lanes))
+        lock = threading.Lock()
+
+        def warm(lane: Lane):
+            status, rendered = (SKIPPED, 0) if self._stop.is_set() else self.warm(lane, limit, options["maps"])
+            with lock:
+                stats.counts[status] += 1
+                stats.maps += rendered
+                if progress is not None:
+                    progress(stats)
+
+        executor = ThreadPoolExecutor(max(options["concurrency"], 1), thread_name_prefix="route-warmup")
+        try:
+            # results are not needed, exceptions of lanes are handled in `warm`
+            list(executor.map(warm, lanes))
+        finally:
+            # interrupted warm-up does not start the other lanes
+            executor.shutdown(cancel_futures=True)
+        return stats
+
+    def warm(self, lane: Lane, limit: RateLimit, maps: bool) -> tuple[str, int]:
+        """It warms up one lane.
+
+        Returns:
+            status of the lane and number of its maps (rendered or stored already)
+        """
+        try:
+            with ors_priority(WARMUP):
+                routes, status = self.find_routes(lane, limit)
+            if maps:
+                RoutePlannerService.routes_map(routes, self.title, self.route_title, self.filename)
+        except ORSException as exc:
+            logger.warning("Lane %s -> %s is not warmed up: %s %s", lane.start, lane.finish, exc.status, exc.data)
+            return FAILED, 0
+        except Exception:
+            # e.g. ORS timeout, the other lanes are warmed up anyway
+            logger.exception("Lane %s -> %s is not warmed up.", lane.start, lane.finish)
+            return FAILED, 0
+        return status, int(maps)
+
+    @staticmethod
+    def find_routes(lane: Lane, limit: RateLimit) -> tuple[Routes, str]:
+        """It returns routes of the lane, ORS is called (within the rate limit) only if they are not cached."""
+        start, finish = snap(lane.start, lane.finish)
+        routes: Routes | None = directions_cache.get(directions_cache.key(routing_backend.profile, start, finish))
+        if routes is not None:
+            return routes, CACHED
+        limit.acquire()
+        return find_routes(lane.start, lane.finish), FETCHED
+
+    def start(self):
+        """It starts periodic warm-up of configured lanes in background thread of the server process."""
+        if not (self.lanes and self.scheduled) or self._scheduler is not None:
+            return
+        self._stop.clear()
+        self._scheduler = threading.Thread(target=self._warm_forever, name="route-warmup-scheduler", daemon=True)
+        self._scheduler.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def holds_lock(self) -> bool:
+        """It takes the lock file without waiting, the lock is held until the process exits."""
+        if self._lock_fd is None:
+            fd: int = os.open(self.lock, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return False
+            self._lock_fd = fd
+        return True
+
+    def _warm_once(self):
+        if not self.holds_lock():
+            logger.debug("Lanes in %s are warmed up by another process.", self.lanes)
+            return
+        logger.info("Warm-up of lanes in %s finished: %s", self.lanes, self.run(read_lanes(self.lanes)))
+
+    def _warm_forever(self):
+        while not self._stop.is_set():
+            try:
+                self._warm_once()
+            except Exception:
+                logger.exception("Warm-up of lanes in %s failed.", self.lanes)
+            if not self.interval or self._stop.wait(self.interval):
+                return
+
+
+route_warmup = RouteWarmup(**settings.ROUTE_WARMUP)
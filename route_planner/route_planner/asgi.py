@@ -1,4 +1,5 @@
 import os
+from contextlib import asynccontextmanager
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.middleware import SlowAPIMiddleware
 from slowapi.util import get_remote_address
@@ -21,11 +22,26 @@ django.setup()
 
 from django.conf import settings  # noqa: E402
 from api.fastapi_views import router  # noqa: E402
+from api.ors import aors_client  # noqa: E402
+from api.jobs import map_jobs  # noqa: E402
+from api.upstream import UpstreamCallsASGIMiddleware  # noqa: E402
+from api.warmup import route_warmup  # noqa: E402
 
 
 limiter = Limiter(key_func=get_remote_address, default_limits=settings.FASTAPI_THROTTLING)
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # hot lanes are warmed up in background thread of one server process (if they are configured)
+    route_warmup.start()
+    yield
+    route_warmup.stop()
+    # pooled keep-alive connections to ORS
+    await aors_client.aclose()
+    map_jobs.shutdown()
+
+
 app = FastAPI(
     title="Route Planner Rigorously Async",
     version="v3",
@@ -35,10 +51,12 @@ app = FastAPI(
     ),
     docs_url="/fastapi/v3/docs",
     openapi_url="/fastapi/v3/openapi.json",
+    lifespan=lifespan,
 )
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 app.add_middleware(SlowAPIMiddleware)
+app.add_middleware(UpstreamCallsASGIMiddleware)
 
 app.include_router(router, prefix="/fastapi/v3", tags=["Routes"])
 
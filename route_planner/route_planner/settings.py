@@ -11,15 +11,18 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
 import os
+import tempfile
+import typing
 from dotenv import load_dotenv
 from pathlib import Path
-from django.forms.fields import BooleanField, IntegerField
+from django.forms.fields import BooleanField, FloatField, IntegerField
 
 import django_stubs_ext
 
 django_stubs_ext.monkeypatch()
 bool_val = BooleanField()
 int_val = IntegerField()
+float_val = FloatField()
 
 
 # it loads environment variables from `.env` file
@@ -65,6 +68,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "api.upstream.UpstreamCallsMiddleware",
 ]
 
 ROOT_URLCONF = "route_planner.urls"
@@ -168,12 +172,194 @@ REST_FRAMEWORK = {
 
 FASTAPI_THROTTLING = [f'{int_val.to_python(os.getenv("THROTTLE_RATES_IP_MIN"))}/minute']
 
-ROUTE = {
+ROUTE: dict[str, typing.Any] = {
     "api_key": os.getenv("OPENROUTESERVICE_API_KEY"),
     "profile": os.getenv("OPENROUTESERVICE_PROFILE", "driving-hgv"),
-    "timeout": 5,
-    "retry_timeout": 20,
+    "timeout": float_val.to_python(os.getenv("OPENROUTESERVICE_TIMEOUT", "5")),
+    "retry_timeout": float_val.to_python(os.getenv("OPENROUTESERVICE_RETRY_TIMEOUT", "20")),
+    # keep-alive connections to ORS kept by async client (FastAPI)
+    "max_connections": int_val.to_python(os.getenv("OPENROUTESERVICE_MAX_CONNECTIONS", "100")),
+}
+
+# ORS calls - concurrent calls are limited between "min_concurrency" and "max_concurrency" (the limit decreases
+# when calls fail or they are slower than "latency_target" seconds), calls over the limit wait max. "queue_timeout"
+# seconds for a free slot (e.g. while batches fan out) and then they fail,
+# "failure_threshold" consecutive failures suspend calls for "reset_timeout" seconds (circuit breaker),
+# with "hedge" on, directions not answered within "hedge_percentile" of recent latencies are requested once more
+ROUTE_RESILIENCE: dict[str, typing.Any] = {
+    "concurrency": int_val.to_python(os.getenv("OPENROUTESERVICE_CONCURRENCY", "10")),
+    "min_concurrency": int_val.to_python(os.getenv("OPENROUTESERVICE_MIN_CONCURRENCY", "2")),
+    "max_concurrency": int_val.to_python(os.getenv("OPENROUTESERVICE_MAX_CONCURRENCY", "100")),
+    "latency_target": float_val.to_python(os.getenv("OPENROUTESERVICE_LATENCY_TARGET", "2.5")),
+    "queue_timeout": float_val.to_python(os.getenv("OPENROUTESERVICE_QUEUE_TIMEOUT", "2.5")),
+    "failure_threshold": int_val.to_python(os.getenv("OPENROUTESERVICE_FAILURE_THRESHOLD", "5")),
+    "reset_timeout": float_val.to_python(os.getenv("OPENROUTESERVICE_RESET_TIMEOUT", "30")),
+    "hedge": bool_val.to_python(os.getenv("OPENROUTESERVICE_HEDGE", "0")),
+    "hedge_percentile": float_val.to_python(os.getenv("OPENROUTESERVICE_HEDGE_PERCENTILE", "95")),
+    "hedge_min_delay": float_val.to_python(os.getenv("OPENROUTESERVICE_HEDGE_MIN_DELAY", "0.05")),
+}
+
+# quota of the ORS API key - all processes of the host share token bucket of "rate" calls per second (0 = unlimited)
+# and "burst" calls at once kept in "file", calls wait for their token max. "max_wait" seconds by priority
+# (interactive requests, batches, warm-up), calls of lower priority wait while calls of higher priority are waiting
+ROUTE_QUOTA: dict[str, typing.Any] = {
+    "rate": float_val.to_python(os.getenv("OPENROUTESERVICE_QUOTA_RATE", "0")),
+    "burst": int_val.to_python(os.getenv("OPENROUTESERVICE_QUOTA_BURST", "5")),
+    "path": os.getenv("OPENROUTESERVICE_QUOTA_FILE"),
+    "max_wait": (
+        float_val.to_python(os.getenv("OPENROUTESERVICE_QUOTA_MAX_WAIT", "2")),
+        float_val.to_python(os.getenv("OPENROUTESERVICE_QUOTA_BATCH_MAX_WAIT", "30")),
+        float_val.to_python(os.getenv("OPENROUTESERVICE_QUOTA_WARMUP_MAX_WAIT", "300")),
+    ),
+}
+
+# routes are found by hosted ORS ("ors") or in-process over road graph in "graph_dir" ("local"),
+# see `build_road_graph` command, start and finish are snapped to the nearest node within "snap_distance" meters
+ROUTE_BACKEND: dict[str, typing.Any] = {
+    "name": os.getenv("ROUTE_BACKEND", "ors"),
+    "options": {
+        "graph_dir": os.getenv("ROUTE_GRAPH_DIR"),
+        "snap_distance": int_val.to_python(os.getenv("ROUTE_GRAPH_SNAP_DISTANCE", "350")),
+    },
+}
+
+# start and finish are snapped to the nearest node of road graph in "graph_dir" before any routing backend
+# is called, points farther than "max_distance" meters are rejected without ORS call
+ROUTE_SNAP: dict[str, typing.Any] = {
+    "enabled": bool_val.to_python(os.getenv("ROUTE_SNAP_ENABLED", "0")),
+    "graph_dir": os.getenv("ROUTE_SNAP_GRAPH_DIR", os.getenv("ROUTE_GRAPH_DIR")),
+    "max_distance": int_val.to_python(os.getenv("ROUTE_SNAP_DISTANCE", "350")),
+}
+
+# number of ORS calls made by request is sent in "header" (hedged requests in "hedged_header", they are not counted
+# in "header"), handlers declare their budget of ORS calls (without hedged requests), exceeded budget is logged
+# or it raises exception if "strict_budget" is on (e.g. in tests)
+ROUTE_UPSTREAM: dict[str, typing.Any] = {
+    "header": "X-Upstream-Calls",
+    "hedged_header": "X-Upstream-Hedged-Calls",
+    "strict_budget": bool_val.to_python(os.getenv("ROUTE_UPSTREAM_STRICT_BUDGET", "0")),
+}
+
+# batch of routes - max. number of start/finish pairs in one request and number of concurrent ORS calls
+ROUTE_BATCH: dict[str, typing.Any] = {
+    "max_pairs": int_val.to_python(os.getenv("ROUTE_BATCH_MAX_PAIRS", "1000")),
+    "concurrency": int_val.to_python(os.getenv("ROUTE_BATCH_CONCURRENCY", "8")),
+}
+
+# distance/duration matrices - max. number of sources (and destinations), the matrix is split into tiles
+# of at most "tile_size" x "tile_size" cells (ORS limit of one matrix call), up to "concurrency" tiles are
+# requested at once, cells are cached (in-process LRU of "cache_entries" cells and ROUTE_CACHE backend)
+ROUTE_MATRIX: dict[str, typing.Any] = {
+    "max_locations": int_val.to_python(os.getenv("ROUTE_MATRIX_MAX_LOCATIONS", "500")),
+    "tile_size": int_val.to_python(os.getenv("ROUTE_MATRIX_TILE_SIZE", "50")),
+    "concurrency": int_val.to_python(os.getenv("ROUTE_MATRIX_CONCURRENCY", "4")),
+    "cache_entries": int_val.to_python(os.getenv("ROUTE_MATRIX_CACHE_ENTRIES", "100000")),
+}
+
+# multi-stop tours - max. number of stops, seconds of improving the order of stops (in MAP_JOBS pool)
+ROUTE_OPTIMIZE: dict[str, typing.Any] = {
+    "max_stops": int_val.to_python(os.getenv("ROUTE_OPTIMIZE_MAX_STOPS", "50")),
+    "time_budget": int_val.to_python(os.getenv("ROUTE_OPTIMIZE_TIME_BUDGET_MS", "1000")) / 1000,
+}
+
+# points near the route (`/corridor`) - max. number of points and max. meters from the route
+ROUTE_CORRIDOR: dict[str, typing.Any] = {
+    "max_points": int_val.to_python(os.getenv("ROUTE_CORRIDOR_MAX_POINTS", "10000")),
+    "max_distance": int_val.to_python(os.getenv("ROUTE_CORRIDOR_MAX_DISTANCE", "50000")),
+}
+
+# fuel stops - CSV of stations ("name", "lat", "long", "price" per gallon columns) loaded at startup,
+# stations within "corridor" meters of the route are considered, vehicle has "vehicle_range" miles on full tank
+FUEL: dict[str, typing.Any] = {
+    "stations": os.getenv("FUEL_STATIONS_CSV"),
+    "corridor": int_val.to_python(os.getenv("FUEL_CORRIDOR", "1600")),
+    "vehicle_range": float_val.to_python(os.getenv("FUEL_VEHICLE_RANGE", "500")),
+    "mpg": float_val.to_python(os.getenv("FUEL_MPG", "10")),
+}
+
+# Found routes are cached in-process (LRU), optionally also in Django cache given by "backend" alias,
+# coordinates are rounded to "precision" decimal places to build cache keys (5 places ~ 1 meter),
+# expired routes are kept "stale_ttl" more seconds (a day by default, 0 turns it off) and they are served when ORS
+# fails - the route is stored twice then (fresh and stale entry), in-process LRU keeps "max_entries" of both
+ROUTE_CACHE: dict[str, typing.Any] = {
+    "enabled": bool_val.to_python(os.getenv("ROUTE_CACHE_ENABLED", "1")),
+    "precision": int_val.to_python(os.getenv("ROUTE_CACHE_PRECISION", "5")),
+    "ttl": int_val.to_python(os.getenv("ROUTE_CACHE_TTL", "3600")),
+    "max_entries": int_val.to_python(os.getenv("ROUTE_CACHE_MAX_ENTRIES", "1024")),
+    "stale_ttl": int_val.to_python(os.getenv("ROUTE_CACHE_STALE_TTL", "86400")),
+    "backend": "routes" if os.getenv("ROUTE_CACHE_DIR") else None,
+}
+
+CACHES: dict[str, dict[str, typing.Any]] = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+}
+if ROUTE_CACHE["backend"]:
+    CACHES[ROUTE_CACHE["backend"]] = {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.getenv("ROUTE_CACHE_DIR"),
+        "TIMEOUT": ROUTE_CACHE["ttl"],
+        "OPTIONS": {"MAX_ENTRIES": int_val.to_python(os.getenv("ROUTE_CACHE_DIR_MAX_ENTRIES", "100000"))},
+    }
+
+# hot lanes (CSV or JSON lines file of start/finish, see `warm_up` command) are warmed up by server process
+# at its startup and then every "interval" seconds (0 = only at startup), ORS is called max. "rate" times per second
+# ("burst" at once) by "concurrency" threads, maps of the routes are rendered too if "maps" is on,
+# only the process holding "lock" file warms them up; turn "scheduled" off to warm them up only by `warm_up` command
+# (e.g. by cron) - rendering of maps is CPU bound, so it blocks gevent worker while it runs in the server
+ROUTE_WARMUP: dict[str, typing.Any] = {
+    "lanes": os.getenv("ROUTE_WARMUP_LANES"),
+    "interval": int_val.to_python(os.getenv("ROUTE_WARMUP_INTERVAL", "0")),
+    "scheduled": bool_val.to_python(os.getenv("ROUTE_WARMUP_SCHEDULED", "1")),
+    "lock": os.getenv("ROUTE_WARMUP_LOCK_FILE"),
+    "rate": float_val.to_python(os.getenv("ROUTE_WARMUP_RATE", "0.5")),
+    "burst": int_val.to_python(os.getenv("ROUTE_WARMUP_BURST", "1")),
+    "concurrency": int_val.to_python(os.getenv("ROUTE_WARMUP_CONCURRENCY", "4")),
+    "maps": bool_val.to_python(os.getenv("ROUTE_WARMUP_MAPS", "1")),
 }
 
 MEDIA_ROOT = os.getenv("MEDIA_ROOT", Path("media"))
 MEDIA_URL = "/media/"
+
+# rendered maps are stored under hash of their content in "prefix" directory of media storage and reused,
+# maps older than "max_age" seconds and the oldest maps over "max_bytes" are deleted (0 = no limit)
+MAP_ARTIFACTS: dict[str, typing.Any] = {
+    "prefix": "maps",
+    "max_bytes": int_val.to_python(os.getenv("MAP_ARTIFACTS_MAX_MB", "1024")) * 1024 * 1024,
+    "max_age": int_val.to_python(os.getenv("MAP_ARTIFACTS_MAX_AGE", str(7 * 24 * 3600))),
+    "sweep_interval": int_val.to_python(os.getenv("MAP_ARTIFACTS_SWEEP_INTERVAL", "600")),
+}
+
+# maps composed of stored route layers (`/maps`) - max. number of routes added at once
+MAP_COMPOSITION: dict[str, typing.Any] = {
+    "max_layers": int_val.to_python(os.getenv("MAP_COMPOSITION_MAX_LAYERS", "20")),
+}
+
+# vector tiles of composed maps (`/maps/{id}/tiles`) - tile "extent" and "buffer" in tile coordinates,
+# tiles are served up to "max_zoom" (map overzooms them), "cache_size" routes are kept in memory of the process
+MAP_TILES: dict[str, typing.Any] = {
+    "extent": int_val.to_python(os.getenv("MAP_TILES_EXTENT", "4096")),
+    "buffer": int_val.to_python(os.getenv("MAP_TILES_BUFFER", "64")),
+    "max_zoom": int_val.to_python(os.getenv("MAP_TILES_MAX_ZOOM", "18")),
+    "cache_size": int_val.to_python(os.getenv("MAP_TILES_CACHE_SIZE", "64")),
+}
+
+# maps can be rendered off the request path by pool of "workers" processes, over "max_pending" jobs (per process)
+# new jobs are refused, state of jobs is kept "ttl" seconds in Django cache given by "backend" alias, it has to be
+# shared by all processes of the server (status of job can be asked from any worker), by default it is file based
+# cache in MAP_JOBS_DIR (temp. directory), status endpoint waits max. "max_wait" seconds
+MAP_JOBS: dict[str, typing.Any] = {
+    "workers": int_val.to_python(os.getenv("MAP_JOBS_WORKERS", "2")),
+    "max_pending": int_val.to_python(os.getenv("MAP_JOBS_MAX_PENDING", "100")),
+    "ttl": int_val.to_python(os.getenv("MAP_JOBS_TTL", "3600")),
+    "max_wait": int_val.to_python(os.getenv("MAP_JOBS_MAX_WAIT", "30")),
+    "backend": os.getenv("MAP_JOBS_CACHE", "map_jobs"),
+}
+if MAP_JOBS["backend"] == "map_jobs":
+    CACHES["map_jobs"] = {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.getenv("MAP_JOBS_DIR", os.path.join(tempfile.gettempdir(), "route_planner_map_jobs")),
+        "TIMEOUT": MAP_JOBS["ttl"],
+        "OPTIONS": {"MAX_ENTRIES": int_val.to_python(os.getenv("MAP_JOBS_DIR_MAX_ENTRIES", "100000"))},
+    }
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'route_planner.settings')
 
 application = get_wsgi_application()
+
+# hot lanes are warmed up in background thread of one server process (if they are configured)
+from api.warmup import route_warmup  # noqa: E402
+
+route_warmup.start()